@@ -0,0 +1,102 @@
+"""
+Measure peak memory of sending one large message to a local SMTP sink, with
+the message built in memory (EMAIL_STREAMING=false) and streamed from disk.
+
+    python -m benchmarks.bench_email --count 5 --size-mb 20
+
+Each mode runs in its own process, so peak RSS is comparable; the peak of
+Python allocations is taken with tracemalloc.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from .fakes import SMTPSink
+
+MODES = ("buffered", "streaming")
+
+def make_attachments(directory, count, size_mb):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"IMG_{i:04d}.jpg")
+        if not os.path.exists(path) or os.path.getsize(path) != size_mb * 1024 * 1024:
+            with open(path, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+        paths.append(path)
+    return paths
+
+def run_mode(mode, paths):
+    from clients.email_uploader import SMTPUploader
+
+    sink = SMTPSink().start()
+    try:
+        uploader = SMTPUploader(
+            host=sink.host, port=sink.port, sender="bench@localhost", password="",
+            recipient="frame@localhost", use_ssl=False, streaming=(mode == "streaming"),
+        )
+        tracemalloc.start()
+        started = time.monotonic()
+        sent = uploader.send_photos(paths)
+        elapsed = time.monotonic() - started
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        uploader.close()
+    finally:
+        sink.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    attachment_bytes = sum(os.path.getsize(p) for p in paths)
+    return {
+        "mode": mode,
+        "sent": sent,
+        "seconds": round(elapsed, 3),
+        "attachment_bytes": attachment_bytes,
+        "message_bytes": sink.bytes,
+        "traced_peak_bytes": traced_peak,
+        "traced_peak_ratio": round(traced_peak / attachment_bytes, 3),
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        "peak_rss_kb": rss // 1024 if sys.platform == "darwin" else rss,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=5, help="Attachments in the message")
+    parser.add_argument("--size-mb", type=int, default=20, help="Size of each attachment")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "aura_bench_email"))
+    parser.add_argument("--mode", choices=MODES, help="Run a single mode in this process")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("EMAIL_USE_SSL", "false")
+    paths = make_attachments(args.fixtures_dir, args.count, args.size_mb)
+    if args.mode:
+        result = run_mode(args.mode, paths)
+        print(json.dumps(result))
+        return result
+
+    results = {}
+    for mode in MODES:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_email", "--mode", mode, "--count", str(args.count),
+             "--size-mb", str(args.size_mb), "--fixtures-dir", args.fixtures_dir],
+            capture_output=True, text=True, check=True,
+        )
+        results[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+        r = results[mode]
+        print(f"{mode}: {r['attachment_bytes'] / 1e6:.0f} MB attached, peak Python allocations "
+              f"{r['traced_peak_bytes'] / 1e6:.1f} MB ({r['traced_peak_ratio']}x), peak RSS "
+              f"{r['peak_rss_kb'] / 1024:.0f} MB, {r['seconds']:.2f}s")
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    main()
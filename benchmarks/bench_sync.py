@@ -0,0 +1,344 @@
+"""
+Benchmark an end-to-end album sync offline, against a synthetic Photos library,
+a local SMTP sink and an in-memory Gist.
+
+    python -m benchmarks.bench_sync --albums Family=200,Trips=100 --output before.json
+
+Runs every album through `sync_photos_to_aura` twice (cold, then warm, when the
+albums are unchanged), then times `list_albums` and face sample thumbnails (cold and cached).
+Reports photos/sec, time to first upload, peak RSS, the peak size of the temp
+directory and Gist/SMTP round-trips, and writes them as JSON for comparing commits.
+Also profiles the import time of the scheduler and the web server in fresh
+interpreters, and times a dry-run plan in-process and through a warm sync worker.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .fakes import FakeGithub, FakePhotosDB, SMTPSink, install_fake_osxphotos
+
+def parse_albums(value):
+    albums = {}
+    for part in value.split(","):
+        title, _, size = part.partition("=")
+        albums[title.strip()] = int(size or 100)
+    return albums
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class DiskSampler:
+    """Polls the size of a directory tree in the background and keeps the peak."""
+
+    def __init__(self, path, interval=0.02):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, dir_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, dir_size(self.path))
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def configure_environment(args, work_dir, sink):
+    """Point every client at the fakes. Runs before any client module is imported."""
+    os.environ.update(
+        AURA_STATE_DIR=os.path.join(work_dir, "state"),
+        EXPORT_CACHE_DIR=os.path.join(work_dir, "export_cache"),
+        EXPORT_CACHE_MAX_BYTES=str(args.export_cache_bytes),
+        EMAIL_SMTP=sink.host,
+        EMAIL_PORT=str(sink.port),
+        EMAIL_USE_SSL="false",
+        EMAIL_SENDER="bench@localhost",
+        EMAIL_PASSWORD="",
+        AURA_FRAME_EMAIL="frame@localhost",
+        EMAIL_BATCH_WAIT=str(args.batch_wait),
+        SYNC_GIST_ID="bench",
+        PHOTOS_LIBRARY=os.path.join(work_dir, "library"),
+        # Fixtures are reused round-robin, so with dedupe on most photos are content duplicates
+        DEDUPE_ACROSS_ALBUMS="true" if args.dedupe else "false",
+    )
+    if args.frames > 1:
+        # Every album fans out to all frames; each photo is still exported and encoded once
+        extra = [f"frame{i}" for i in range(2, args.frames + 1)]
+        os.environ["FRAME_DESTINATIONS"] = ",".join(f"{name}={name}@localhost" for name in extra)
+        os.environ["ALBUM_DESTINATIONS"] = "*=" + "+".join(["default"] + extra)
+    if args.export_workers:
+        os.environ["EXPORT_WORKERS"] = str(args.export_workers)
+    if args.max_dimension is not None:
+        os.environ["FRAME_MAX_DIMENSION"] = str(args.max_dimension)
+    tmp_dir = os.path.join(work_dir, "tmp")
+    os.makedirs(tmp_dir)
+    tempfile.tempdir = tmp_dir
+    # Exports go to the scratch workspace; keep it where the disk sampler looks
+    os.environ["WORKSPACE_DIR"] = os.path.join(tmp_dir, "workspace")
+    if args.workspace_bytes is not None:
+        os.environ["WORKSPACE_MAX_BYTES"] = str(args.workspace_bytes)
+    return tmp_dir
+
+def set_log_level(level):
+    for name in list(logging.root.manager.loggerDict):
+        if name.split(".")[0] in ("clients", "server"):
+            logging.getLogger(name).setLevel(level)
+    # Modules imported later (most are, lazily) set up their loggers at INFO; drop anything below level there too
+    logging.disable(logging.getLevelName(level) - 1)
+
+def run_sync_pass(albums, github, sink):
+    """Sync every album once with one shared tracker, as a scheduled run does."""
+    from clients.sync_tracker import SyncTracker
+    from server.jobs import SyncResources, sync_photos_to_aura
+
+    reads, writes, messages = github.reads, github.writes, sink.messages
+    sink.first_message_at = None
+    started = time.monotonic()
+    resources = SyncResources(SyncTracker(github_client=github))
+    per_album = {}
+    try:
+        for album in albums:
+            album_started = time.monotonic()
+            result = sync_photos_to_aura(album, resources=resources)
+            elapsed = time.monotonic() - album_started
+            sent = getattr(result, "sent", 0)
+            per_album[album] = {
+                "success": bool(result),
+                "short_circuited": getattr(result, "short_circuited", False),
+                "sent": sent,
+                "deduplicated": getattr(result, "deduplicated", 0),
+                "seconds": round(elapsed, 3),
+                "photos_per_sec": round(sent / elapsed, 2) if elapsed else 0.0,
+            }
+    finally:
+        resources.close()
+    elapsed = time.monotonic() - started
+    sent = sum(a["sent"] for a in per_album.values())
+    first = sink.first_message_at
+    return {
+        "seconds": round(elapsed, 3),
+        "photos_sent": sent,
+        "photos_per_sec": round(sent / elapsed, 2) if elapsed else 0.0,
+        "time_to_first_upload": round(first - started, 3) if first else None,
+        "gist_reads": github.reads - reads,
+        "gist_writes": github.writes - writes,
+        "smtp_messages": sink.messages - messages,
+        "albums": per_album,
+    }
+
+def import_profile(module, top=10):
+    """Import module in a fresh interpreter with -X importtime; total seconds and the slowest imports."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path[1:]))
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=root, env=env, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    if out.returncode != 0:
+        return {"error": (out.stderr.strip().splitlines() or ["import failed"])[-1]}
+    # The module and its parent packages, leaving out interpreter startup (site, encodings)
+    total = sum(cumulative for name, _, cumulative in rows if module == name or module.startswith(name + "."))
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)[:top]
+    return {
+        "seconds": round(total / 1e6, 3),
+        "slowest": [{"module": name, "self_ms": round(self_us / 1000, 1), "cumulative_ms": round(cumulative / 1000, 1)}
+                    for name, self_us, cumulative in slowest],
+    }
+
+def time_worker(albums, github, work_dir):
+    """A dry-run plan with a fresh tracker in-process, then twice through a warm worker."""
+    from clients.planner import plan_sync
+    from clients.sync_tracker import SyncTracker
+    from clients.worker_client import WorkerClient
+    from server.worker import SyncWorker
+
+    def cold_plan():
+        tracker = SyncTracker(github_client=github)
+        try:
+            return plan_sync(albums, tracker, detail=0)
+        finally:
+            tracker.close()
+
+    _, cold_seconds = timed(cold_plan)
+    worker = SyncWorker(os.path.join(work_dir, "worker.sock"), tracker_factory=lambda: SyncTracker(github_client=github))
+    thread = threading.Thread(target=worker.serve, daemon=True)
+    thread.start()
+    client = WorkerClient(worker.path)
+    try:
+        deadline = time.monotonic() + 10
+        while client.ping() is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        _, first_seconds = timed(client.call, "plan", albums=albums, detail=0)
+        _, warm_seconds = timed(client.call, "plan", albums=albums, detail=0)
+    finally:
+        worker.shutdown()
+        thread.join()
+    return {"plan_in_process_seconds": cold_seconds, "plan_worker_first_seconds": first_seconds,
+            "plan_worker_warm_seconds": warm_seconds}
+
+def timed(func, *args, **kwargs):
+    started = time.monotonic()
+    value = func(*args, **kwargs)
+    return value, round(time.monotonic() - started, 3)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--albums", type=parse_albums, default=parse_albums("Family=200,Trips=100"),
+                        help="Comma-separated TITLE=SIZE pairs (default: Family=200,Trips=100)")
+    parser.add_argument("--persons", type=int, default=10, help="Named people tagged across the library")
+    parser.add_argument("--fixtures", type=int, default=8, help="Distinct JPEG fixtures, reused round-robin")
+    parser.add_argument("--size", default="4032x3024", help="Fixture size WxH (default: 12MP)")
+    parser.add_argument("--export-latency", type=float, default=0.02, help="Seconds per simulated export")
+    parser.add_argument("--icloud-every", type=int, default=10, help="Every Nth photo is iCloud-only (0: none)")
+    parser.add_argument("--icloud-latency", type=float, default=0.2, help="Extra seconds to 'download' one")
+    parser.add_argument("--export-workers", type=int, default=None)
+    parser.add_argument("--export-cache-bytes", type=int, default=0, help="Export cache budget (default: disabled)")
+    parser.add_argument("--max-dimension", type=int, default=None, help="FRAME_MAX_DIMENSION for the run")
+    parser.add_argument("--batch-wait", type=float, default=10)
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Skip content duplicates (most photos, since fixtures are reused)")
+    parser.add_argument("--frames", type=int, default=1, help="Frames every album is sent to")
+    parser.add_argument("--workspace-bytes", type=int, default=None, help="WORKSPACE_MAX_BYTES for the run")
+    parser.add_argument("--samples", type=int, default=10, help="Photos per person for the faces benchmark")
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "aura_bench_fixtures"))
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args(argv)
+
+    from .fixtures import make_fixtures
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    fixtures = make_fixtures(os.path.join(args.fixtures_dir, args.size), args.fixtures, width, height)
+
+    work_dir = tempfile.mkdtemp(prefix="aura_bench_sync_")
+    sink = SMTPSink().start()
+    try:
+        tmp_dir = configure_environment(args, work_dir, sink)
+        install_fake_osxphotos(args.export_latency, args.icloud_latency)
+        db = FakePhotosDB(fixtures, args.albums, persons=args.persons, icloud_every=args.icloud_every)
+        github = FakeGithub()
+
+        from clients.apple_photos import list_albums, list_persons, person_photos
+        from clients.library import LibrarySnapshotManager, set_library_manager
+        from clients.thumbnails import get_thumbnail_service
+        from clients.metrics import REGISTRY
+        from clients.workspace import get_workspace
+        set_log_level(args.log_level.upper())
+
+        manager = LibrarySnapshotManager(loader=lambda path: db)
+        set_library_manager(manager)
+        _, library_load = timed(manager.get)
+
+        with DiskSampler(tmp_dir) as disk:
+            cold = run_sync_pass(list(args.albums), github, sink)
+            warm = run_sync_pass(list(args.albums), github, sink)
+
+        from clients.album_catalog import get_album_catalog
+        albums, list_seconds = timed(list_albums)
+        # Counts are filled in on a background thread; time that separately
+        _, recount_seconds = timed(get_album_catalog().wait)
+        _, list_warm_seconds = timed(list_albums)
+        persons, persons_seconds = timed(list_persons)
+        sample_seconds = []
+        thumbnails = get_thumbnail_service()
+        for person in persons[:3]:
+            # What the faces page and the browser's thumbnail requests do
+            photos = person_photos(person["name"], limit=args.samples, photosdb=db)
+            with ThreadPoolExecutor(max_workers=len(photos) or 1) as browser:
+                thumbs, cold_seconds = timed(lambda: list(browser.map(thumbnails.get, photos)))
+                _, warm_seconds = timed(lambda: list(browser.map(thumbnails.get, photos)))
+            sample_seconds.append({"person": person["name"], "photos": len([t for t in thumbs if t]),
+                                   "seconds": cold_seconds, "warm_seconds": warm_seconds})
+
+        worker = time_worker(list(args.albums), github, work_dir)
+        imports = {module: import_profile(module) for module in ("scheduler", "server.main")}
+
+        result = {
+            "commit": git_commit(),
+            "config": {
+                "albums": args.albums,
+                "photos": sum(args.albums.values()),
+                "fixture_size": args.size,
+                "export_latency": args.export_latency,
+                "icloud_every": args.icloud_every,
+                "icloud_latency": args.icloud_latency,
+                "export_workers": int(os.environ.get("EXPORT_WORKERS", 0)) or None,
+                "export_cache_bytes": args.export_cache_bytes,
+                "max_dimension": args.max_dimension,
+                "dedupe": args.dedupe,
+                "frames": args.frames,
+                "workspace_bytes": args.workspace_bytes,
+            },
+            "library_load_seconds": library_load,
+            "sync_cold": cold,
+            "sync_warm": warm,
+            "list_albums": {
+                "albums": len(albums),
+                "seconds": list_seconds,
+                "recount_seconds": recount_seconds,
+                "warm_seconds": list_warm_seconds,
+            },
+            "list_persons": {"persons": len(persons), "seconds": persons_seconds},
+            "person_samples": sample_seconds,
+            "import_time": imports,
+            "worker": worker,
+            "peak_rss_kb": peak_rss_kb(),
+            "temp_disk_peak_bytes": disk.peak,
+            "workspace": get_workspace().stats(),
+            "gist": github.stats(),
+            "smtp": sink.stats(),
+            "metrics": REGISTRY.summary(),
+        }
+    finally:
+        sink.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Synced {cold['photos_sent']} photos in {cold['seconds']:.2f}s "
+          f"({cold['photos_per_sec']:.1f} photos/s, first upload after {cold['time_to_first_upload']}s); "
+          f"unchanged re-run took {warm['seconds']:.2f}s")
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark the frame resize/recompress stage on synthetic JPEG/PNG fixtures.
+
+    python -m benchmarks.bench_transform --count 12 --size 8064x6048 --workers 4
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from clients.frame_transform import FrameTransformer
+from .fixtures import make_fixtures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=12)
+    parser.add_argument("--size", default="8064x6048", help="Fixture size WxH (default: 48MP)")
+    parser.add_argument("--png-every", type=int, default=4, help="Make every Nth fixture a PNG (0: none)")
+    parser.add_argument("--max-dimension", type=int, default=2560)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--strip-metadata", action="store_true")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "aura_bench_fixtures"))
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    fixtures = make_fixtures(os.path.join(args.fixtures_dir, args.size), args.count, width, height, args.png_every)
+    work_dir = tempfile.mkdtemp(prefix="aura_bench_transform_")
+    items = []
+    for i, path in enumerate(fixtures):
+        photo_dir = os.path.join(work_dir, str(i))
+        os.makedirs(photo_dir)
+        items.append((str(i), [shutil.copy(path, photo_dir)]))
+
+    transformer = FrameTransformer(args.max_dimension, args.quality, args.strip_metadata, args.workers)
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            list(pool.map(transformer.transform, items))
+    finally:
+        transformer.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    elapsed = time.monotonic() - started
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    result = dict(
+        transformer.stats(),
+        seconds=round(elapsed, 3),
+        photos_per_sec=round(len(items) / elapsed, 3),
+        workers=args.workers,
+        peak_worker_rss_kb=children,
+    )
+    print(f"Resized {transformer.format_stats()} in {elapsed:.2f}s")
+    print(json.dumps(result, indent=2))
+    return result
+
+if __name__ == "__main__":
+    main()
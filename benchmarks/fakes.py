@@ -0,0 +1,260 @@
+"""
+In-process stand-ins for the services a sync talks to, so it can be benchmarked
+without a Mac: a synthetic Photos library (plus an `osxphotos` shim that exports
+from it), an SMTP sink and a fake of the Gist API used by SyncTracker.
+"""
+import json
+import os
+import random
+import shutil
+import socketserver
+import sys
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+class FakePhoto:
+    """The PhotoInfo attributes the clients read."""
+
+    def __init__(self, uuid, path, date, persons, incloud=False):
+        self.uuid = uuid
+        self.path = path
+        self.path_edited = None
+        self.path_original = path
+        self.filename = os.path.basename(path)
+        self.original_filename = self.filename
+        self.date = date
+        self.date_modified = None
+        self.persons = persons
+        self.incloud = incloud
+        self.ismissing = False
+        self.hasadjustments = False
+
+class FakeAlbum:
+    def __init__(self, title, photos):
+        self.title = title
+        self.uuid = f"album-{title}"
+        self.photos = photos
+        self.smart = False
+
+class FakePhotosDB:
+    """
+    A synthetic library: `album_sizes` photos per album, drawn round-robin from
+    the fixture files, each tagged with up to two of `persons` names.
+    Every `icloud_every`-th photo is marked as stored in iCloud only.
+    """
+
+    def __init__(self, fixtures: List[str], album_sizes: Dict[str, int], persons: int = 10,
+                 icloud_every: int = 0, seed: int = 0):
+        rng = random.Random(seed)
+        names = [f"Person {i:02d}" for i in range(persons)]
+        start = datetime(2020, 1, 1)
+        self._photos: List[FakePhoto] = []
+        self.album_info: List[FakeAlbum] = []
+        self.albums: List[FakeAlbum] = []
+        for title, size in album_sizes.items():
+            members = []
+            for _ in range(size):
+                i = len(self._photos)
+                tagged = rng.sample(names, k=min(len(names), rng.randint(0, 2)))
+                photo = FakePhoto(
+                    f"{i:08d}-bench-{rng.getrandbits(64):016x}",
+                    fixtures[i % len(fixtures)],
+                    start + timedelta(hours=i),
+                    tagged,
+                    incloud=bool(icloud_every) and i % icloud_every == icloud_every - 1,
+                )
+                self._photos.append(photo)
+                members.append(photo)
+            self.album_info.append(FakeAlbum(title, members))
+
+    def photos(self, uuid=None, **kwargs):
+        if uuid is None:
+            return list(self._photos)
+        wanted = set(uuid)
+        return [p for p in self._photos if p.uuid in wanted]
+
+class _ExportResults:
+    def __init__(self, exported):
+        self.exported = exported
+        self.error = []
+        self.missing = []
+        self.skipped = []
+
+def install_fake_osxphotos(export_latency: float = 0.0, icloud_latency: float = 0.0):
+    """
+    Register an `osxphotos` module whose PhotoExporter copies the fixture file,
+    sleeping export_latency per photo (plus icloud_latency for iCloud-only photos)
+    to stand in for HEIC conversion and downloads. Must run before clients are imported.
+    """
+    module = types.ModuleType("osxphotos")
+
+    class ExportOptions:
+        def __init__(self):
+            self.convert_to_jpeg = False
+            self.download_missing = False
+
+    class QueryOptions:
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    class PhotoExporter:
+        def __init__(self, photo):
+            self.photo = photo
+
+        def export(self, dest_dir, options=None):
+            delay = export_latency + (icloud_latency if self.photo.incloud else 0.0)
+            if delay:
+                time.sleep(delay)
+            stem = os.path.splitext(self.photo.filename)[0]
+            dest = os.path.join(dest_dir, f"{stem}.jpeg")
+            shutil.copyfile(self.photo.path, dest)
+            return _ExportResults([dest])
+
+    def PhotosDB(*args, **kwargs):
+        raise RuntimeError("The benchmark library is installed with set_library_manager()")
+
+    module.ExportOptions = ExportOptions
+    module.QueryOptions = QueryOptions
+    module.PhotoExporter = PhotoExporter
+    module.PhotosDB = PhotosDB
+    utils = types.ModuleType("osxphotos.utils")
+    utils.get_last_library_path = lambda: None
+    utils.get_system_library_path = lambda: None
+    module.utils = utils
+    sys.modules["osxphotos"] = module
+    sys.modules["osxphotos.utils"] = utils
+    return module
+
+class _GistFile:
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.content = content
+        self.size = len(content.encode("utf-8"))
+        self.truncated = False
+        self.raw_url = None
+
+class FakeGist:
+    def __init__(self, github, gist_id, files):
+        self._github = github
+        self.id = gist_id
+        self.files = files
+
+    def edit(self, description=None, files=None):
+        with self._github._lock:
+            self._github.writes += 1
+            for name, value in (files or {}).items():
+                if value is None:
+                    self._github._files.pop(name, None)
+                    continue
+                # PyGithub's InputFileContent keeps its content private
+                identity = getattr(value, "_identity", None)
+                content = identity["content"] if identity else value.content
+                self._github.bytes_written += len(content.encode("utf-8"))
+                self._github._files[name] = content
+            self.files = self._github._gist_files()
+
+class FakeGithub:
+    """Holds one Gist in memory and counts the reads and writes made against it."""
+
+    def __init__(self, files: Optional[Dict[str, str]] = None):
+        self._files: Dict[str, str] = dict(files or {})
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.bytes_written = 0
+
+    def _gist_files(self):
+        return {name: _GistFile(name, content) for name, content in self._files.items()}
+
+    def get_gist(self, gist_id):
+        with self._lock:
+            self.reads += 1
+            return FakeGist(self, gist_id, self._gist_files())
+
+    def stats(self) -> dict:
+        return {"reads": self.reads, "writes": self.writes, "bytes_written": self.bytes_written}
+
+    def json_file(self, name="synced_photos.json") -> Optional[dict]:
+        content = self._files.get(name)
+        return json.loads(content) if content else None
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        sink = self.server.sink
+        sink._record("sessions")
+        self.reply("220 bench-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            sink._record("commands")
+            verb = line.split(b" ", 1)[0].strip().upper()
+            if verb == b"EHLO":
+                self.reply("250-bench-smtp")
+                self.reply("250 8BITMIME")
+            elif verb in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif verb == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                sink._received(size)
+                self.reply("250 OK queued")
+            elif verb == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class _ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SMTPSink:
+    """
+    A plain-SMTP server on localhost that accepts and discards every message,
+    recording sessions, commands, messages, bytes and when the first message arrived.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = _ThreadingSMTPServer((host, port), _SMTPHandler)
+        self.server.sink = self
+        self.host, self.port = self.server.server_address[:2]
+        self.sessions = 0
+        self.commands = 0
+        self.messages = 0
+        self.bytes = 0
+        self.first_message_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _received(self, size):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            if self.first_message_at is None:
+                self.first_message_at = time.monotonic()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        return {"sessions": self.sessions, "commands": self.commands, "messages": self.messages, "bytes": self.bytes}
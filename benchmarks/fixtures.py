@@ -0,0 +1,34 @@
+import os
+import random
+from PIL import Image, ImageDraw, ImageFilter
+
+def make_photo(path, width, height, seed=0):
+    """Write a photo-like test image (gradient, shapes and grain) to path; format from the extension."""
+    rng = random.Random(seed)
+    base = Image.linear_gradient("L").resize((width, height))
+    im = Image.merge("RGB", (base, base.rotate(90).resize((width, height)), base.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(width // 40, width // 6)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    im = im.filter(ImageFilter.GaussianBlur(2))
+    noise = Image.effect_noise((width, height), 24).convert("RGB")
+    im = Image.blend(im, noise, 0.15)
+    if path.lower().endswith(".png"):
+        im.save(path, "PNG")
+    else:
+        im.save(path, "JPEG", quality=95)
+    return path
+
+def make_fixtures(directory, count, width, height, png_every=0):
+    """Create `count` fixture images in directory and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        ext = ".png" if png_every and i % png_every == png_every - 1 else ".jpg"
+        path = os.path.join(directory, f"IMG_{i:04d}{ext}")
+        if not os.path.exists(path):
+            make_photo(path, width, height, seed=i)
+        paths.append(path)
+    return paths
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+from .library import LibrarySnapshot, get_library_manager
+from .logger import setup_logger
+from .state import state_path
+
+logger = setup_logger(__name__)
+
+CATALOG_VERSION = 1
+
+def _epoch(value) -> float:
+    try:
+        return value.timestamp() if value else 0.0
+    except (AttributeError, OverflowError, OSError, ValueError):
+        return 0.0
+
+def _sort_key(album: dict):
+    # Regular albums alphabetically first, then smart albums alphabetically
+    return album["type"] != "album", album["title"].lower()
+
+class AlbumCatalog:
+    """
+    Album metadata (uuid, title, type, photo count, last modified) for listing
+    albums without walking the library.
+
+    On a library change only the cheap album list (uuid, title, type) is
+    re-read; counts and modification dates are kept from the previous state,
+    marked stale, and recomputed album by album on a background thread
+    (stale-while-revalidate). The catalog is saved to disk, so a restart
+    serves the last known counts straight away. `etag` changes whenever
+    anything a listing shows changes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or state_path("album_catalog.json")
+        self.generation = 0
+        self.library_key = None
+        self._listing_hash = ""
+        # Counts updated since the listing was last hashed
+        self._updates = 0
+        # uuid -> {"uuid", "title", "type", "photo_count", "modified", "stale"}
+        self._albums: Dict[str, dict] = {}
+        self._sorted: List[dict] = []
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._pending: Optional[LibrarySnapshot] = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") != CATALOG_VERSION:
+                return
+            self._albums = {a["uuid"]: a for a in data["albums"]}
+            self.library_key = data.get("library_key")
+            self._reindex()
+            logger.info(f"Loaded album catalog: {len(self._albums)} albums")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable album catalog {self.path}: {e}")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CATALOG_VERSION, "library_key": self.library_key,
+                       "albums": list(self._albums.values())}, f)
+        os.replace(tmp_path, self.path)
+
+    def _reindex(self):
+        self._sorted = sorted(self._albums.values(), key=_sort_key)
+        listing = json.dumps(self._sorted, sort_keys=True, separators=(",", ":"))
+        self._listing_hash = hashlib.sha1(listing.encode("utf-8")).hexdigest()[:16]
+        self._updates = 0
+
+    @property
+    def etag(self) -> str:
+        return f"{self._listing_hash}.{self._updates}" if self._updates else self._listing_hash
+
+    @staticmethod
+    def _key_json(key):
+        # Snapshot keys are tuples; compare them the way they round-trip through JSON
+        return json.loads(json.dumps(key))
+
+    def update(self, snapshot: LibrarySnapshot):
+        """Bring the album list up to date with a snapshot and schedule a recount if it changed."""
+        with self._lock:
+            if snapshot.generation == self.generation:
+                return
+            self.generation = snapshot.generation
+            key = self._key_json(snapshot.key)
+            if key is not None and key == self.library_key and self._albums:
+                # Saved catalog already matches this library state
+                return
+            albums = {}
+            for album in snapshot.db.album_info:
+                try:
+                    album_uuid = str(getattr(album, "uuid", None) or album.title)
+                    previous = self._albums.get(album_uuid, {})
+                    albums[album_uuid] = {
+                        "uuid": album_uuid,
+                        "title": str(album.title),
+                        "type": "smart" if getattr(album, "smart", False) else "album",
+                        "photo_count": previous.get("photo_count"),
+                        "modified": previous.get("modified"),
+                        "stale": True,
+                    }
+                except Exception as e:
+                    logger.error(f"Error reading album {getattr(album, 'title', 'Unknown')}: {e}")
+            added = len(set(albums) - set(self._albums))
+            removed = len(set(self._albums) - set(albums))
+            self._albums = albums
+            self._reindex()
+            self._pending = snapshot
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(target=self._refresh_counts, name="album-catalog", daemon=True)
+                self._refresh_thread.start()
+        logger.info(f"Updated album catalog: {len(albums)} albums ({added} added, {removed} removed), recounting")
+
+    def _refresh_counts(self):
+        """Recount stale albums from the newest pending snapshot, restarting if another arrives."""
+        while True:
+            with self._lock:
+                snapshot, self._pending = self._pending, None
+                if snapshot is None:
+                    self._refresh_thread = None
+                    return
+            self._recount(snapshot)
+
+    def _recount(self, snapshot: LibrarySnapshot):
+        counted = 0
+        for album in snapshot.db.album_info:
+            if self._pending is not None:
+                # A newer snapshot arrived; start over from it
+                return
+            album_uuid = str(getattr(album, "uuid", None) or album.title)
+            try:
+                photos = album.photos or []
+                count = len(photos)
+                modified = max((_epoch(getattr(p, "date_modified", None) or getattr(p, "date", None))
+                                for p in photos), default=None)
+            except Exception as e:
+                logger.error(f"Error counting album {getattr(album, 'title', 'Unknown')}: {e}")
+                continue
+            with self._lock:
+                entry = self._albums.get(album_uuid)
+                if entry is not None:
+                    entry.update(photo_count=count, modified=modified, stale=False)
+                    self._updates += 1
+                    counted += 1
+        with self._lock:
+            if self._pending is not None or snapshot.generation != self.generation:
+                return
+            self.library_key = self._key_json(snapshot.key)
+            self._reindex()
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning(f"Could not save album catalog: {e}")
+        logger.info(f"Album catalog recounted {counted} albums")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a running recount; returns False if it is still going after timeout."""
+        thread = self._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def albums(self, query: Optional[str] = None) -> List[dict]:
+        """Albums in display order, optionally only those whose title contains query."""
+        with self._lock:
+            albums = self._sorted
+        if query:
+            needle = query.lower()
+            albums = [a for a in albums if needle in a["title"].lower()]
+        return [dict(a) for a in albums]
+
+    def page(self, query: Optional[str] = None, page: int = 1, per_page: int = 50) -> dict:
+        """One page of `albums(query)`, with the totals needed for paging."""
+        albums = self.albums(query)
+        per_page = max(1, per_page)
+        pages = max(1, -(-len(albums) // per_page))
+        page = min(max(1, page), pages)
+        return {
+            "albums": albums[(page - 1) * per_page:page * per_page],
+            "total": len(albums),
+            "page": page,
+            "pages": pages,
+            "per_page": per_page,
+            "query": query or "",
+            "stale": any(a["stale"] for a in albums),
+            "etag": self.etag,
+        }
+
+_catalog: Optional[AlbumCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_album_catalog() -> AlbumCatalog:
+    """Return the shared album catalog, updated to the current library snapshot."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = AlbumCatalog()
+    _catalog.update(get_library_manager().get())
+    return _catalog
@@ -1,15 +1,34 @@
-import osxphotos
-from osxphotos import PhotoExporter, ExportOptions, QueryOptions
-import tempfile
+import hashlib
+import json
 import os
+import shutil
+from dotenv import load_dotenv
 import random
 import traceback
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
+from .album_catalog import get_album_catalog
+from .destinations import record_name
+from .export_cache import DiskCache, get_export_cache, link_or_copy
+from .fingerprint import DEDUPE_ACROSS_ALBUMS, compute_fingerprint
+from .library import get_library_manager, get_photosdb
 from .logger import setup_logger
+from .metrics import BYTES_EXPORTED, EXPORT_FAILURES, EXPORT_SECONDS, PHOTOS_EXPORTED
+from .person_index import get_person_index
+from .pipeline import Pipeline, Stage
+from .workspace import get_workspace
 
+load_dotenv()
 logger = setup_logger(__name__)
 
+# Photos exported (HEIC->JPEG conversion, iCloud download) in parallel.
+# Threads rather than processes: PhotoInfo objects are tied to the open
+# PhotosDB and the heavy lifting happens outside the GIL.
+EXPORT_WORKERS = max(1, int(os.getenv("EXPORT_WORKERS", min(4, os.cpu_count() or 1))))
+# Order unsynced photos are sent in: "newest" or "oldest" first by date taken, or "album" order.
+# When the send quota runs out mid-album, the photos left for later are the end of this order.
+SYNC_ORDER = os.getenv("SYNC_ORDER", "newest").lower()
+
 def export_photo_as_jpeg(photo, dest_dir):
     """Helper function to export a single photo as JPEG using PhotoExporter."""
     try:
@@ -34,6 +53,9 @@ def export_photo_as_jpeg(photo, dest_dir):
                 exists = os.path.exists(path)
                 logger.debug(f"- {path} (exists: {exists})")
         
+        # Imported here: osxphotos is slow to import and most commands never export
+        from osxphotos import ExportOptions, PhotoExporter
+        
         logger.debug("Creating exporter for photo")
         exporter = PhotoExporter(photo)
         
@@ -101,175 +123,336 @@ def export_photo_as_jpeg(photo, dest_dir):
         logger.error(f"Traceback:\n{traceback.format_exc()}")
         return []
 
-def list_albums() -> List[dict]:
+def photo_cache_key(photo, output_format="jpeg") -> str:
+    """Export cache key: the photo plus whatever changes its rendered output."""
+    modified = getattr(photo, 'date_modified', None) or getattr(photo, 'date', None)
+    return DiskCache.make_key(
+        photo.uuid,
+        modified.isoformat() if modified else "",
+        bool(getattr(photo, 'hasadjustments', False)),
+        output_format,
+    )
+
+def export_photo(photo, dest_dir) -> List[str]:
+    """
+    Export a photo as JPEG into dest_dir, reusing the export cache when possible.
+    Cached files are hard-linked (or copied) into dest_dir, so callers may delete
+    what they get back without affecting the cache. In a full workspace the
+    export waits for room and may spill elsewhere; use the returned paths.
+    """
+    workspace = get_workspace()
+    dest_dir = workspace.place(dest_dir)
+    cache = get_export_cache()
+    if cache is None:
+        return workspace.track(_timed_export(photo, dest_dir))
+    key = photo_cache_key(photo)
+    cached = cache.get(key)
+    if cached is None:
+        staging_dir = cache.staging_dir()
+        try:
+            paths = _timed_export(photo, staging_dir)
+            if not paths:
+                return []
+            cached = cache.put(key, paths, extra={"uuid": photo.uuid})
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    else:
+        logger.debug(f"Export cache hit for {photo.uuid[:8]}...")
+        _count_export(cached, "cache")
+    return workspace.track([link_or_copy(path, dest_dir) for path in cached])
+
+def photo_fingerprint(photo, paths) -> dict:
     """
-    Return a list of album information from the Photos library.
-    Each album is represented as a dict with 'title', 'photo_count', and 'type'.
+    Content fingerprint of a photo's exported files. With the export cache on,
+    it is stored in the cache entry's meta.json and reused by later syncs.
+    """
+    cache = get_export_cache()
+    if cache is None:
+        return compute_fingerprint(paths)
+    key = photo_cache_key(photo)
+    meta = cache.get_meta(key) or {}
+    known = meta.get("fingerprint")
+    digests = [info["sha256"] for info in meta.get("files", [])]
+    fingerprint = compute_fingerprint(paths, digests=digests if len(digests) == len(paths) else None, known=known)
+    if meta and fingerprint != known:
+        cache.update_meta(key, fingerprint=fingerprint)
+    return fingerprint
+
+def _count_export(paths, source):
+    PHOTOS_EXPORTED.inc(source=source)
+    BYTES_EXPORTED.inc(sum(os.path.getsize(p) for p in paths if os.path.exists(p)), source=source)
+
+def _timed_export(photo, dest_dir) -> List[str]:
+    """export_photo_as_jpeg, recording its latency (separately for iCloud downloads) and output."""
+    icloud = "true" if getattr(photo, 'incloud', False) else "false"
+    with EXPORT_SECONDS.time(icloud=icloud):
+        paths = export_photo_as_jpeg(photo, dest_dir)
+    if paths:
+        _count_export(paths, "library")
+    else:
+        EXPORT_FAILURES.inc()
+    return paths
+
+def list_albums(query: Optional[str] = None) -> List[dict]:
+    """
+    Return album information from the album catalog, regular albums first.
+    Each album is a dict with 'uuid', 'title', 'type', 'photo_count' and
+    'modified'; counts are None (or stale) until the catalog has recounted.
     """
     try:
-        photosdb = osxphotos.PhotosDB()
-        albums_dict = {}  # Use dict to deduplicate albums
-        
-        # Debug: Print all available attributes and methods
-        logger.debug("Available PhotosDB attributes:")
-        for attr in dir(photosdb):
-            if not attr.startswith('_'):  # Skip private attributes
-                logger.debug(f"- {attr}")
-        
-        # Process regular albums
-        logger.info("Processing regular albums...")
-        for album in photosdb.album_info:
-            try:
-                photos = album.photos
-                title = str(album.title)
-                # Debug: Print album details
-                logger.debug(f"Album details for {title}:")
-                for attr in dir(album):
-                    if not attr.startswith('_'):
-                        try:
-                            value = getattr(album, attr)
-                            # logger.debug(f"- {attr}: {value}")
-                        except Exception as e:
-                            logger.error(f"- {attr}: Error accessing ({e})")
-                
-                # Use album UUID as key to prevent duplicates
-                album_uuid = getattr(album, 'uuid', title)
-                albums_dict[album_uuid] = {
-                    'title': title,
-                    'photo_count': len(photos) if photos else 0,
-                    'type': 'album' if not getattr(album, 'smart', False) else 'smart'
-                }
-                logger.info(f"Found album: {title} with {len(photos) if photos else 0} photos (UUID: {album_uuid})")
-            except Exception as e:
-                logger.error(f"Error processing album {getattr(album, 'title', 'Unknown')}: {e}")
-                continue
-        
-        # Convert dict to list and sort
-        albums = list(albums_dict.values())
-        # Sort: Regular albums alphabetically first, then smart albums alphabetically
-        albums.sort(key=lambda x: (x['type'] != 'album', x['title'].lower()))
-        
-        logger.info(f"Found {len(albums)} unique albums")
-        logger.info("Final album list:")
-        for album in albums:
-            logger.info(f"- {album['title']} ({album['type']}, {album['photo_count']} photos)")
-        
-        return albums
+        return get_album_catalog().albums(query)
     except Exception as e:
         logger.error(f"Error listing albums: {e}")
         return []
 
-def get_children_photos(face_names):
+def photos_by_uuid(uuids, photosdb=None):
+    """Look up photos by UUID (in the current library snapshot by default), keeping the order of uuids."""
+    if not uuids:
+        return []
+    photosdb = photosdb if photosdb is not None else get_photosdb()
+    found = {p.uuid: p for p in photosdb.photos(uuid=list(uuids))}
+    return [found[u] for u in uuids if u in found]
+
+def person_photos(person_name, limit=None, newest=True, photosdb=None):
+    """Photos of a person from the person index, newest first by default."""
+    return photos_by_uuid(get_person_index().uuids_for(person_name, limit=limit, newest=newest), photosdb)
+
+def get_children_photos(face_names, dest_dir=None):
     """
-    Exports only the first photo for given face names to a temp directory and returns exported file paths (for testing).
+    Exports only the first photo for given face names and returns exported file paths (for testing).
+    Without dest_dir, exports go to a new workspace directory; release it with
+    get_workspace().release() once done.
     """
-    photosdb = osxphotos.PhotosDB()
-    all_photos = photosdb.photos()
-    filtered_photos = [p for p in all_photos if any(name in (p.persons or []) for name in face_names)]
+    index = get_person_index()
+    uuids = [u for name in face_names for u in index.uuids_for(name, limit=1)]
+    filtered_photos = photos_by_uuid(uuids[:1])
     if not filtered_photos:
         return []
-    temp_dir = tempfile.mkdtemp(prefix="aura_photos_")
     # Only export the first matching photo
     photo = filtered_photos[0]
-    return export_photo_as_jpeg(photo, temp_dir)
+    return export_photo(photo, dest_dir or get_workspace().run_dir("aura_photos_"))
 
 def list_all_person_names():
-    photosdb = osxphotos.PhotosDB()
-    return photosdb.persons
+    return get_person_index().names()
 
-def get_sample_photos_for_person(person_name, max_samples=10):
-    photosdb = osxphotos.PhotosDB()
-    all_photos = photosdb.photos()
-    logger.info(f"get_sample_photos_for_person: Found {len(all_photos)} total photos in library")
-    filtered_photos = [p for p in all_photos if person_name in (p.persons or [])]
+def list_persons() -> List[dict]:
+    """Every named person with 'name', 'photo_count' and 'newest' (epoch seconds)."""
+    return get_person_index().people()
+
+def get_sample_photos_for_person(person_name, max_samples=10, newest=True, dest_dir=None):
+    """
+    Export up to max_samples photos of a person (newest first by default) and return their paths.
+    Without dest_dir, exports go to a new workspace directory; release it with
+    get_workspace().release() once done.
+    """
+    filtered_photos = person_photos(person_name, limit=max_samples, newest=newest)
+    logger.info(f"get_sample_photos_for_person: {len(filtered_photos)} samples for {person_name}")
     if not filtered_photos:
         return []
-    temp_dir = tempfile.mkdtemp(prefix="face_sample_")
+    temp_dir = dest_dir or get_workspace().run_dir("face_sample_")
     exported_paths = []
-    for photo in filtered_photos[:max_samples]:
-        paths = export_photo_as_jpeg(photo, temp_dir)
+    for photo in filtered_photos:
+        paths = export_photo(photo, temp_dir)
         exported_paths.extend(paths)
     return exported_paths
 
-def export_random_photo():
+def export_random_photo(dest_dir=None):
     """
-    Export a random photo from the Photos library to a temp directory and return its path (for testing email upload).
+    Export a random photo from the Photos library and return its path (for testing email upload).
+    Without dest_dir, it goes to a new workspace directory; release it with
+    get_workspace().release() once done.
     """
-    photosdb = osxphotos.PhotosDB()
+    photosdb = get_photosdb()
     all_photos = photosdb.photos()
     logger.info(f"export_random_photo: Found {len(all_photos)} total photos in library")
     if not all_photos:
         return []
     photo = random.choice(all_photos)
-    temp_dir = tempfile.mkdtemp(prefix="random_photo_")
-    return export_photo_as_jpeg(photo, temp_dir)
+    return export_photo(photo, dest_dir or get_workspace().run_dir("random_photo_"))
 
-def get_album_photos(album_name: str, sync_tracker=None) -> List[Tuple[str, List[str]]]:
-    """
-    Get photos from a specific album that haven't been synced yet.
-    Returns a list of tuples: (photo_uuid, exported_paths)
-    """
-    logger.info(f"Looking for album: {album_name}")
-    photosdb = osxphotos.PhotosDB()
-    
+def find_album(photosdb, album_name: str):
+    """Return the album (regular or smart) with the given title, or None."""
     # Try regular albums first
     album = next((a for a in photosdb.album_info if str(a.title) == album_name), None)
     
     # If not found in regular albums, try smart albums
     if not album and hasattr(photosdb, 'albums'):
         album = next((a for a in photosdb.albums if str(a.title) == album_name), None)
+    return album
+
+def _photo_modified(photo) -> float:
+    modified = getattr(photo, 'date_modified', None) or getattr(photo, 'date', None)
+    try:
+        return modified.timestamp() if modified else 0.0
+    except (AttributeError, OverflowError, OSError, ValueError):
+        return 0.0
+
+def album_fingerprint(photos) -> dict:
+    """Member count plus a hash of the sorted member UUIDs and modification dates."""
+    members = sorted(f"{p.uuid}:{_photo_modified(p)}" for p in photos if getattr(p, 'uuid', None))
+    digest = hashlib.sha1("\n".join(members).encode("utf-8")).hexdigest()
+    return {"count": len(members), "digest": digest}
+
+class AlbumPlan:
+    """What a sync of one album needs to do: the photos not yet synced, in SYNC_ORDER."""
+
+    def __init__(self, album_name: str, photos=None, total: int = 0, fingerprint: Optional[dict] = None,
+                 unchanged: bool = False, found: bool = True, held: int = 0, duplicates=None):
+        self.album_name = album_name
+        self.photos = photos or []
+        self.total = total
+        self.fingerprint = fingerprint
+        self.unchanged = unchanged
+        self.found = found
+        # Unsynced photos left out because they are waiting in the outbox
+        self.held = held
+        # UUIDs of unsynced photos already sent from another album
+        self.duplicates = duplicates or []
+
+def order_photos(photos, order: Optional[str] = None) -> list:
+    """Sort photos for sending: "newest" or "oldest" first by date taken, or keep "album" order."""
+    order = order or SYNC_ORDER
+    if order not in ("newest", "oldest"):
+        return list(photos)
+    undated = datetime.min if order == "oldest" else datetime.max
+    def taken(photo):
+        date = getattr(photo, 'date', None)
+        # Compare aware and naive dates alike; undated photos go last
+        return date.replace(tzinfo=None) if date else undated
+    return sorted(photos, key=taken, reverse=order == "newest")
+
+def plan_album(album_name: str, sync_tracker=None, snapshot=None, held=None,
+               dedupe: Optional[bool] = None, order: Optional[str] = None,
+               destination: Optional[str] = None, remember: bool = True) -> AlbumPlan:
+    """
+    Work out which photos of an album still need syncing.
+
+    If the tracker's stored fingerprint says the album was fully synced at the
+    current library state, nothing is enumerated at all. Otherwise the album's
+    UUID set is compared with the tracker's synced set in one set difference.
+    Pass snapshot to plan several albums against the same library state, and
+    held to leave out photos that are already exported and waiting elsewhere.
+    With dedupe (DEDUPE_ACROSS_ALBUMS), photos already sent from another album
+    are returned in `duplicates` instead of being planned again. Planned
+    photos come in `order` (SYNC_ORDER by default). With a destination, the
+    plan is for that frame's sync record of the album, and duplicates are
+    photos already sent to that frame. With remember=False the tracker is
+    only read, never updated (for dry runs).
+    """
+    dedupe = DEDUPE_ACROSS_ALBUMS if dedupe is None else dedupe
+    snapshot = snapshot or get_library_manager().get()
+    library_key = json.loads(json.dumps(snapshot.key))
+    record = record_name(album_name, destination)
+    stored = sync_tracker.get_album_fingerprint(record) if sync_tracker else None
+    if stored and stored.get("complete") and library_key is not None and stored.get("library_key") == library_key:
+        logger.info(f"Album '{album_name}' unchanged since its last complete sync, skipping")
+        return AlbumPlan(album_name, total=stored.get("count", 0), fingerprint=stored, unchanged=True)
     
+    logger.info(f"Looking for album: {album_name}")
+    album = find_album(snapshot.db, album_name)
     if not album:
         logger.warning(f"Album '{album_name}' not found")
-        return []
+        return AlbumPlan(album_name, found=False)
     
     # Get photos from the album
     try:
-        photos = album.photos
-        if not photos:
-            logger.warning(f"No photos found in album '{album_name}'")
-            return []
-        
-        logger.info(f"Found {len(photos)} photos in album '{album_name}'")
+        photos = [p for p in (album.photos or []) if getattr(p, 'uuid', None)]
     except Exception as e:
         logger.error(f"Error accessing album photos: {e}")
-        return []
+        return AlbumPlan(album_name, found=False)
+    if not photos:
+        logger.warning(f"No photos found in album '{album_name}'")
     
-    # Create temp directory for exports
+    fingerprint = dict(album_fingerprint(photos), library_key=library_key)
+    if stored and stored.get("complete") and stored.get("digest") == fingerprint["digest"]:
+        logger.info(f"Album '{album_name}' membership unchanged since its last complete sync, skipping")
+        # Remember the new library state so the next run skips without enumerating
+        if remember:
+            sync_tracker.set_album_fingerprint(record, dict(fingerprint, complete=True))
+        return AlbumPlan(album_name, total=len(photos), fingerprint=fingerprint, unchanged=True)
+    
+    pending = {p.uuid for p in photos}
+    if sync_tracker:
+        pending -= sync_tracker.synced_uuids(record)
+    held = pending & set(held or ())
+    pending -= held
+    elsewhere = pending & sync_tracker.synced_anywhere(destination) if sync_tracker and dedupe else set()
+    pending -= elsewhere
+    planned = order_photos([p for p in photos if p.uuid in pending], order)
+    
+    logger.info("Album plan summary:")
+    logger.info(f"- Total photos in album: {len(photos)}")
+    logger.info(f"- Already synced: {len(photos) - len(planned) - len(held) - len(elsewhere)}")
+    if elsewhere:
+        logger.info(f"- Already sent from another album: {len(elsewhere)}")
+    if held:
+        logger.info(f"- Waiting in the outbox: {len(held)}")
+    logger.info(f"- Queued for export: {len(planned)}")
+    duplicates = [p.uuid for p in photos if p.uuid in elsewhere]
+    return AlbumPlan(album_name, planned, len(photos), fingerprint, held=len(held), duplicates=duplicates)
+
+def iter_unsynced_photos(album_name: str, sync_tracker=None) -> Iterator:
+    """Yield the photos of an album that haven't been synced yet, in SYNC_ORDER."""
+    yield from plan_album(album_name, sync_tracker).photos
+
+def export_album_photo(photo, dest_dir, fingerprints=None) -> Optional[Tuple[str, List[str]]]:
+    """
+    Export one album photo into its own subdirectory of dest_dir.
+    Returns (photo_uuid, exported_paths), or None if the export failed.
+    If fingerprints (a dict) is given, the photo's content fingerprint is stored in it by UUID.
+    """
+    photo_uuid = photo.uuid
+    photo_dir = os.path.join(dest_dir, photo_uuid)
+    os.makedirs(photo_dir, exist_ok=True)
+    exported_paths = export_photo(photo, photo_dir)
+    if not exported_paths:
+        logger.error(f"Failed to export photo {photo_uuid[:8]}...")
+        return None
+    if fingerprints is not None:
+        try:
+            fingerprints[photo_uuid] = photo_fingerprint(photo, exported_paths)
+        except Exception as e:
+            logger.warning(f"Could not fingerprint photo {photo_uuid[:8]}...: {e}")
+    return photo_uuid, exported_paths
+
+def export_stage(dest_dir, workers: Optional[int] = None, slots=None, fingerprints=None) -> Stage:
+    """
+    Pipeline stage exporting photos into dest_dir on a pool of worker threads.
+    slots, a semaphore shared by several pipelines, caps exports running at once across all of them.
+    fingerprints, if given, collects each exported photo's content fingerprint by UUID.
+    """
+    def export(photo):
+        if slots is None:
+            return export_album_photo(photo, dest_dir, fingerprints)
+        with slots:
+            return export_album_photo(photo, dest_dir, fingerprints)
+    
+    return Stage("export", export, workers=workers or EXPORT_WORKERS, ordered=True)
+
+def export_photos(photos, dest_dir, workers: Optional[int] = None) -> List[Tuple[str, List[str]]]:
+    """
+    Export photos in parallel, returning (photo_uuid, exported_paths) in input order.
+    A photo that fails to export is logged and left out without affecting the others.
+    """
+    pipeline = Pipeline("export", photos, [export_stage(dest_dir, workers)])
+    return pipeline.run()
+
+def get_album_photos(album_name: str, sync_tracker=None, export_workers: Optional[int] = None,
+                     dest_dir=None) -> List[Tuple[str, List[str]]]:
+    """
+    Get photos from a specific album that haven't been synced yet.
+    Returns a list of tuples: (photo_uuid, exported_paths)
+    Without dest_dir, exports go to a new workspace directory; release it with
+    get_workspace().release() once done.
+    """
+    # Create a scratch directory for exports
     try:
-        temp_dir = tempfile.mkdtemp(prefix=f"album_{album_name}_")
+        temp_dir = dest_dir or get_workspace().run_dir(f"album_{album_name}_")
     except Exception as e:
         logger.error(f"Error creating temp directory: {e}")
         return []
     
     # Export photos that haven't been synced
-    results = []
-    skipped_count = 0
-    for i, photo in enumerate(photos, 1):
-        try:
-            # Get photo UUID
-            photo_uuid = getattr(photo, 'uuid', None)
-            if not photo_uuid:
-                skipped_count += 1
-                continue
-            
-            # Check if already synced
-            if sync_tracker and sync_tracker.is_synced(photo_uuid, album_name):
-                skipped_count += 1
-                continue
-            
-            # Export the photo
-            exported_paths = export_photo_as_jpeg(photo, temp_dir)
-            if exported_paths:
-                results.append((photo_uuid, exported_paths))
-            else:
-                logger.error(f"Failed to export photo {i}/{len(photos)}")
-        except Exception as e:
-            logger.error(f"Error processing photo {i}/{len(photos)}: {e}")
-            continue
-    
-    logger.info("Export summary:")
-    logger.info(f"- Total photos in album: {len(photos)}")
-    logger.info(f"- Skipped (already synced/no UUID): {skipped_count}")
-    logger.info(f"- Successfully exported: {len(results)}")
-    return results 
\ No newline at end of file
+    results = export_photos(iter_unsynced_photos(album_name, sync_tracker), temp_dir, export_workers)
+    logger.info(f"Successfully exported: {len(results)}")
+    return results
@@ -0,0 +1,95 @@
+import os
+import threading
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# The frame at AURA_FRAME_EMAIL; its sync records keep the plain album name
+DEFAULT_DESTINATION = "default"
+# More frames, as name=address pairs: "grandma=grandma@example.com,cabin=cabin@example.com"
+FRAME_DESTINATIONS = os.getenv("FRAME_DESTINATIONS", "")
+# Which frames each album goes to: "Family=default+grandma;Trips=cabin". "*" stands for
+# every album not listed; albums without a route go to the default frame only.
+ALBUM_DESTINATIONS = os.getenv("ALBUM_DESTINATIONS", "")
+
+# Separates an album from its destination in sync record names
+RECORD_SEPARATOR = "::"
+
+def record_name(album_name: str, destination: Optional[str] = None) -> str:
+    """Name of the sync record for photos of an album sent to a destination."""
+    if not destination or destination == DEFAULT_DESTINATION:
+        return album_name
+    return f"{album_name}{RECORD_SEPARATOR}{destination}"
+
+def record_destination(record: str) -> str:
+    """The destination a sync record belongs to."""
+    _, sep, destination = record.rpartition(RECORD_SEPARATOR)
+    return destination if sep else DEFAULT_DESTINATION
+
+class Destination:
+    """A frame photos are emailed to."""
+
+    def __init__(self, name: str, email: str):
+        self.name = name
+        self.email = email
+
+    def record(self, album_name: str) -> str:
+        return record_name(album_name, self.name)
+
+    def __repr__(self):
+        return f"Destination({self.name!r}, {self.email!r})"
+
+def parse_destinations(value: str) -> Dict[str, str]:
+    destinations = {}
+    for part in value.split(","):
+        name, _, email = part.partition("=")
+        if name.strip() and email.strip():
+            destinations[name.strip()] = email.strip()
+    return destinations
+
+def parse_routes(value: str) -> Dict[str, List[str]]:
+    routes = {}
+    for part in value.split(";"):
+        album, _, names = part.rpartition("=")
+        if album.strip():
+            routes[album.strip()] = [n.strip() for n in names.split("+") if n.strip()]
+    return routes
+
+class Routing:
+    """Frames to send to, and which albums go to which of them."""
+
+    def __init__(self, destinations: Optional[Dict[str, str]] = None, routes: Optional[Dict[str, List[str]]] = None,
+                 default_email: Optional[str] = None):
+        default_email = default_email or os.getenv("AURA_FRAME_EMAIL")
+        emails = {DEFAULT_DESTINATION: default_email} if default_email else {}
+        emails.update(parse_destinations(FRAME_DESTINATIONS) if destinations is None else destinations)
+        self.destinations = {name: Destination(name, email) for name, email in emails.items()}
+        self.routes: Dict[str, List[Destination]] = {}
+        for album, names in (parse_routes(ALBUM_DESTINATIONS) if routes is None else routes).items():
+            unknown = [n for n in names if n not in self.destinations]
+            if unknown:
+                logger.warning(f"Ignoring unknown destination(s) {', '.join(unknown)} for album '{album}'")
+            self.routes[album] = [self.destinations[n] for n in names if n in self.destinations]
+
+    def for_album(self, album_name: str) -> List[Destination]:
+        """Destinations an album is synced to."""
+        if album_name in self.routes:
+            return self.routes[album_name]
+        if "*" in self.routes:
+            return self.routes["*"]
+        default = self.destinations.get(DEFAULT_DESTINATION)
+        return [default] if default else []
+
+_routing: Optional[Routing] = None
+_routing_lock = threading.Lock()
+
+def get_routing() -> Routing:
+    """Return the routing configured in the environment."""
+    global _routing
+    with _routing_lock:
+        if _routing is None:
+            _routing = Routing()
+        return _routing
@@ -1,8 +1,18 @@
+import base64
 import os
+import re
 import smtplib
+import threading
+import time
+import uuid
+from email.header import Header
 from email.message import EmailMessage
+from email.utils import encode_rfc2231, formatdate, make_msgid
+from typing import Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 from .logger import setup_logger
+from .metrics import BYTES_SENT, PHOTOS_SENT, SMTP_CONNECTIONS, SMTP_MESSAGES, SMTP_SEND_SECONDS
+from .send_quota import get_send_quota
 
 load_dotenv()
 logger = setup_logger(__name__)
@@ -12,35 +22,419 @@ EMAIL_SENDER = os.getenv("EMAIL_SENDER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 EMAIL_SMTP = os.getenv("EMAIL_SMTP", "smtp.gmail.com")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", 465))
+# Set to false to talk plain SMTP (e.g. a local test server)
+EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "true").lower() not in ("0", "false", "no")
+# Packing limits for one message: encoded size in bytes and attachment count
+EMAIL_MAX_BYTES = int(os.getenv("EMAIL_MAX_BYTES", 18 * 1024 * 1024))
+EMAIL_MAX_ATTACHMENTS = int(os.getenv("EMAIL_MAX_ATTACHMENTS", 10))
+# Longest a photo waits in a partly filled message before it is sent anyway
+# (enforced by callers that poll `due_in()`/`flush_due()`, like the sync pipeline)
+EMAIL_BATCH_WAIT = float(os.getenv("EMAIL_BATCH_WAIT", 10))
+# SMTP sessions shared by albums syncing at the same time
+SMTP_MAX_SESSIONS = int(os.getenv("SMTP_MAX_SESSIONS", 1))
+# Encode attachments from disk while sending instead of building the whole message in memory
+EMAIL_STREAMING = os.getenv("EMAIL_STREAMING", "true").lower() not in ("0", "false", "no")
 
-def send_photos_via_email(photo_paths, subject="Photos for Aura Frame", body="Sent automatically."):
-    if not photo_paths:
-        logger.warning("No photos to send.")
-        return False
+# Bytes read from disk per chunk when streaming: a multiple of 57, so every
+# chunk encodes to whole 76-character base64 lines
+_STREAM_CHUNK = 57 * 1024
+# Lines starting with "." must be doubled on the DATA stream (RFC 5321 4.5.2)
+_DOT_LINE = re.compile(rb"(?m)^\.")
+
+# Headers, text part and MIME boundaries of one message, roughly
+_MESSAGE_OVERHEAD = 4096
+
+def _encoded_size(path):
+    """Approximate size of a file once base64-encoded into a message."""
+    return os.path.getsize(path) * 4 // 3 + 1024
+
+def _attachment_type(filename):
+    maintype, subtype = ("application", "octet-stream")
+    if filename.lower().endswith(('.jpg', '.jpeg')):
+        maintype, subtype = ("image", "jpeg")
+    elif filename.lower().endswith('.png'):
+        maintype, subtype = ("image", "png")
+    return maintype, subtype
+
+def recipient_list(recipient=None) -> List[str]:
+    """Addresses from one address, a comma-separated string or a list; AURA_FRAME_EMAIL by default."""
+    recipient = recipient or AURA_FRAME_EMAIL or ""
+    if isinstance(recipient, str):
+        recipient = recipient.split(",")
+    return [address.strip() for address in recipient if address and address.strip()]
+
+def build_message(photo_paths, subject="Photos for Aura Frame", body="Sent automatically.",
+                  sender=None, recipient=None):
     msg = EmailMessage()
     msg["Subject"] = subject
-    msg["From"] = EMAIL_SENDER
-    msg["To"] = AURA_FRAME_EMAIL
+    msg["From"] = sender or EMAIL_SENDER
+    msg["To"] = ", ".join(recipient_list(recipient))
     msg.set_content(body)
     for path in photo_paths:
         with open(path, "rb") as f:
             data = f.read()
             filename = os.path.basename(path)
-            maintype, subtype = ("application", "octet-stream")
-            if filename.lower().endswith(('.jpg', '.jpeg')):
-                maintype, subtype = ("image", "jpeg")
-            elif filename.lower().endswith('.png'):
-                maintype, subtype = ("image", "png")
+            maintype, subtype = _attachment_type(filename)
             msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
-    try:
-        with smtplib.SMTP_SSL(EMAIL_SMTP, EMAIL_PORT) as smtp:
-            smtp.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            result = smtp.send_message(msg)
-            if result == {}:
-                logger.info(f"Sent {len(photo_paths)} photo(s) to {AURA_FRAME_EMAIL} (all recipients accepted).")
-            else:
-                logger.warning(f"Some recipients were refused: {result}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send email: {e}")
-        return False 
\ No newline at end of file
+    return msg
+
+def _header_value(value: str) -> str:
+    return value if value.isascii() else Header(value, "utf-8").encode()
+
+class StreamingMessage:
+    """
+    A multipart/mixed message with photo attachments that is produced chunk by
+    chunk: each attachment is read from disk and base64-encoded `_STREAM_CHUNK`
+    bytes at a time while it is written to the SMTP connection, so memory use
+    stays the same whatever the size of the message. With several
+    recipients the message is encoded once, in a single SMTP transaction.
+    """
+
+    def __init__(self, photo_paths, subject="Photos for Aura Frame", body="Sent automatically.",
+                 sender=None, recipient=None):
+        self.photo_paths = list(photo_paths)
+        # Fail now rather than halfway through the DATA stream
+        self.attachment_bytes = sum(os.path.getsize(path) for path in self.photo_paths)
+        self.sender = sender or EMAIL_SENDER
+        self.recipients = recipient_list(recipient)
+        self.recipient = ", ".join(self.recipients)
+        self.body = body
+        self.boundary = f"===============aura{uuid.uuid4().hex}=="
+        self.headers = {
+            "Subject": _header_value(subject),
+            "From": self.sender,
+            "To": self.recipient,
+            "Date": formatdate(localtime=True),
+            "Message-ID": make_msgid(),
+            "MIME-Version": "1.0",
+            "Content-Type": f'multipart/mixed; boundary="{self.boundary}"',
+        }
+
+    def __getitem__(self, name):
+        return self.headers.get(name)
+
+    def _part_header(self, path) -> bytes:
+        filename = os.path.basename(path)
+        maintype, subtype = _attachment_type(filename)
+        if filename.isascii():
+            disposition = f'attachment; filename="{filename}"'
+        else:
+            disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+        return (
+            f"\r\n--{self.boundary}\r\n"
+            f"Content-Type: {maintype}/{subtype}\r\n"
+            f"Content-Transfer-Encoding: base64\r\n"
+            f"Content-Disposition: {disposition}\r\n\r\n"
+        ).encode("ascii")
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """The message as CRLF-terminated chunks, each ending on a line boundary."""
+        head = "".join(f"{name}: {value}\r\n" for name, value in self.headers.items())
+        body = base64.encodebytes(self.body.encode("utf-8")).decode("ascii").replace("\n", "\r\n")
+        yield (
+            f"{head}\r\n"
+            f"--{self.boundary}\r\n"
+            f'Content-Type: text/plain; charset="utf-8"\r\n'
+            f"Content-Transfer-Encoding: base64\r\n\r\n"
+            f"{body}"
+        ).encode("ascii")
+        for path in self.photo_paths:
+            yield self._part_header(path)
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(_STREAM_CHUNK)
+                    if not data:
+                        break
+                    yield base64.encodebytes(data).replace(b"\n", b"\r\n")
+        yield f"\r\n--{self.boundary}--\r\n".encode("ascii")
+
+    def as_bytes(self) -> bytes:
+        return b"".join(self.iter_chunks())
+
+def _send_streaming(smtp: smtplib.SMTP, msg: StreamingMessage) -> dict:
+    """What smtplib's sendmail does, but writing the message to the socket as it is encoded."""
+    smtp.ehlo_or_helo_if_needed()
+    code, resp = smtp.mail(msg.sender)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, msg.sender)
+    refused = {}
+    for recipient in msg.recipients:
+        code, resp = smtp.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+    if refused:
+        # Nothing is delivered unless every frame takes it, so a retry can't send doubles
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    smtp.putcmd("data")
+    code, resp = smtp.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in msg.iter_chunks():
+        smtp.send(_DOT_LINE.sub(b"..", chunk))
+    smtp.send(b".\r\n")
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return {}
+
+class SMTPUploader:
+    """
+    Sends photos over one authenticated SMTP session that is kept open across sends.
+
+    Photos queued with `add()` are packed into as few messages as the size and
+    attachment limits allow. The session is re-established once if the server
+    drops it. Every message takes a slot of the send quota first; once the
+    quota is used up, `quota_exhausted` is set and later sends fail straight
+    away. Use as a context manager, or call `close()` when done.
+    """
+
+    def __init__(self, host=None, port=None, sender=None, password=None, recipient=None,
+                 use_ssl=None, max_bytes=None, max_attachments=None, batch_wait=None, timeout=120,
+                 session_pool=None, streaming=None, quota=None):
+        self.host = host or EMAIL_SMTP
+        self.port = port or EMAIL_PORT
+        self.sender = sender or EMAIL_SENDER
+        self.password = password if password is not None else EMAIL_PASSWORD
+        # One address or several; several share each message
+        self.recipient = ", ".join(recipient_list(recipient))
+        self.use_ssl = EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.max_bytes = max_bytes or EMAIL_MAX_BYTES
+        self.max_attachments = max(1, max_attachments or EMAIL_MAX_ATTACHMENTS)
+        self.batch_wait = EMAIL_BATCH_WAIT if batch_wait is None else batch_wait
+        self.timeout = timeout
+        self.streaming = EMAIL_STREAMING if streaming is None else streaming
+        # When set, messages go out over the pool's sessions instead of our own
+        self.session_pool = session_pool
+        self.quota = quota or get_send_quota()
+        self.quota_exhausted = False
+        self.connections = 0
+        self.messages_sent = 0
+        # Why the most recent send failed, for the outbox
+        self.last_error: Optional[str] = None
+        self._smtp = None
+        self._lock = threading.RLock()
+        # Queued photos: (key, paths, encoded size)
+        self._batch: List[Tuple[object, List[str], int]] = []
+        self._batch_started = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.password:
+            smtp.login(self.sender, self.password)
+        self.connections += 1
+        SMTP_CONNECTIONS.inc()
+        logger.debug(f"Opened SMTP session #{self.connections} to {self.host}:{self.port}")
+        return smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def send_message(self, msg) -> bool:
+        """Send one message within the send quota, on the pooled session or our own."""
+        slot = None if self.quota_exhausted else self.quota.acquire()
+        if slot is None:
+            self.quota_exhausted = True
+            self.last_error = "Send quota used up"
+            return False
+        if self.session_pool is not None:
+            sent, self.last_error = self.session_pool.send_message(msg)
+            if sent:
+                self.messages_sent += 1
+        else:
+            sent = self.deliver(msg)
+        if not sent:
+            self.quota.refund(slot)
+        return sent
+
+    def deliver(self, msg) -> bool:
+        """Send one message on our session, reconnecting once if it was dropped. Ignores the quota."""
+        with SMTP_SEND_SECONDS.time():
+            sent = self._send_message(msg)
+        SMTP_MESSAGES.inc(result="sent" if sent else "failed")
+        return sent
+
+    def _send_message(self, msg) -> bool:
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._smtp is None:
+                        self._smtp = self._connect()
+                    if isinstance(msg, StreamingMessage):
+                        result = _send_streaming(self._smtp, msg)
+                    else:
+                        result = self._smtp.send_message(msg)
+                    self.messages_sent += 1
+                    self.last_error = None
+                    if result == {}:
+                        logger.debug(f"Sent message to {msg['To']} (all recipients accepted).")
+                    else:
+                        logger.warning(f"Some recipients were refused: {result}")
+                    return True
+                except smtplib.SMTPServerDisconnected as e:
+                    self._smtp = None
+                    if attempt == 1:
+                        logger.info(f"SMTP session dropped ({e}), reconnecting...")
+                        continue
+                    self.last_error = str(e)
+                    logger.error(f"Failed to send email: {e}")
+                except Exception as e:
+                    self.last_error = str(e) or type(e).__name__
+                    logger.error(f"Failed to send email: {e}")
+                    # The session state is unknown after a failure
+                    self._disconnect()
+                    break
+            return False
+
+    def send_photos(self, photo_paths, subject="Photos for Aura Frame", body="Sent automatically.") -> bool:
+        """Send the given files as one message."""
+        if not photo_paths:
+            logger.warning("No photos to send.")
+            return False
+        try:
+            make_message = StreamingMessage if self.streaming else build_message
+            msg = make_message(photo_paths, subject, body, self.sender, self.recipient)
+        except Exception as e:
+            self.last_error = f"Failed to build email: {e}"
+            logger.error(self.last_error)
+            return False
+        if self.send_message(msg):
+            logger.info(f"Sent {len(photo_paths)} photo(s) to {self.recipient}.")
+            PHOTOS_SENT.inc(len(photo_paths))
+            BYTES_SENT.inc(sum(os.path.getsize(p) for p in photo_paths if os.path.exists(p)))
+            return True
+        return False
+
+    def add(self, key, photo_paths) -> List[Tuple[object, List[str], bool]]:
+        """
+        Queue one photo's files for sending under `key`.
+
+        Returns (key, paths, sent) for every photo whose message went out (or
+        failed) during this call; the rest stay queued until a later `add()` or
+        `flush()`.
+        """
+        size = sum(_encoded_size(p) for p in photo_paths)
+        done = []
+        with self._lock:
+            queued_size = _MESSAGE_OVERHEAD + sum(s for _, _, s in self._batch)
+            queued_files = sum(len(paths) for _, paths, _ in self._batch)
+            if self._batch and (queued_size + size > self.max_bytes
+                                or queued_files + len(photo_paths) > self.max_attachments):
+                done.extend(self.flush())
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append((key, list(photo_paths), size))
+            queued_files = sum(len(paths) for _, paths, _ in self._batch)
+            if (queued_files >= self.max_attachments
+                    or time.monotonic() - self._batch_started >= self.batch_wait):
+                done.extend(self.flush())
+        return done
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until the queued message has waited batch_wait, or None with nothing queued."""
+        with self._lock:
+            if not self._batch:
+                return None
+            return max(0.0, self._batch_started + self.batch_wait - time.monotonic())
+
+    def flush_due(self) -> List[Tuple[object, List[str], bool]]:
+        """`flush()` if the queued message has waited batch_wait, else nothing."""
+        with self._lock:
+            if self._batch and time.monotonic() - self._batch_started >= self.batch_wait:
+                return self.flush()
+            return []
+
+    def flush(self) -> List[Tuple[object, List[str], bool]]:
+        """Send everything queued by `add()` and return the per-photo results."""
+        with self._lock:
+            batch, self._batch = self._batch, []
+            if not batch:
+                return []
+            paths = [p for _, photo_paths, _ in batch for p in photo_paths]
+            sent = self.send_photos(paths)
+            return [(key, photo_paths, sent) for key, photo_paths, _ in batch]
+
+    def close(self) -> List[Tuple[object, List[str], bool]]:
+        """Send anything still queued, close the session and return the results of that last send."""
+        with self._lock:
+            done = self.flush()
+            self._disconnect()
+        return done
+
+class SMTPSessionPool:
+    """
+    Up to `max_sessions` SMTP sessions shared by several SMTPUploaders.
+
+    Each send checks out an idle session (opening one if the cap allows) and
+    waits when all of them are busy.
+    """
+
+    def __init__(self, max_sessions=None, **uploader_kwargs):
+        self.max_sessions = max(1, max_sessions or SMTP_MAX_SESSIONS)
+        self.uploader_kwargs = uploader_kwargs
+        self._idle: List[SMTPUploader] = []
+        self._sessions: List[SMTPUploader] = []
+        self._cond = threading.Condition()
+
+    @property
+    def connections(self) -> int:
+        return sum(s.connections for s in self._sessions)
+
+    @property
+    def messages_sent(self) -> int:
+        return sum(s.messages_sent for s in self._sessions)
+
+    def _checkout(self) -> SMTPUploader:
+        with self._cond:
+            while not self._idle and len(self._sessions) >= self.max_sessions:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            session = SMTPUploader(**self.uploader_kwargs)
+            self._sessions.append(session)
+            return session
+
+    def _checkin(self, session: SMTPUploader):
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    def send_message(self, msg) -> Tuple[bool, Optional[str]]:
+        """Send on an idle session; returns (sent, error)."""
+        session = self._checkout()
+        try:
+            # The pool's user already took the quota slot
+            sent = session.deliver(msg)
+            return sent, session.last_error
+        finally:
+            self._checkin(session)
+
+    def uploader(self, **kwargs) -> SMTPUploader:
+        """A new batching uploader that sends through this pool."""
+        return SMTPUploader(session_pool=self, **dict(self.uploader_kwargs, **kwargs))
+
+    def close(self):
+        with self._cond:
+            for session in self._sessions:
+                session.close()
+            self._idle = []
+            self._sessions = []
+
+def send_photos_via_email(photo_paths, subject="Photos for Aura Frame", body="Sent automatically."):
+    with SMTPUploader() as uploader:
+        return uploader.send_photos(photo_paths, subject, body)
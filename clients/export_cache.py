@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import List, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .state import STATE_DIR
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+EXPORT_CACHE_DIR = os.path.expanduser(os.getenv("EXPORT_CACHE_DIR") or os.path.join(STATE_DIR, "export_cache"))
+# Byte budget for cached exports; 0 disables the cache
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+META_FILE = "meta.json"
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(src, dest_dir):
+    """Hard-link src into dest_dir (copying across filesystems) without clobbering existing files."""
+    name, ext = os.path.splitext(os.path.basename(src))
+    dest = os.path.join(dest_dir, name + ext)
+    n = 1
+    while os.path.exists(dest):
+        dest = os.path.join(dest_dir, f"{name} ({n}){ext}")
+        n += 1
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+class DiskCache:
+    """
+    Byte-budgeted LRU cache of files on disk.
+
+    Each key maps to a directory holding the cached files and a meta.json with
+    their sizes and SHA-256 digests, which are checked on every read. Reads
+    touch meta.json, and the least recently used entries are evicted once the
+    total size goes over `max_bytes`.
+    """
+
+    def __init__(self, root: str, max_bytes: int, name: str = "cache"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.corrupt = 0
+        self.evictions = 0
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._sweep_staging()
+
+    def _sweep_staging(self, max_age=3600):
+        """Remove staging directories left behind by interrupted puts."""
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".staging-"):
+                try:
+                    if time.time() - entry.stat().st_mtime > max_age:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except OSError:
+                    continue
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha1("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._entry_dir(key), META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the cached file paths for key, or None on a miss or failed integrity check."""
+        meta = self._read_meta(key)
+        if meta is None:
+            self.misses += 1
+            return None
+        entry_dir = self._entry_dir(key)
+        paths = []
+        for info in meta["files"]:
+            path = os.path.join(entry_dir, info["name"])
+            try:
+                intact = os.path.getsize(path) == info["size"] and file_sha256(path) == info["sha256"]
+            except OSError:
+                intact = False
+            if not intact:
+                logger.warning(f"[{self.name}] Entry {key[:8]} failed its integrity check, discarding")
+                self.corrupt += 1
+                self.misses += 1
+                self.discard(key)
+                return None
+            paths.append(path)
+        os.utime(os.path.join(entry_dir, META_FILE))
+        self.hits += 1
+        return paths
+
+    def get_meta(self, key: str) -> Optional[dict]:
+        return self._read_meta(key)
+
+    def update_meta(self, key: str, **fields) -> bool:
+        """Add fields to an entry's meta.json (atomically); False if the entry is gone."""
+        with self._lock:
+            meta = self._read_meta(key)
+            if meta is None:
+                return False
+            meta.update(fields)
+            path = os.path.join(self._entry_dir(key), META_FILE)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(meta, f)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.debug(f"[{self.name}] Could not update meta of {key[:8]}: {e}")
+                return False
+            return True
+
+    def put(self, key: str, src_paths: List[str], extra: Optional[dict] = None) -> List[str]:
+        """Move src_paths into the cache under key and return their cached paths."""
+        staging = self.staging_dir()
+        files = []
+        for src in src_paths:
+            dest = os.path.join(staging, os.path.basename(src))
+            shutil.move(src, dest)
+            files.append({"name": os.path.basename(src), "size": os.path.getsize(dest), "sha256": file_sha256(dest)})
+        meta = {"files": files, "created_at": time.time()}
+        if extra:
+            meta.update(extra)
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+        entry_dir = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        with self._lock:
+            if os.path.exists(entry_dir):
+                self._remove(entry_dir)
+            os.rename(staging, entry_dir)
+            if self._total_bytes is not None:
+                self._total_bytes += sum(info["size"] for info in files)
+        self.evict(keep=entry_dir)
+        return [os.path.join(entry_dir, info["name"]) for info in files]
+
+    def discard(self, key: str):
+        with self._lock:
+            self._remove(self._entry_dir(key))
+
+    def _remove(self, entry_dir: str):
+        size = self._dir_size(entry_dir)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        if self._total_bytes is not None:
+            self._total_bytes = max(0, self._total_bytes - size)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        try:
+            return sum(e.stat().st_size for e in os.scandir(path) if e.is_file() and e.name != META_FILE)
+        except OSError:
+            return 0
+
+    def _entries(self):
+        """Yield (last_used, size, entry_dir) for every cache entry."""
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir() or bucket.name.startswith("."):
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    last_used = os.stat(os.path.join(entry.path, META_FILE)).st_mtime
+                except OSError:
+                    last_used = 0
+                yield last_used, self._dir_size(entry.path), entry.path
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            return self._total_bytes
+
+    def staging_dir(self) -> str:
+        """A scratch directory on the cache's filesystem, so `put()` can move files cheaply."""
+        return tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used entries (other than `keep`) until the cache fits its byte budget."""
+        if self.total_bytes() <= self.max_bytes:
+            return
+        with self._lock:
+            for _, size, entry_dir in sorted(self._entries()):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if entry_dir == keep:
+                    continue
+                self._remove(entry_dir)
+                self.evictions += 1
+        logger.info(f"[{self.name}] Evicted down to {self._total_bytes} bytes ({self.evictions} evictions so far)")
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "corrupt": self.corrupt,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+_export_cache: Optional[DiskCache] = None
+_export_cache_lock = threading.Lock()
+
+def get_export_cache() -> Optional[DiskCache]:
+    """Return the shared export cache, or None when EXPORT_CACHE_MAX_BYTES is 0."""
+    global _export_cache
+    if EXPORT_CACHE_MAX_BYTES <= 0:
+        return None
+    with _export_cache_lock:
+        if _export_cache is None:
+            _export_cache = DiskCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, name="export-cache")
+        return _export_cache
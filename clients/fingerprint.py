@@ -0,0 +1,160 @@
+import hashlib
+import importlib.util
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from .export_cache import file_sha256
+from .logger import setup_logger
+
+# Pillow is optional; without it only exact duplicates are found. It is
+# imported by dhash(), so processes that never hash images don't load it.
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Send each image once: skip photos already sent from another album or with the same content
+DEDUPE_ACROSS_ALBUMS = os.getenv("DEDUPE_ACROSS_ALBUMS", "true").lower() not in ("0", "false", "no")
+# Also match re-encoded copies by a perceptual hash (needs Pillow)
+DEDUPE_PERCEPTUAL = os.getenv("DEDUPE_PERCEPTUAL", "false").lower() in ("1", "true", "yes")
+# Most differing bits (of 64) for two perceptual hashes to count as the same image
+DEDUPE_PERCEPTUAL_DISTANCE = int(os.getenv("DEDUPE_PERCEPTUAL_DISTANCE", 4))
+
+SHA256 = "sha256:"
+DHASH = "dhash:"
+
+def content_sha256(paths: List[str], digests: Optional[List[str]] = None) -> str:
+    """SHA-256 of a photo's exported files: the file's own digest, or a digest of all of them."""
+    digests = digests or [file_sha256(p) for p in paths]
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256("\n".join(digests).encode("ascii")).hexdigest()
+
+def dhash(path: str, size: int = 8) -> Optional[str]:
+    """
+    64-bit difference hash of an image as 16 hex digits: whether each pixel of
+    a (size+1) x size grayscale thumbnail is brighter than its right neighbour.
+    Survives re-encoding and resizing. None if Pillow is missing or the file
+    can't be decoded.
+    """
+    if not HAS_PILLOW:
+        return None
+    from PIL import Image, ImageOps
+    try:
+        with Image.open(path) as im:
+            if im.format == "JPEG":
+                # Decode at 1/8 scale; the hash only needs a tiny thumbnail
+                im.draft("L", (size * 8, size * 8))
+            im = ImageOps.exif_transpose(im).convert("L").resize((size + 1, size), Image.LANCZOS)
+            pixels = list(im.getdata())
+    except Exception as e:
+        logger.debug(f"Could not compute a perceptual hash of {os.path.basename(path)}: {e}")
+        return None
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+def compute_fingerprint(paths: List[str], perceptual: Optional[bool] = None, digests: Optional[List[str]] = None,
+                        known: Optional[dict] = None) -> dict:
+    """
+    Fingerprint of a photo's exported files: {"sha256": ..., "dhash": ...}.
+    Parts already in `known` (e.g. from the export cache) aren't computed again,
+    and `digests` are the files' SHA-256s if the caller has them.
+    """
+    perceptual = DEDUPE_PERCEPTUAL if perceptual is None else perceptual
+    fingerprint = dict(known or {})
+    if "sha256" not in fingerprint:
+        fingerprint["sha256"] = content_sha256(paths, digests)
+    if perceptual and "dhash" not in fingerprint and paths:
+        value = dhash(paths[0])
+        if value:
+            fingerprint["dhash"] = value
+    return fingerprint
+
+def fingerprint_keys(fingerprint: Optional[dict]) -> List[str]:
+    """Index keys for a fingerprint, e.g. ["sha256:<hex>", "dhash:<hex>"]."""
+    if not fingerprint:
+        return []
+    keys = []
+    if fingerprint.get("sha256"):
+        keys.append(SHA256 + fingerprint["sha256"])
+    if fingerprint.get("dhash"):
+        keys.append(DHASH + fingerprint["dhash"])
+    return keys
+
+class ContentIndex:
+    """
+    Which photo (UUID) was sent with which content fingerprint keys.
+
+    Exact keys are looked up directly; perceptual hashes can also be matched
+    within a Hamming distance, which scans all of them.
+    """
+
+    def __init__(self, owners: Optional[Dict[str, str]] = None):
+        self.owners: Dict[str, str] = {}
+        self._dhashes: Dict[int, str] = {}
+        for key, photo_uuid in (owners or {}).items():
+            self._add_key(key, photo_uuid)
+
+    def __len__(self):
+        return len(self.owners)
+
+    def _add_key(self, key: str, photo_uuid: str):
+        self.owners.setdefault(key, photo_uuid)
+        if key.startswith(DHASH):
+            self._dhashes.setdefault(int(key[len(DHASH):], 16), photo_uuid)
+
+    def add(self, photo_uuid: str, keys: Iterable[str]):
+        for key in keys:
+            self._add_key(key, photo_uuid)
+
+    def find(self, keys: Iterable[str], max_distance: int = 0) -> Optional[str]:
+        """The UUID recorded for any of keys, or for a perceptual hash within max_distance bits."""
+        keys = list(keys)
+        for key in keys:
+            if key in self.owners:
+                return self.owners[key]
+        if max_distance > 0:
+            for key in keys:
+                if key.startswith(DHASH):
+                    value = int(key[len(DHASH):], 16)
+                    for other, photo_uuid in self._dhashes.items():
+                        if bin(value ^ other).count("1") <= max_distance:
+                            return photo_uuid
+        return None
+
+    def keep_only(self, photo_uuids: set):
+        """Forget keys of photos that are no longer synced anywhere."""
+        owners = {k: u for k, u in self.owners.items() if u in photo_uuids}
+        self.owners = {}
+        self._dhashes = {}
+        for key, photo_uuid in owners.items():
+            self._add_key(key, photo_uuid)
+
+class ContentClaims:
+    """
+    Content being sent right now, shared by the albums of one run, so two
+    copies of an image in flight at the same time are only sent once.
+    """
+
+    def __init__(self, max_distance: Optional[int] = None):
+        self.max_distance = DEDUPE_PERCEPTUAL_DISTANCE if max_distance is None else max_distance
+        self._index = ContentIndex()
+        self._lock = threading.Lock()
+
+    def claim(self, photo_uuid: str, keys: List[str]) -> Optional[str]:
+        """
+        Claim keys for photo_uuid; returns the photo already holding them, if
+        any (which may be the same photo, claimed by another album).
+        """
+        with self._lock:
+            owner = self._index.find(keys, self.max_distance)
+            if owner is not None:
+                return owner
+            self._index.add(photo_uuid, keys)
+            return None
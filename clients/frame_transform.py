@@ -0,0 +1,143 @@
+import importlib.util
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .workspace import get_workspace
+
+# Pillow is optional; without it photos are sent as exported. It is imported
+# where images are decoded, so processes that never resize don't load it.
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Longest edge in pixels of what we send to the frame; 0 disables the transform
+FRAME_MAX_DIMENSION = int(os.getenv("FRAME_MAX_DIMENSION", 0))
+FRAME_JPEG_QUALITY = int(os.getenv("FRAME_JPEG_QUALITY", 85))
+FRAME_STRIP_METADATA = os.getenv("FRAME_STRIP_METADATA", "false").lower() in ("1", "true", "yes")
+TRANSFORM_WORKERS = max(1, int(os.getenv("TRANSFORM_WORKERS", os.cpu_count() or 1)))
+
+def resize_for_frame(src: str, dest: str, max_dimension: int, quality: int,
+                     strip_metadata: bool = False) -> Tuple[str, int, int]:
+    """
+    Downsample an image so its longest edge is at most max_dimension and save it as JPEG.
+
+    JPEGs are decoded directly at a reduced DCT scale (`Image.draft`), so a 48MP
+    photo never has to be held in memory at full resolution. Returns
+    (path, bytes before, bytes after); the path is src itself when
+    re-encoding would not make the file smaller.
+    """
+    from PIL import Image, ImageOps
+    src_bytes = os.path.getsize(src)
+    with Image.open(src) as im:
+        if im.format == "JPEG":
+            im.draft("RGB", (max_dimension, max_dimension))
+        exif = None if strip_metadata else im.info.get("exif")
+        icc_profile = im.info.get("icc_profile")
+        # Bake in the EXIF orientation, since stripped or rewritten metadata loses it
+        im = ImageOps.exif_transpose(im)
+        if exif and not strip_metadata:
+            exif_data = im.getexif()
+            exif_data.pop(0x0112, None)  # Orientation
+            exif = exif_data.tobytes()
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        save_args = {"quality": quality, "optimize": True, "progressive": True}
+        if exif:
+            save_args["exif"] = exif
+        if icc_profile:
+            save_args["icc_profile"] = icc_profile
+        im.save(dest, "JPEG", **save_args)
+    dest_bytes = os.path.getsize(dest)
+    if dest_bytes >= src_bytes and src.lower().endswith((".jpg", ".jpeg")) and not strip_metadata:
+        os.remove(dest)
+        return src, src_bytes, src_bytes
+    return dest, src_bytes, dest_bytes
+
+class FrameTransformer:
+    """
+    Resizes and recompresses exported photos for the frame on a process pool.
+
+    `transform(item)` takes and returns the (photo_uuid, paths) items used by
+    the sync pipeline, replacing each file with its frame-sized version.
+    """
+
+    def __init__(self, max_dimension: Optional[int] = None, quality: Optional[int] = None,
+                 strip_metadata: Optional[bool] = None, workers: Optional[int] = None):
+        self.max_dimension = FRAME_MAX_DIMENSION if max_dimension is None else max_dimension
+        self.quality = quality or FRAME_JPEG_QUALITY
+        self.strip_metadata = FRAME_STRIP_METADATA if strip_metadata is None else strip_metadata
+        self.workers = workers or TRANSFORM_WORKERS
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        if self.max_dimension <= 0:
+            return False
+        if not HAS_PILLOW:
+            logger.warning("FRAME_MAX_DIMENSION is set but Pillow is not installed; sending photos unchanged")
+            return False
+        return True
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def transform_file(self, path: str) -> str:
+        """Return the frame-sized version of path, removing the original if it was replaced."""
+        name = os.path.splitext(os.path.basename(path))[0]
+        dest = os.path.join(os.path.dirname(path), f"{name}_frame.jpg")
+        future = self._executor().submit(
+            resize_for_frame, path, dest, self.max_dimension, self.quality, self.strip_metadata
+        )
+        result, src_bytes, dest_bytes = future.result()
+        with self._lock:
+            self.files += 1
+            self.bytes_in += src_bytes
+            self.bytes_out += dest_bytes
+        if result != path:
+            workspace = get_workspace()
+            workspace.track([result])
+            workspace.remove([path])
+        return result
+
+    def transform(self, item) -> Tuple[str, List[str]]:
+        photo_uuid, paths = item
+        new_paths = []
+        for path in paths:
+            try:
+                new_paths.append(self.transform_file(path))
+            except Exception as e:
+                logger.error(f"Could not resize {os.path.basename(path)}, sending it as exported: {e}")
+                new_paths.append(path)
+        return photo_uuid, new_paths
+
+    def stats(self) -> dict:
+        return {
+            "files": self.files,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+        }
+
+    def format_stats(self) -> str:
+        saved = self.bytes_in - self.bytes_out
+        percent = 100 * saved / self.bytes_in if self.bytes_in else 0
+        return (f"{self.files} files, {self.bytes_in / 1e6:.1f} MB -> {self.bytes_out / 1e6:.1f} MB "
+                f"({saved / 1e6:.1f} MB / {percent:.0f}% saved)")
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
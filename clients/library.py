@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .metrics import LIBRARY_LOAD_SECONDS
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Optional explicit library path; defaults to the library osxphotos would open
+PHOTOS_LIBRARY = os.getenv("PHOTOS_LIBRARY")
+# Seconds between stat() checks of the library database files
+PHOTOS_LIBRARY_CHECK_INTERVAL = float(os.getenv("PHOTOS_LIBRARY_CHECK_INTERVAL", 2))
+
+# Files whose mtime/size change when Photos writes to the library
+LIBRARY_DB_FILES = ("database/Photos.sqlite", "database/Photos.sqlite-wal")
+
+def resolve_library_path(library_path=None):
+    """Return the Photos library path to use, or None if it can't be determined."""
+    if library_path or PHOTOS_LIBRARY:
+        return os.path.expanduser(library_path or PHOTOS_LIBRARY)
+    try:
+        from osxphotos.utils import get_last_library_path, get_system_library_path
+        return get_last_library_path() or get_system_library_path()
+    except Exception as e:
+        logger.debug(f"Could not determine Photos library path: {e}")
+        return None
+
+def library_file_key(library_path):
+    """
+    Default cache key: (relative path, mtime_ns, size) for each library database file.
+    Returns None when the library path is unknown, which keeps the current snapshot.
+    """
+    if not library_path:
+        return None
+    key = []
+    for name in LIBRARY_DB_FILES:
+        try:
+            st = os.stat(os.path.join(library_path, name))
+            key.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            key.append((name, None, None))
+    return tuple(key)
+
+def _default_loader(library_path):
+    import osxphotos
+    return osxphotos.PhotosDB(dbfile=library_path) if library_path else osxphotos.PhotosDB()
+
+class LibrarySnapshot:
+    """An opened PhotosDB together with the library state it was loaded from."""
+
+    def __init__(self, db, key, generation: int, load_seconds: float):
+        self.db = db
+        self.key = key
+        self.generation = generation
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+
+class LibrarySnapshotManager:
+    """
+    Process-wide cache of the opened Photos library.
+
+    The library is opened once and the same snapshot is handed to every caller.
+    It is reopened only when `key_func(library_path)` changes; the default key
+    watches the mtime and size of Photos.sqlite and its WAL file.
+    """
+
+    def __init__(self, library_path: Optional[str] = None,
+                 loader: Optional[Callable] = None,
+                 key_func: Optional[Callable] = None,
+                 check_interval: Optional[float] = None):
+        self.library_path = resolve_library_path(library_path)
+        self.loader = loader or _default_loader
+        self.key_func = key_func or library_file_key
+        self.check_interval = PHOTOS_LIBRARY_CHECK_INTERVAL if check_interval is None else check_interval
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._snapshot: Optional[LibrarySnapshot] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable] = []
+
+    def current_key(self):
+        return self.key_func(self.library_path)
+
+    def get(self) -> LibrarySnapshot:
+        """Return the current snapshot, reloading it if the library changed."""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                now = time.monotonic()
+                if now - self._last_check < self.check_interval:
+                    self.hits += 1
+                    return snapshot
+                self._last_check = now
+                key = self.current_key()
+                if key is None or key == snapshot.key:
+                    self.hits += 1
+                    return snapshot
+                logger.info("Photos library changed on disk, reloading snapshot")
+                self.reloads += 1
+            else:
+                self.misses += 1
+                key = self.current_key()
+            snapshot = self._load(key)
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Library reload listener failed: {e}")
+        return snapshot
+
+    def _load(self, key) -> LibrarySnapshot:
+        started = time.monotonic()
+        db = self.loader(self.library_path)
+        elapsed = time.monotonic() - started
+        LIBRARY_LOAD_SECONDS.observe(elapsed)
+        generation = self._snapshot.generation + 1 if self._snapshot else 1
+        self._snapshot = LibrarySnapshot(db, key, generation, elapsed)
+        self._last_check = time.monotonic()
+        logger.info(f"Loaded Photos library snapshot #{generation} in {elapsed:.1f}s ({self.stats()})")
+        return self._snapshot
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next `get()` reopens the library."""
+        with self._lock:
+            self._snapshot = None
+
+    def add_reload_listener(self, callback: Callable):
+        """Call `callback(snapshot)` after every (re)load."""
+        self._listeners.append(callback)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "generation": snapshot.generation if snapshot else 0,
+            "last_load_seconds": round(snapshot.load_seconds, 3) if snapshot else None,
+        }
+
+_manager: Optional[LibrarySnapshotManager] = None
+_manager_lock = threading.Lock()
+
+def get_library_manager() -> LibrarySnapshotManager:
+    """Return the process-wide snapshot manager, creating it on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = LibrarySnapshotManager()
+        return _manager
+
+def set_library_manager(manager: LibrarySnapshotManager):
+    """Replace the process-wide manager (e.g. with a fake library loader)."""
+    global _manager
+    with _manager_lock:
+        _manager = manager
+
+def get_photosdb():
+    """Return the shared PhotosDB for the current library snapshot."""
+    return get_library_manager().get().db
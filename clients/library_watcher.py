@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+from dotenv import load_dotenv
+from .library import LIBRARY_DB_FILES, library_file_key, resolve_library_path
+from .logger import setup_logger
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional; without it the database files are polled
+    FileSystemEventHandler = object
+    Observer = None
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Seconds without further writes before a change triggers a sync
+LIBRARY_WATCH_DEBOUNCE = float(os.getenv("LIBRARY_WATCH_DEBOUNCE", 30))
+# Longest a continuous burst of writes can hold a trigger back
+LIBRARY_WATCH_MAX_DELAY = float(os.getenv("LIBRARY_WATCH_MAX_DELAY", 300))
+# Seconds between stat() checks when watchdog is not installed
+LIBRARY_WATCH_POLL_INTERVAL = float(os.getenv("LIBRARY_WATCH_POLL_INTERVAL", 5))
+
+_DB_NAMES = tuple(os.path.basename(name) for name in LIBRARY_DB_FILES)
+
+class _DatabaseEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "LibraryWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        paths = [getattr(event, "src_path", ""), getattr(event, "dest_path", "")]
+        if any(os.path.basename(p).startswith(_DB_NAMES) for p in paths if p):
+            self.watcher.notify()
+
+class LibraryWatcher:
+    """
+    Calls `callback()` after the Photos library database has changed.
+
+    Changes to `database/Photos.sqlite` and its WAL are picked up with watchdog
+    (inotify/FSEvents) when it is installed, or by polling their mtime and size.
+    A burst of writes is debounced into one trigger once the files have been
+    quiet for `debounce` seconds (or after `max_delay` at most), and the
+    callback only fires if the files' key differs from the previous trigger.
+    """
+
+    def __init__(self, callback: Callable[[], None], library_path: Optional[str] = None,
+                 debounce: Optional[float] = None, max_delay: Optional[float] = None,
+                 poll_interval: Optional[float] = None, key_func: Optional[Callable] = None,
+                 use_watchdog: Optional[bool] = None):
+        self.callback = callback
+        self.library_path = resolve_library_path(library_path)
+        self.debounce = LIBRARY_WATCH_DEBOUNCE if debounce is None else debounce
+        self.max_delay = max(self.debounce, LIBRARY_WATCH_MAX_DELAY if max_delay is None else max_delay)
+        self.poll_interval = poll_interval or LIBRARY_WATCH_POLL_INTERVAL
+        self.key_func = key_func or library_file_key
+        self.use_watchdog = (Observer is not None) if use_watchdog is None else (use_watchdog and Observer is not None)
+        self.events = 0
+        self.triggers = 0
+        self._last_key = None
+        self._first_change: Optional[float] = None
+        self._last_change: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._observer = None
+
+    @property
+    def mode(self) -> str:
+        return "watchdog" if self.use_watchdog else "polling"
+
+    def start(self) -> bool:
+        """Start watching; returns False if the library path is unknown."""
+        if not self.library_path:
+            logger.warning("Photos library path unknown, not watching for changes")
+            return False
+        self._last_key = self.key_func(self.library_path)
+        if self.use_watchdog:
+            database_dir = os.path.join(self.library_path, os.path.dirname(LIBRARY_DB_FILES[0]))
+            self._observer = Observer()
+            self._observer.schedule(_DatabaseEventHandler(self), database_dir, recursive=False)
+            self._observer.start()
+        else:
+            self._spawn(self._poll, "library-watch-poll")
+        self._spawn(self._debounce_loop, "library-watch")
+        logger.info(
+            f"Watching {self.library_path} for changes ({self.mode}, debounce {self.debounce:g}s, "
+            f"max delay {self.max_delay:g}s)"
+        )
+        return True
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self):
+        """Record a write to the library; the debounce loop turns bursts into one trigger."""
+        now = time.monotonic()
+        with self._lock:
+            self.events += 1
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+        self._wake.set()
+
+    def _poll(self):
+        seen = self._last_key
+        while not self._stop.wait(self.poll_interval):
+            try:
+                key = self.key_func(self.library_path)
+            except Exception as e:
+                logger.debug(f"Could not stat the Photos library: {e}")
+                continue
+            if key != seen:
+                seen = key
+                self.notify()
+
+    def _debounce_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            while not self._stop.is_set():
+                with self._lock:
+                    if self._first_change is None:
+                        break
+                    now = time.monotonic()
+                    wait = min(self._last_change + self.debounce, self._first_change + self.max_delay) - now
+                    if wait <= 0:
+                        self._first_change = self._last_change = None
+                if wait > 0:
+                    self._stop.wait(wait)
+                    continue
+                self._fire()
+                break
+
+    def _fire(self):
+        key = self.key_func(self.library_path)
+        if key == self._last_key:
+            logger.debug("Library files were touched but are unchanged since the last trigger")
+            return
+        self._last_key = key
+        self.triggers += 1
+        logger.info(f"Photos library changed ({self.events} write events so far), triggering sync")
+        try:
+            self.callback()
+        except Exception as e:
+            logger.error(f"Library change callback failed: {e}")
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "events": self.events, "triggers": self.triggers}
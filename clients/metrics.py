@@ -0,0 +1,246 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Seconds; covers a cached export (milliseconds) up to a slow iCloud download or library load
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[Tuple[str, str], ...], object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> Tuple[Tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. photos sent."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+class Gauge(Counter):
+    """A value that can go up and down, e.g. a queue depth or a timestamp."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Distribution of observed values (usually seconds) over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (last one is +Inf), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block, also when it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    out.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), cumulative))
+                out.append((f"{self.name}_sum", key, total))
+                out.append((f"{self.name}_count", key, count))
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: (total, count) for key, (_, total, count) in self._values.items()}
+
+class Registry:
+    """All metrics of the process, rendered for Prometheus or diffed into a run summary."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return next((m for m in self._metrics if m.name == name), None)
+
+    def render(self) -> str:
+        """The Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in list(self._metrics)}
+
+    def summary(self, since: Optional[dict] = None) -> dict:
+        """
+        Counters and histograms as plain dicts, minus the values in `since` (an
+        earlier `snapshot()`), e.g. to report what a single run did. Non-zero
+        gauges are reported as their current value.
+        """
+        since = since or {}
+        out = {}
+        for metric in list(self._metrics):
+            before = since.get(metric.name, {})
+            rows = {}
+            for key, value in metric.snapshot().items():
+                label = ",".join(f"{k}={v}" for k, v in key) or "total"
+                if isinstance(metric, Histogram):
+                    total, count = value
+                    prev_total, prev_count = before.get(key, (0.0, 0))
+                    count -= prev_count
+                    total -= prev_total
+                    if count:
+                        rows[label] = {"count": count, "seconds": round(total, 3),
+                                       "mean_seconds": round(total / count, 3)}
+                elif isinstance(metric, Gauge):
+                    if value:
+                        rows[label] = value
+                else:
+                    delta = value - before.get(key, 0)
+                    if delta:
+                        rows[label] = delta
+            if rows:
+                out[metric.name] = rows
+        return out
+
+REGISTRY = Registry()
+
+# Library
+LIBRARY_LOAD_SECONDS = Histogram("aura_library_load_seconds", "Time to open the Photos library.")
+
+# Export (apple_photos)
+EXPORT_SECONDS = Histogram(
+    "aura_export_seconds", "Time to export one photo from the library; icloud=true includes the download.",
+    ("icloud",),
+)
+PHOTOS_EXPORTED = Counter("aura_photos_exported_total", "Photos exported, by source (cache or library).", ("source",))
+BYTES_EXPORTED = Counter("aura_export_bytes_total", "Bytes of JPEG produced by exports.", ("source",))
+EXPORT_FAILURES = Counter("aura_export_failures_total", "Photos that could not be exported.")
+
+# SMTP (email_uploader)
+SMTP_SEND_SECONDS = Histogram("aura_smtp_send_seconds", "Time to send one message, including reconnects.")
+SMTP_CONNECTIONS = Counter("aura_smtp_connections_total", "SMTP sessions opened.")
+SMTP_MESSAGES = Counter("aura_smtp_messages_total", "Messages sent, by result.", ("result",))
+PHOTOS_SENT = Counter("aura_photos_sent_total", "Photo files delivered in accepted messages.")
+BYTES_SENT = Counter("aura_sent_bytes_total", "Attachment bytes delivered in accepted messages.")
+
+# Gist (sync_tracker)
+GIST_REQUEST_SECONDS = Histogram("aura_gist_request_seconds", "Time of one Gist API round-trip.", ("op",))
+GIST_ERRORS = Counter("aura_gist_errors_total", "Failed Gist API round-trips.", ("op",))
+
+# Pipeline and jobs
+STAGE_SECONDS = Histogram("aura_stage_seconds", "Time a pipeline stage spent on one item.", ("stage",))
+QUEUE_DEPTH = Gauge("aura_pipeline_queue_depth", "Items waiting in front of a pipeline stage.", ("pipeline", "stage"))
+SYNC_JOBS = Gauge("aura_sync_jobs", "Sync jobs in the job queue, by status.", ("status",))
+ALBUM_SYNC_SECONDS = Histogram("aura_album_sync_seconds", "Wall time of one album sync.", ("album",))
+ALBUM_PHOTOS_SYNCED = Counter("aura_album_photos_synced_total", "Photos synced per album.", ("album",))
+ALBUM_LAST_SUCCESS = Gauge(
+    "aura_album_last_success_timestamp_seconds", "Unix time of the last successful sync of an album.", ("album",)
+)
+PHOTOS_DEDUPLICATED = Counter(
+    "aura_photos_deduplicated_total",
+    "Photos marked synced without sending because the image was already sent, by reason (album or content).",
+    ("reason",),
+)
+
+# Outbox
+OUTBOX_ITEMS = Gauge("aura_outbox_items", "Photos waiting in the outbox after a failed upload, by status.", ("status",))
+OUTBOX_RETRIES = Counter("aura_outbox_retries_total", "Outbox items retried, by result.", ("result",))
+
+# Thumbnails (face samples)
+THUMBNAIL_SECONDS = Histogram("aura_thumbnail_seconds", "Time to export and downsize one thumbnail.")
+THUMBNAILS = Counter("aura_thumbnails_total", "Thumbnail requests, by result (hit, generated or failed).", ("result",))
+
+# Send quota
+SEND_QUOTA_REMAINING = Gauge("aura_send_quota_remaining", "Messages left in each send quota window.", ("window",))
+SEND_QUOTA_WAIT_SECONDS = Histogram("aura_send_quota_wait_seconds", "Time a message waited for the send quota.")
+SEND_QUOTA_DENIED = Counter(
+    "aura_send_quota_denied_total", "Sends put off because the quota was used up, by limiting window.", ("window",)
+)
+PHOTOS_DEFERRED = Counter("aura_photos_deferred_total", "Photos left for a later run by the send quota.")
+
+# Destinations (frames)
+DESTINATION_PENDING = Gauge(
+    "aura_destination_pending_photos", "Photos of an album not yet delivered to a frame after its last sync.",
+    ("album", "destination"),
+)
+
+# Scratch workspace
+WORKSPACE_BYTES = Gauge("aura_workspace_bytes", "Bytes of exports in the scratch workspace.")
+WORKSPACE_WAIT_SECONDS = Histogram("aura_workspace_wait_seconds", "Time an export waited for room in the workspace.")
+WORKSPACE_SPILLS = Counter("aura_workspace_spills_total", "Exports written to the spill directory because the workspace was full.")
+WORKSPACE_DIRS_SWEPT = Counter("aura_workspace_dirs_swept_total", "Scratch directories of crashed runs removed on startup.")
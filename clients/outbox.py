@@ -0,0 +1,280 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+from dotenv import load_dotenv
+from .export_cache import link_or_copy
+from .logger import setup_logger
+from .metrics import OUTBOX_ITEMS, OUTBOX_RETRIES
+from .state import state_path
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# SQLite database of photos whose upload failed; files are kept next to it
+OUTBOX_PATH = os.getenv("OUTBOX_PATH")
+# Failed sends before an item is dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+# Delay before the first retry, doubled after every further failure up to OUTBOX_BACKOFF_MAX
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 60))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 6 * 3600))
+
+PENDING = "pending"
+DEAD = "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    photo_uuid TEXT NOT NULL,
+    album TEXT NOT NULL,
+    files TEXT NOT NULL DEFAULT '[]',
+    bytes INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (album, photo_uuid)
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+class Outbox:
+    """
+    Durable queue of exported photos whose upload failed.
+
+    Each item keeps hard links (or copies) of the exported files under
+    `<db dir>/outbox/<id>/`, so a retry sends them again without opening the
+    Photos library or exporting anything. Failed retries back off
+    exponentially; after `max_attempts` failed sends an item is dead-lettered
+    and stays put until it is requeued or discarded.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_attempts: Optional[int] = None,
+                 backoff_base: Optional[float] = None, backoff_max: Optional[float] = None):
+        self.path = path or OUTBOX_PATH or state_path("outbox.sqlite3")
+        self.files_dir = os.path.join(os.path.dirname(os.path.abspath(self.path)), "outbox")
+        self.max_attempts = max(1, max_attempts or OUTBOX_MAX_ATTEMPTS)
+        self.backoff_base = OUTBOX_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = OUTBOX_BACKOFF_MAX if backoff_max is None else backoff_max
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit; every write is a single statement. WAL lets the dashboard
+        # read while a sync in another process writes.
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._update_gauge()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait after the given number of failed sends."""
+        return min(self.backoff_max, self.backoff_base * 2 ** max(0, attempts - 1))
+
+    @staticmethod
+    def _item(row) -> dict:
+        item = dict(row)
+        item["files"] = json.loads(item["files"])
+        return item
+
+    def _update_gauge(self):
+        counts = {PENDING: 0, DEAD: 0}
+        for row in self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"):
+            counts[row[0]] = row[1]
+        for status, count in counts.items():
+            OUTBOX_ITEMS.set(count, status=status)
+
+    def _item_dir(self, item_id: int) -> str:
+        return os.path.join(self.files_dir, str(item_id))
+
+    def add(self, photo_uuid: str, album_name: str, paths: List[str], error: Optional[str] = None) -> Optional[int]:
+        """
+        Keep a photo whose first send just failed, linking its files into the
+        outbox. Returns the item id, or None if the files could not be kept.
+        """
+        now = time.time()
+        with self._lock:
+            existing = self._db.execute(
+                "SELECT id FROM outbox WHERE album = ? AND photo_uuid = ?", (album_name, photo_uuid)
+            ).fetchone()
+            if existing is not None:
+                # Already waiting (e.g. synced again by another process); count it as one more failure
+                self._failed(existing["id"], error, now)
+                return existing["id"]
+            item_id = self._db.execute(
+                "INSERT INTO outbox (photo_uuid, album, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (photo_uuid, album_name, now, now, now),
+            ).lastrowid
+            item_dir = self._item_dir(item_id)
+            try:
+                os.makedirs(item_dir, exist_ok=True)
+                files = [link_or_copy(p, item_dir) for p in paths]
+            except OSError as e:
+                logger.error(f"Could not keep files of {photo_uuid[:8]}... in the outbox: {e}")
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+                shutil.rmtree(item_dir, ignore_errors=True)
+                return None
+            size = sum(os.path.getsize(f) for f in files)
+            self._db.execute(
+                "UPDATE outbox SET files = ?, bytes = ? WHERE id = ?", (json.dumps(files), size, item_id)
+            )
+            self._failed(item_id, error, now)
+        logger.info(f"Queued {photo_uuid[:8]}... from '{album_name}' in the outbox ({len(files)} files)")
+        return item_id
+
+    def _failed(self, item_id: int, error: Optional[str], now: float):
+        row = self._db.execute("SELECT attempts FROM outbox WHERE id = ?", (item_id,)).fetchone()
+        attempts = row["attempts"] + 1
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = DEAD, now
+            logger.warning(f"Outbox item {item_id} failed {attempts} times, moved to dead letters: {error}")
+        else:
+            status, next_attempt_at = PENDING, now + self.backoff(attempts)
+        self._db.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+            "WHERE id = ?",
+            (status, attempts, next_attempt_at, error, now, item_id),
+        )
+        self._update_gauge()
+
+    def mark_failed(self, item_id: int, error: Optional[str] = None):
+        """Record a failed retry and schedule the next one (or dead-letter the item)."""
+        with self._lock:
+            self._failed(item_id, error, time.time())
+
+    def remove(self, item_id: int) -> bool:
+        """Drop an item and its files, after it was sent or when it is discarded."""
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM outbox WHERE id = ?", (item_id,)).rowcount
+            self._update_gauge()
+        shutil.rmtree(self._item_dir(item_id), ignore_errors=True)
+        return bool(deleted)
+
+    def requeue(self, item_id: Optional[int] = None) -> int:
+        """Give dead-lettered items (one, or all) a fresh set of attempts, due now."""
+        now = time.time()
+        query = "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ?"
+        params = [PENDING, now, now, DEAD]
+        if item_id is not None:
+            query += " AND id = ?"
+            params.append(item_id)
+        with self._lock:
+            count = self._db.execute(query, params).rowcount
+            self._update_gauge()
+        return count
+
+    def due(self, album_name: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """Pending items whose backoff has expired, oldest first."""
+        query = "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ?"
+        params: list = [PENDING, time.time()]
+        if album_name is not None:
+            query += " AND album = ?"
+            params.append(album_name)
+        query += " ORDER BY next_attempt_at, id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [self._item(row) for row in self._db.execute(query, params)]
+
+    def held_uuids(self, album_name: str) -> Set[str]:
+        """Photos of an album that sit in the outbox (pending or dead) and must not be exported again."""
+        with self._lock:
+            rows = self._db.execute("SELECT photo_uuid FROM outbox WHERE album = ?", (album_name,))
+            return {row[0] for row in rows}
+
+    def items(self, status: Optional[str] = None, limit: int = 100) -> List[dict]:
+        query = "SELECT * FROM outbox"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += f" ORDER BY created_at LIMIT {int(limit)}"
+        with self._lock:
+            return [self._item(row) for row in self._db.execute(query, params)]
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT"
+                " SUM(status = 'pending'), SUM(status = 'dead'),"
+                " SUM(status = 'pending' AND next_attempt_at <= ?), SUM(bytes),"
+                " MIN(created_at), MIN(CASE WHEN status = 'pending' THEN next_attempt_at END)"
+                " FROM outbox",
+                (now,),
+            ).fetchone()
+        pending, dead, due, size, oldest, next_attempt = row
+        return {
+            "pending": pending or 0,
+            "dead": dead or 0,
+            "due": due or 0,
+            "bytes": size or 0,
+            "oldest_created_at": oldest,
+            "next_attempt_at": next_attempt,
+        }
+
+    def retry(self, uploader, on_sent: Callable[[dict], None], album_name: Optional[str] = None,
+              limit: Optional[int] = None) -> Dict[str, int]:
+        """
+        Send due items through `uploader` (an SMTPUploader), packing them into
+        messages like a normal sync. `on_sent(item)` runs for every item
+        delivered, before it is removed from the outbox. Items held back by
+        the send quota stay due and don't count as failed attempts.
+        """
+        counts = {"sent": 0, "failed": 0, "dropped": 0, "deferred": 0}
+        items = {}
+
+        def settle(done):
+            for item_id, _, sent in done:
+                item = items.pop(item_id)
+                if sent:
+                    on_sent(item)
+                    self.remove(item_id)
+                    counts["sent"] += 1
+                elif getattr(uploader, "quota_exhausted", False):
+                    counts["deferred"] += 1
+                else:
+                    self.mark_failed(item_id, getattr(uploader, "last_error", None))
+                    counts["failed"] += 1
+
+        for item in self.due(album_name, limit):
+            if getattr(uploader, "quota_exhausted", False):
+                break
+            missing = [f for f in item["files"] if not os.path.exists(f)]
+            if missing or not item["files"]:
+                # Nothing left to send; dropping the item lets the next sync export the photo again
+                logger.warning(f"Outbox item {item['id']} lost its files, dropping it: {', '.join(missing)}")
+                self.remove(item["id"])
+                counts["dropped"] += 1
+                continue
+            items[item["id"]] = item
+            settle(uploader.add(item["id"], item["files"]))
+        settle(uploader.flush())
+        for result, count in counts.items():
+            if count:
+                OUTBOX_RETRIES.inc(count, result=result)
+        if any(counts.values()):
+            logger.info(
+                f"Outbox retry{f' for {album_name!r}' if album_name else ''}: {counts['sent']} sent, "
+                f"{counts['failed']} failed, {counts['dropped']} dropped, {counts['deferred']} deferred"
+            )
+        return counts
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> Outbox:
+    """Return the process-wide outbox, opening it on first use."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
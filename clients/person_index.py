@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+from .library import LibrarySnapshot, get_library_manager
+from .logger import setup_logger
+from .state import state_path
+
+logger = setup_logger(__name__)
+
+INDEX_VERSION = 1
+
+def _epoch(value) -> float:
+    try:
+        return value.timestamp() if value else 0.0
+    except (AttributeError, OverflowError, OSError, ValueError):
+        return 0.0
+
+class PersonIndex:
+    """
+    Inverted index from person name to photo UUIDs, newest photo first.
+
+    Built from a library snapshot and saved to disk. When the library changes,
+    every photo's persons are read again (naming or tagging a face doesn't
+    change a photo's modification date), but the by-person lists are only
+    rebuilt if some photo's entry actually changed.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or state_path("person_index.json")
+        self.generation = 0
+        self.library_key = None
+        # uuid -> [date epoch, date_modified epoch, [person names]]
+        self._photos: Dict[str, list] = {}
+        # name -> [uuid, ...] sorted newest first
+        self._by_person: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return
+            self._photos = data["photos"]
+            self.library_key = data.get("library_key")
+            self._rebuild()
+            logger.info(f"Loaded person index: {len(self._by_person)} people, {len(self._photos)} photos")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable person index {self.path}: {e}")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "library_key": self.library_key, "photos": self._photos}, f)
+        os.replace(tmp_path, self.path)
+
+    def _rebuild(self):
+        by_person: Dict[str, List[str]] = {}
+        for uuid, (date, _, persons) in self._photos.items():
+            for name in persons:
+                by_person.setdefault(name, []).append(uuid)
+        for uuids in by_person.values():
+            uuids.sort(key=lambda u: self._photos[u][0], reverse=True)
+        self._by_person = by_person
+
+    @staticmethod
+    def _key_json(key):
+        # Snapshot keys are tuples; compare them the way they round-trip through JSON
+        return json.loads(json.dumps(key))
+
+    def update(self, snapshot: LibrarySnapshot):
+        """Bring the index up to date with a library snapshot."""
+        with self._lock:
+            if snapshot.generation == self.generation:
+                return
+            key = self._key_json(snapshot.key)
+            if key is not None and key == self.library_key and self._photos:
+                # Saved index already matches this library state
+                self.generation = snapshot.generation
+                return
+            photos = {}
+            changed = 0
+            for photo in snapshot.db.photos():
+                persons = [name for name in (photo.persons or []) if name]
+                entry = [_epoch(getattr(photo, "date", None)), _epoch(getattr(photo, "date_modified", None)), persons]
+                previous = self._photos.get(photo.uuid)
+                if previous == entry:
+                    photos[photo.uuid] = previous
+                    continue
+                photos[photo.uuid] = entry
+                changed += 1
+            removed = len(set(self._photos) - set(photos))
+            self._photos = photos
+            if changed or removed:
+                self._rebuild()
+            self.library_key = key
+            self.generation = snapshot.generation
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning(f"Could not save person index: {e}")
+            logger.info(
+                f"Updated person index: {len(self._by_person)} people, {len(photos)} photos "
+                f"({changed} changed, {removed} removed)"
+            )
+
+    def names(self) -> List[str]:
+        return sorted(self._by_person)
+
+    def people(self) -> List[dict]:
+        """Every person with their photo count and the date of their newest photo."""
+        people = []
+        for name, uuids in self._by_person.items():
+            people.append({
+                "name": name,
+                "photo_count": len(uuids),
+                "newest": self._photos[uuids[0]][0] if uuids else None,
+            })
+        people.sort(key=lambda p: p["name"].lower())
+        return people
+
+    def uuids_for(self, name: str, limit: Optional[int] = None, newest: bool = True) -> List[str]:
+        uuids = self._by_person.get(name, [])
+        if not newest:
+            uuids = uuids[::-1]
+        return list(uuids[:limit] if limit else uuids)
+
+_index: Optional[PersonIndex] = None
+_index_lock = threading.Lock()
+
+def get_person_index() -> PersonIndex:
+    """Return the shared person index, updated to the current library snapshot."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PersonIndex()
+    _index.update(get_library_manager().get())
+    return _index
@@ -0,0 +1,314 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .metrics import QUEUE_DEPTH, STAGE_SECONDS
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Max items waiting between two stages
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+# Seconds between progress reports while a pipeline is running
+PIPELINE_REPORT_INTERVAL = float(os.getenv("PIPELINE_REPORT_INTERVAL", 30))
+
+_DONE = object()
+# Stands in for an item a stage dropped, so ordered stages further down don't wait for it
+_DROPPED = object()
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    `func(item)` returns the item to pass downstream, or None to drop it.
+    Exceptions are logged and counted and only drop the item that raised.
+    Dropped items leave a marker in the stream, so ordered stages further
+    down move past them instead of waiting.
+    With several workers, `ordered=True` passes results on in source order.
+    `on_finish()` runs once after the last item and may return one final item,
+    e.g. for stages that buffer items into batches. `on_idle()` runs whenever
+    no item has arrived for `idle_timeout()` seconds (None: until the next
+    item) and may return an item too, so buffering stages can keep a bound
+    on how long they hold items while upstream is slow.
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, ordered: bool = False,
+                 on_finish: Optional[Callable] = None, on_idle: Optional[Callable] = None,
+                 idle_timeout: Optional[Callable[[], Optional[float]]] = None):
+        self.name = name
+        self.func = func
+        self.on_finish = on_finish
+        self.on_idle = on_idle
+        self.idle_timeout = idle_timeout
+        self.workers = max(1, workers)
+        self.ordered = ordered and self.workers > 1
+        # Per worker thread: [items, busy seconds]
+        self.worker_stats: Dict[str, List[float]] = {}
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Reorder buffer for ordered stages: seq -> result (None if dropped)
+        self._next_seq = 0
+        self._held: Dict[int, object] = {}
+        # Runs of in-order results taken from the buffer are passed on in ticket order
+        self._tickets = 0
+        self._emitted = 0
+        self._emit_turn = threading.Condition()
+
+    def stats(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        wall = end - self.started_at if self.started_at else 0.0
+        return {
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_sec": round(self.processed / wall, 3) if wall > 0 else 0.0,
+        }
+
+    def format_worker_stats(self) -> str:
+        return ", ".join(
+            f"{worker}: {int(count)} items in {seconds:.1f}s"
+            + (f" ({seconds / count:.2f}s/item)" if count else "")
+            for worker, (count, seconds) in sorted(self.worker_stats.items())
+        )
+
+class Pipeline:
+    """
+    Runs items from a source iterable through stages connected by bounded queues.
+
+    Every stage runs in its own thread(s), so stage N+1 starts on the first
+    item as soon as stage N has produced it. The queues block producers when
+    a downstream stage falls behind, which keeps in-flight work bounded.
+    """
+
+    def __init__(self, name: str, source: Iterable, stages: List[Stage],
+                 queue_size: Optional[int] = None):
+        self.name = name
+        self.source = source
+        self.stages = stages
+        queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        # queues[i] feeds stages[i]; the last queue collects final results
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.queues.append(queue.Queue())
+        self.max_depth = [0] * len(stages)
+        self.source_count = 0
+        self.source_error: Optional[Exception] = None
+        self.started_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._remaining = [stage.workers for stage in stages]
+        self._remaining_lock = threading.Lock()
+
+    def stop(self):
+        """Ask the source and all stages to stop after the items in flight."""
+        self._stop.set()
+
+    def _put(self, index: int, item) -> bool:
+        q = self.queues[index]
+        while True:
+            if self._stop.is_set() and item is not _DONE:
+                return False
+            try:
+                q.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        if index < len(self.max_depth):
+            depth = q.qsize()
+            self.max_depth[index] = max(self.max_depth[index], depth)
+            QUEUE_DEPTH.set(depth, pipeline=self.name, stage=self.stages[index].name)
+        return True
+
+    def _produce(self):
+        try:
+            for seq, item in enumerate(self.source):
+                if self._stop.is_set():
+                    break
+                self.source_count += 1
+                if not self._put(0, (seq, item)):
+                    break
+        except Exception as e:
+            logger.error(f"[{self.name}] Source failed: {e}")
+            self.source_error = e
+        finally:
+            self._put(0, _DONE)
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        while True:
+            try:
+                item = inbox.get(timeout=self._idle_timeout(stage))
+            except queue.Empty:
+                self._idle(index)
+                continue
+            if item is _DONE:
+                # Let sibling workers see the sentinel too; the last one passes it on
+                inbox.put(_DONE)
+                with self._remaining_lock:
+                    self._remaining[index] -= 1
+                    last = self._remaining[index] == 0
+                if last:
+                    if stage.on_finish and not self._stop.is_set():
+                        try:
+                            result = stage.on_finish()
+                            if result is not None:
+                                self._put(index + 1, (self.source_count, result))
+                        except Exception as e:
+                            logger.error(f"[{self.name}] Stage '{stage.name}' failed to finish: {e}")
+                            stage.errors += 1
+                    stage.finished_at = time.monotonic()
+                    self._put(index + 1, _DONE)
+                return
+            if self._stop.is_set():
+                continue
+            QUEUE_DEPTH.set(inbox.qsize(), pipeline=self.name, stage=stage.name)
+            seq, item = item
+            if item is _DROPPED:
+                if stage.ordered:
+                    self._emit_ordered(index, seq, None)
+                else:
+                    self._put(index + 1, (seq, _DROPPED))
+                continue
+            started = time.monotonic()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logger.error(f"[{self.name}] Stage '{stage.name}' failed on an item: {e}")
+                result = None
+                with stage._lock:
+                    stage.errors += 1
+            elapsed = time.monotonic() - started
+            STAGE_SECONDS.observe(elapsed, stage=stage.name)
+            with stage._lock:
+                stage.busy_seconds += elapsed
+                stage.processed += 1
+                if result is None:
+                    stage.dropped += 1
+                worker = stage.worker_stats.setdefault(threading.current_thread().name, [0, 0.0])
+                worker[0] += 1
+                worker[1] += elapsed
+            if seq is None:
+                # Items from on_idle() have no place in the source order
+                if result is not None:
+                    self._put(index + 1, (None, result))
+            elif stage.ordered:
+                self._emit_ordered(index, seq, result)
+            else:
+                self._put(index + 1, (seq, _DROPPED if result is None else result))
+
+    def _idle_timeout(self, stage: Stage) -> Optional[float]:
+        if stage.on_idle is None or stage.idle_timeout is None or self._stop.is_set():
+            return None
+        try:
+            return stage.idle_timeout()
+        except Exception as e:
+            logger.error(f"[{self.name}] Stage '{stage.name}' failed to report its idle timeout: {e}")
+            return None
+
+    def _idle(self, index: int):
+        stage = self.stages[index]
+        try:
+            result = stage.on_idle()
+        except Exception as e:
+            logger.error(f"[{self.name}] Stage '{stage.name}' failed while idle: {e}")
+            with stage._lock:
+                stage.errors += 1
+            return
+        if result is not None:
+            self._put(index + 1, (None, result))
+
+    def _emit_ordered(self, index: int, seq: int, result):
+        """Hold results until every earlier item has been emitted or dropped."""
+        stage = self.stages[index]
+        with stage._lock:
+            stage._held[seq] = result
+            ready = []
+            while stage._next_seq in stage._held:
+                ready.append((stage._next_seq, stage._held.pop(stage._next_seq)))
+                stage._next_seq += 1
+            if not ready:
+                return
+            ticket = stage._tickets
+            stage._tickets += 1
+        # Put outside the stage lock: when downstream is full, only workers with
+        # later runs to pass on wait; the others go on to their next items
+        with stage._emit_turn:
+            stage._emit_turn.wait_for(lambda: stage._emitted == ticket)
+            try:
+                for ready_seq, ready_result in ready:
+                    self._put(index + 1, (ready_seq, _DROPPED if ready_result is None else ready_result))
+            finally:
+                stage._emitted += 1
+                stage._emit_turn.notify_all()
+
+    def _report(self, done: threading.Event):
+        while not done.wait(PIPELINE_REPORT_INTERVAL):
+            logger.info(f"[{self.name}] Progress: {self.format_stats()}")
+
+    def run(self) -> list:
+        """Run the pipeline to completion and return the last stage's outputs in arrival order."""
+        self.started_at = time.monotonic()
+        for stage in self.stages:
+            stage.started_at = self.started_at
+        threads = [threading.Thread(target=self._produce, name=f"{self.name}-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(index,), name=f"{self.name}-{stage.name}-{n}", daemon=True
+                ))
+        done = threading.Event()
+        reporter = threading.Thread(target=self._report, args=(done,), name=f"{self.name}-report", daemon=True)
+        for thread in threads:
+            thread.start()
+        reporter.start()
+
+        results = []
+        out = self.queues[-1]
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            if item[1] is not _DROPPED:
+                results.append(item[1])
+        for thread in threads:
+            thread.join()
+        done.set()
+        for stage in self.stages:
+            QUEUE_DEPTH.set(0, pipeline=self.name, stage=stage.name)
+        logger.info(f"[{self.name}] Finished: {self.format_stats()}")
+        for stage in self.stages:
+            if stage.workers > 1:
+                logger.info(f"[{self.name}] Stage '{stage.name}' worker timing: {stage.format_worker_stats()}")
+        return results
+
+    def _depth(self, index: int) -> int:
+        # A finished stage's queue only holds the end-of-stream marker
+        return 0 if self.stages[index].finished_at else self.queues[index].qsize()
+
+    def stats(self) -> dict:
+        return {
+            "source_items": self.source_count,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 3) if self.started_at else 0.0,
+            "stages": {
+                stage.name: dict(stage.stats(), queue_depth=self._depth(i), max_queue_depth=self.max_depth[i])
+                for i, stage in enumerate(self.stages)
+            },
+        }
+
+    def format_stats(self) -> str:
+        parts = [f"source={self.source_count}"]
+        for i, stage in enumerate(self.stages):
+            s = stage.stats()
+            parts.append(
+                f"{stage.name}: {s['processed']} done, {s['errors']} errors, "
+                f"{s['items_per_sec']}/s, queue {self._depth(i)} (max {self.max_depth[i]})"
+            )
+        return "; ".join(parts)
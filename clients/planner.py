@@ -0,0 +1,292 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from .apple_photos import order_photos, plan_album
+from .destinations import get_routing
+from .email_uploader import EMAIL_MAX_ATTACHMENTS, EMAIL_MAX_BYTES
+from .frame_transform import FRAME_MAX_DIMENSION
+from .logger import setup_logger
+from .outbox import get_outbox
+from .send_quota import get_send_quota
+from .state import state_path
+from .sync_tracker import SyncTracker
+
+logger = setup_logger(__name__)
+
+# HEIC originals come out of the JPEG conversion roughly this much larger
+HEIC_TO_JPEG = 2.0
+# JPEG bytes per pixel when neither the file nor its size is known (about 3 MB for 12 MP)
+JPEG_BYTES_PER_PIXEL = 0.25
+# Album syncs kept for the throughput estimate
+HISTORY_RUNS = 20
+
+def estimate_photo_bytes(photo) -> Optional[int]:
+    """
+    Bytes the exported JPEG of a photo is likely to have, from library
+    metadata only: the original's size (converted from HEIC if need be) or
+    its pixel count, scaled down when FRAME_MAX_DIMENSION will resize it.
+    None if the library says nothing about the photo's size.
+    """
+    size = getattr(photo, 'original_filesize', None)
+    if not size:
+        path = getattr(photo, 'path', None)
+        try:
+            size = os.path.getsize(path) if path else None
+        except OSError:
+            size = None
+    width = getattr(photo, 'width', None) or getattr(photo, 'original_width', None)
+    height = getattr(photo, 'height', None) or getattr(photo, 'original_height', None)
+    if not size and width and height:
+        size = width * height * JPEG_BYTES_PER_PIXEL
+    if not size:
+        return None
+    name = (getattr(photo, 'original_filename', None) or getattr(photo, 'filename', None) or "").lower()
+    if name.endswith((".heic", ".heif")):
+        size *= HEIC_TO_JPEG
+    longest = max(width or 0, height or 0)
+    if FRAME_MAX_DIMENSION and longest > FRAME_MAX_DIMENSION:
+        size *= (FRAME_MAX_DIMENSION / longest) ** 2
+    return int(size)
+
+def needs_download(photo) -> bool:
+    """True if the photo's original is only in iCloud, so exporting it downloads it first."""
+    return bool(getattr(photo, 'incloud', False) or getattr(photo, 'ismissing', False))
+
+class ThroughputHistory:
+    """
+    Photos, bytes and wall time of the last few album syncs, kept on disk, so
+    the planner can project how long a sync will take.
+    """
+
+    def __init__(self, path: Optional[str] = None, runs: int = HISTORY_RUNS):
+        self.path = path or state_path("throughput.json")
+        self.runs = runs
+        self._lock = threading.Lock()
+
+    def _load(self) -> List[dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)["runs"]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable throughput history {self.path}: {e}")
+            return []
+
+    def record(self, photos: int, size: int, seconds: float):
+        """Add one album sync that exported and sent `photos` photos of `size` bytes in `seconds`."""
+        if photos <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            runs = self._load()
+            runs.append({"at": int(time.time()), "photos": photos, "bytes": size, "seconds": round(seconds, 3)})
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump({"runs": runs[-self.runs:]}, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save throughput history: {e}")
+
+    def rates(self) -> Optional[dict]:
+        """Seconds per photo and bytes per second over the recorded syncs; None without history."""
+        with self._lock:
+            runs = self._load()
+        photos = sum(r["photos"] for r in runs)
+        seconds = sum(r["seconds"] for r in runs)
+        if not photos or not seconds:
+            return None
+        return {
+            "runs": len(runs),
+            "seconds_per_photo": seconds / photos,
+            "bytes_per_second": sum(r["bytes"] for r in runs) / seconds,
+        }
+
+_history: Optional[ThroughputHistory] = None
+_history_lock = threading.Lock()
+
+def get_throughput_history() -> ThroughputHistory:
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = ThroughputHistory()
+        return _history
+
+def _project_seconds(photos: int, size: int, unknown: int, rates: Optional[dict]) -> Optional[float]:
+    if not photos:
+        return 0.0
+    if rates is None:
+        return None
+    by_count = photos * rates["seconds_per_photo"]
+    if unknown or not rates["bytes_per_second"]:
+        return by_count
+    # Photos much larger (or smaller) than usual take correspondingly longer
+    return max(size / rates["bytes_per_second"], by_count * 0.5)
+
+def _messages(photos: int, size: int) -> int:
+    # Attachments are base64-encoded: 4 bytes on the wire for every 3
+    return max(math.ceil(photos / max(1, EMAIL_MAX_ATTACHMENTS)), math.ceil(size * 4 / 3 / EMAIL_MAX_BYTES))
+
+def plan_sync(album_names: List[str], sync_tracker, snapshot=None, routing=None, outbox=None,
+              detail: int = 50) -> dict:
+    """
+    What a sync of album_names would do, worked out from library metadata and
+    sync state alone: nothing is exported or sent and the sync state is
+    left as it is. Per album it
+    lists the photos that would be sent (the first `detail` of them, in send
+    order), their estimated bytes, those that must be downloaded from
+    iCloud first, and the projected run time at recent throughput. Content
+    duplicates only show up when photos are exported, so they aren't
+    counted here.
+    """
+    started = time.monotonic()
+    routing = routing or get_routing()
+    outbox = outbox if outbox is not None else get_outbox()
+    rates = get_throughput_history().rates()
+    albums = []
+    for album_name in album_names:
+        destinations = routing.for_album(album_name)
+        if not destinations:
+            albums.append({"album_name": album_name, "found": False, "error": "not routed to any frame"})
+            continue
+        plans = {d.name: plan_album(album_name, sync_tracker, snapshot, held=outbox.held_uuids(d.record(album_name)),
+                                    destination=d.name, remember=False)
+                 for d in destinations}
+        if not all(p.found for p in plans.values()):
+            albums.append({"album_name": album_name, "found": False, "error": "not found"})
+            continue
+        needed: Dict[str, List[str]] = {}
+        photos = {}
+        for name, plan in plans.items():
+            for photo in plan.photos:
+                needed.setdefault(photo.uuid, []).append(name)
+                photos[photo.uuid] = photo
+        items = []
+        size = unknown = icloud = 0
+        for photo in order_photos(photos.values()):
+            photo_bytes = estimate_photo_bytes(photo)
+            download = needs_download(photo)
+            size += photo_bytes or 0
+            unknown += photo_bytes is None
+            icloud += download
+            if len(items) < detail:
+                date = getattr(photo, 'date', None)
+                items.append({
+                    "uuid": photo.uuid,
+                    "filename": getattr(photo, 'original_filename', None) or getattr(photo, 'filename', None),
+                    "date": date.isoformat() if date else None,
+                    "bytes": photo_bytes,
+                    "icloud": download,
+                    "destinations": needed[photo.uuid],
+                })
+        albums.append({
+            "album_name": album_name,
+            "found": True,
+            "unchanged": all(p.unchanged for p in plans.values()),
+            "destinations": [d.name for d in destinations],
+            "photos": len(photos),
+            "deliveries": sum(len(names) for names in needed.values()),
+            "already_sent_elsewhere": sum(len(p.duplicates) for p in plans.values()),
+            "in_outbox": sum(p.held for p in plans.values()),
+            "bytes": size,
+            "unknown_size": unknown,
+            "icloud": icloud,
+            "messages": _messages(len(photos), size),
+            "seconds": _project_seconds(len(photos), size, unknown, rates),
+            "items": items,
+        })
+    found = [a for a in albums if a["found"]]
+    totals = {
+        "photos": sum(a["photos"] for a in found),
+        "deliveries": sum(a["deliveries"] for a in found),
+        "bytes": sum(a["bytes"] for a in found),
+        "icloud": sum(a["icloud"] for a in found),
+        "messages": sum(a["messages"] for a in found),
+    }
+    seconds = [a["seconds"] for a in found]
+    totals["seconds"] = None if None in seconds else round(sum(seconds), 1)
+    quota = get_send_quota()
+    available = quota.messages_available()
+    totals["quota"] = dict(quota.stats(), messages_available=available,
+                           fits=available is None or totals["messages"] <= available)
+    if "day" in quota.limits:
+        # Days of sending at the daily limit, counting today's remainder
+        rest = max(0, totals["messages"] - (available or 0))
+        totals["quota"]["days"] = (1 if totals["messages"] else 0) + math.ceil(rest / quota.limits["day"][1])
+    return {
+        "albums": albums,
+        "totals": totals,
+        "throughput": rates,
+        "planned_in_seconds": round(time.monotonic() - started, 3),
+    }
+
+def configured_albums() -> List[str]:
+    """The albums in SYNC_ALBUMS."""
+    return [name.strip() for name in os.getenv("SYNC_ALBUMS", "").split(",") if name.strip()]
+
+def dry_run(album_names: Optional[List[str]] = None, detail: int = 50) -> dict:
+    """plan_sync for album_names (SYNC_ALBUMS by default) with a read-only tracker of its own."""
+    sync_tracker = SyncTracker(read_only=True)
+    try:
+        return plan_sync(album_names or configured_albums(), sync_tracker, detail=detail)
+    finally:
+        sync_tracker.close()
+
+def _size(value: int) -> str:
+    return f"{value / 1048576:.1f} MB"
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "unknown (no sync history yet)"
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def format_plan(plan: dict, items: bool = False) -> str:
+    """A plan as text for the terminal."""
+    lines = []
+    for album in plan["albums"]:
+        if not album["found"]:
+            lines.append(f"{album['album_name']}: {album['error']}")
+            continue
+        if album["unchanged"]:
+            lines.append(f"{album['album_name']}: unchanged since its last complete sync")
+            continue
+        lines.append(
+            f"{album['album_name']}: {album['photos']} photos to send to {', '.join(album['destinations'])}, "
+            f"about {_size(album['bytes'])} in {album['messages']} messages, "
+            f"{album['icloud']} to download from iCloud, {_duration(album['seconds'])}"
+        )
+        if album["already_sent_elsewhere"] or album["in_outbox"]:
+            lines.append(f"  {album['already_sent_elsewhere']} already sent from another album, "
+                         f"{album['in_outbox']} waiting in the outbox")
+        if items:
+            for item in album["items"]:
+                size = _size(item["bytes"]) if item["bytes"] is not None else "size unknown"
+                note = ", iCloud" if item["icloud"] else ""
+                lines.append(f"  - {item['date'] or '?'} {item['filename']} ({size}{note})")
+            if album["photos"] > len(album["items"]):
+                lines.append(f"  ... and {album['photos'] - len(album['items'])} more")
+    totals = plan["totals"]
+    lines.append(
+        f"Total: {totals['photos']} photos, about {_size(totals['bytes'])} in {totals['messages']} messages, "
+        f"{totals['icloud']} from iCloud, {_duration(totals['seconds'])}"
+    )
+    quota = totals["quota"]
+    if quota.get("enabled"):
+        available = quota["messages_available"]
+        if quota["fits"]:
+            left = f" ({available} messages left)" if available is not None else ""
+            lines.append(f"Fits the send quota{left}")
+        else:
+            lines.append(f"Exceeds the send quota: {available} messages left now, "
+                         f"the rest goes out over later runs")
+        if "days" in quota:
+            lines.append(f"About {quota['days']} day(s) of sending at {quota['limits']['day']} messages a day")
+    lines.append(f"(planned in {plan['planned_in_seconds']:.2f}s)")
+    return "\n".join(lines)
@@ -0,0 +1,230 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .metrics import SEND_QUOTA_DENIED, SEND_QUOTA_REMAINING, SEND_QUOTA_WAIT_SECONDS
+from .state import state_path
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Messages the mail provider accepts per rolling minute, hour and day; 0 means no limit.
+# Gmail allows roughly 500 messages a day from a personal account.
+SEND_QUOTA_PER_MINUTE = int(os.getenv("SEND_QUOTA_PER_MINUTE", 0))
+SEND_QUOTA_PER_HOUR = int(os.getenv("SEND_QUOTA_PER_HOUR", 0))
+SEND_QUOTA_PER_DAY = int(os.getenv("SEND_QUOTA_PER_DAY", 0))
+# Longest a send waits for the quota before the rest is left for a later run
+SEND_QUOTA_MAX_WAIT = float(os.getenv("SEND_QUOTA_MAX_WAIT", 60))
+
+WINDOWS = (("minute", 60), ("hour", 3600), ("day", 86400))
+QUOTA_VERSION = 1
+
+class SendQuota:
+    """
+    Rolling per-minute, per-hour and per-day message budgets for the SMTP
+    account, shared by everything that sends.
+
+    Every message takes one slot through `acquire()`, which waits (up to
+    `max_wait`) when a window is full and paces sends evenly across the
+    minute when a per-minute budget is set. Send times are saved to disk, so
+    the budget survives restarts and is seen by other processes on the same
+    machine; a lock file next to them keeps two processes from taking the
+    same slot.
+    """
+
+    def __init__(self, path: Optional[str] = None, per_minute: Optional[int] = None, per_hour: Optional[int] = None,
+                 per_day: Optional[int] = None, max_wait: Optional[float] = None):
+        budgets = {
+            "minute": SEND_QUOTA_PER_MINUTE if per_minute is None else per_minute,
+            "hour": SEND_QUOTA_PER_HOUR if per_hour is None else per_hour,
+            "day": SEND_QUOTA_PER_DAY if per_day is None else per_day,
+        }
+        # window -> (seconds, messages), for the windows that have a limit
+        self.limits = {name: (seconds, budgets[name]) for name, seconds in WINDOWS if budgets[name] > 0}
+        self.max_wait = SEND_QUOTA_MAX_WAIT if max_wait is None else max_wait
+        self.path = path or state_path("send_quota.json")
+        self.lock_path = self.path + ".lock"
+        self.denied = 0
+        self._sent = deque()
+        self._mtime = None
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._load()
+            self._update_gauges(time.time())
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the quota against other threads and, through the lock file, other processes."""
+        with self._lock, open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+            # Every save replaces the file, so a new inode means new contents even within one mtime tick
+            mtime = (st.st_ino, st.st_mtime_ns)
+            if mtime == self._mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == QUOTA_VERSION:
+                self._sent = deque(sorted(data["sent"]))
+            self._mtime = mtime
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable send quota state {self.path}: {e}")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"version": QUOTA_VERSION, "sent": list(self._sent)}, f)
+            os.replace(tmp_path, self.path)
+            st = os.stat(self.path)
+            self._mtime = (st.st_ino, st.st_mtime_ns)
+        except OSError as e:
+            logger.warning(f"Could not save send quota state: {e}")
+
+    def _prune(self, now: float):
+        horizon = now - max(seconds for seconds, _ in self.limits.values())
+        while self._sent and self._sent[0] <= horizon:
+            self._sent.popleft()
+
+    def _used(self, seconds: int, now: float) -> int:
+        count = 0
+        for sent_at in reversed(self._sent):
+            if sent_at <= now - seconds:
+                break
+            count += 1
+        return count
+
+    def _wait(self, now: float):
+        """Seconds until the next send is allowed, and the window that holds it back."""
+        wait, window = 0.0, None
+        for name, (seconds, limit) in self.limits.items():
+            used = self._used(seconds, now)
+            if used >= limit:
+                # Free once the oldest send still inside the window drops out of it
+                oldest = self._sent[len(self._sent) - used]
+                until = oldest + seconds - now
+                if until > wait:
+                    wait, window = until, name
+        if "minute" in self.limits and self._sent:
+            # Spread sends across the minute rather than bursting at its start
+            until = self._sent[-1] + 60 / self.limits["minute"][1] - now
+            if until > wait:
+                wait, window = until, "pacing"
+        return wait, window
+
+    def _update_gauges(self, now: float):
+        for name, remaining in self._remaining(now).items():
+            SEND_QUOTA_REMAINING.set(remaining, window=name)
+
+    def _remaining(self, now: float) -> Dict[str, int]:
+        return {name: max(0, limit - self._used(seconds, now)) for name, (seconds, limit) in self.limits.items()}
+
+    def acquire(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Take a slot for one message, waiting for one to free up if needed.
+        Returns the slot's send time, for `refund()`, or None as soon as the
+        next slot is further off than max_wait.
+        """
+        if not self.enabled:
+            return time.time()
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            with self._locked():
+                now = time.time()
+                self._load()
+                self._prune(now)
+                wait, window = self._wait(now)
+                if wait <= 0:
+                    self._sent.append(now)
+                    self._save()
+                    self._update_gauges(now)
+                    SEND_QUOTA_WAIT_SECONDS.observe(waited)
+                    return now
+            if wait > deadline - time.monotonic():
+                self.denied += 1
+                SEND_QUOTA_DENIED.inc(window=window)
+                logger.warning(f"Send quota used up ({window} budget), next slot in {wait:.0f}s; "
+                               f"leaving the rest for a later run")
+                return None
+            if window != "pacing":
+                logger.info(f"Send quota: waiting {wait:.1f}s for the {window} budget")
+            time.sleep(wait)
+            waited += wait
+
+    def refund(self, sent_at: float):
+        """Give back the slot `acquire()` took at sent_at, for a message that was not delivered."""
+        if not self.enabled:
+            return
+        with self._locked():
+            # Other senders may have taken slots since; only ours is given back
+            self._load()
+            try:
+                self._sent.remove(sent_at)
+            except ValueError:
+                return
+            self._save()
+            self._update_gauges(time.time())
+
+    def messages_available(self) -> Optional[int]:
+        """
+        Messages that can be sent before a window too long to wait out fills
+        up; None if no such window is limited. Windows no longer than
+        max_wait refill while sends wait, so they don't limit this.
+        """
+        long_windows = [name for name, (seconds, _) in self.limits.items() if seconds > self.max_wait]
+        if not long_windows:
+            return None
+        with self._lock:
+            now = time.time()
+            self._load()
+            remaining = self._remaining(now)
+            return min(remaining[name] for name in long_windows)
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            now = time.time()
+            self._load()
+            self._prune(now)
+            wait, window = self._wait(now)
+            return {
+                "enabled": True,
+                "limits": {name: limit for name, (_, limit) in self.limits.items()},
+                "remaining": self._remaining(now),
+                "next_slot_in": round(max(0.0, wait), 1),
+                "limited_by": window,
+                "denied": self.denied,
+            }
+
+_quota: Optional[SendQuota] = None
+_quota_lock = threading.Lock()
+
+def get_send_quota() -> SendQuota:
+    """Return the process-wide send quota, loading its state on first use."""
+    global _quota
+    with _quota_lock:
+        if _quota is None:
+            _quota = SendQuota()
+        return _quota
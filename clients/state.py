@@ -0,0 +1,23 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local directory for journals, caches and other per-machine state
+STATE_DIR = os.path.expanduser(os.getenv("AURA_STATE_DIR", "~/.aura-frame-syncer"))
+
+def pid_alive(pid: int) -> bool:
+    """True if a process with this pid is running (or exists but isn't ours to signal)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def state_path(*parts):
+    """Return a path inside the local state directory, creating its parent directory."""
+    path = os.path.join(STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,298 @@
+import base64
+import gzip
+import json
+import os
+import time
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from .fingerprint import ContentIndex
+from .logger import setup_logger
+from .metrics import GIST_ERRORS, GIST_REQUEST_SECONDS
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+STATE_VERSION = 2
+MANIFEST_FILE = "sync_state.json"
+DELTA_FILE = "sync_delta.jsonl"
+CONTENT_FILE = "sync_content.json"
+LEGACY_FILE = "synced_photos.json"
+# Shard encoding: "json", or "gzip" for gzip+base64 (roughly 3x smaller)
+SYNC_STATE_ENCODING = os.getenv("SYNC_STATE_ENCODING", "json").lower()
+# Marks kept in the delta file before they are folded into the album shards
+SYNC_STATE_COMPACT_EVERY = int(os.getenv("SYNC_STATE_COMPACT_EVERY", 1000))
+
+_GZIP_PREFIX = "gz:"
+
+def shard_file(album_id: int) -> str:
+    return f"sync_album_{album_id}.json"
+
+def to_epoch(value) -> int:
+    """Seconds since the epoch for an epoch number or a naive-UTC / aware ISO timestamp."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def encode_content(data, encoding: str) -> str:
+    text = json.dumps(data, separators=(",", ":"), sort_keys=True)
+    if encoding == "gzip":
+        return _GZIP_PREFIX + base64.b64encode(gzip.compress(text.encode("utf-8"), mtime=0)).decode("ascii")
+    return text
+
+def decode_content(content: str):
+    if content.startswith(_GZIP_PREFIX):
+        content = gzip.decompress(base64.b64decode(content[len(_GZIP_PREFIX):])).decode("utf-8")
+    return json.loads(content)
+
+class SyncState:
+    """
+    Which photos have been synced from which album, and when.
+
+    Held per album as {uuid: epoch seconds}, which is also how it is stored:
+    one shard per album, so a change to one album never rewrites the others.
+    `content` maps the content fingerprints of sent photos to their UUIDs.
+    """
+
+    def __init__(self):
+        self.albums: Dict[str, Dict[str, int]] = {}
+        self.fingerprints: Dict[str, dict] = {}
+        self.content = ContentIndex()
+
+    def mark(self, photo_uuid: str, album_name: str, synced_at) -> bool:
+        """Record a sync; returns True if the photo was not yet recorded for the album."""
+        records = self.albums.setdefault(album_name, {})
+        new = photo_uuid not in records
+        records[photo_uuid] = to_epoch(synced_at)
+        return new
+
+    def remove_album(self, album_name: str) -> int:
+        self.fingerprints.pop(album_name, None)
+        removed = len(self.albums.pop(album_name, {}))
+        self.content.keep_only(self.all_uuids())
+        return removed
+
+    def synced_at(self, photo_uuid: str, album_name: str) -> Optional[int]:
+        return self.albums.get(album_name, {}).get(photo_uuid)
+
+    def all_uuids(self) -> Set[str]:
+        """Every photo synced from any album."""
+        return {uuid for records in self.albums.values() for uuid in records}
+
+    def photo_count(self) -> int:
+        return len(self.all_uuids())
+
+    @classmethod
+    def from_legacy(cls, data: dict) -> "SyncState":
+        """Convert the version 1 `synced_photos.json` layout."""
+        state = cls()
+        for photo_uuid, info in data.get("synced_photos", {}).items():
+            albums = list(info.get("albums") or [])
+            if info.get("album") and info["album"] not in albums:
+                albums.append(info["album"])
+            try:
+                synced_at = to_epoch(info.get("synced_at") or 0)
+            except (TypeError, ValueError):
+                synced_at = 0
+            for album in albums:
+                state.albums.setdefault(album, {})[photo_uuid] = synced_at
+        state.fingerprints = dict(data.get("album_fingerprints", {}))
+        return state
+
+class GistStateStore:
+    """
+    Reads and writes SyncState in a Gist as a small manifest, one shard file per
+    album (album names interned to integer ids) and an append-only delta file.
+
+    A save appends the new marks to the delta file and only rewrites the
+    manifest when it changed. Once the delta holds `compact_every` marks it is
+    folded into the shards of the albums it touches and emptied. Content
+    fingerprints ride along on the delta lines and are compacted into their
+    own file. A Gist that still has the version 1 `synced_photos.json` is
+    migrated on first load.
+    """
+
+    def __init__(self, encoding: Optional[str] = None, compact_every: Optional[int] = None):
+        self.encoding = encoding or SYNC_STATE_ENCODING
+        self.compact_every = max(1, compact_every or SYNC_STATE_COMPACT_EVERY)
+        self.manifest: dict = self._empty_manifest()
+        # Delta lines as read at the last load: [album id, uuid, epoch(, content keys)]
+        self._delta: List[list] = []
+        self.bytes_written = 0
+
+    def _empty_manifest(self) -> dict:
+        return {"version": STATE_VERSION, "encoding": self.encoding, "next_id": 1, "albums": {}, "fingerprints": {}}
+
+    @staticmethod
+    def _truncated(f) -> bool:
+        truncated = getattr(f, "truncated", None)
+        if truncated is None:
+            # PyGithub only exposes the API's "truncated" flag through raw_data
+            truncated = (getattr(f, "raw_data", None) or {}).get("truncated", False)
+        return bool(truncated)
+
+    def _read_file(self, gist, name: str) -> Optional[str]:
+        f = gist.files.get(name)
+        if f is None:
+            return None
+        if self._truncated(f) and getattr(f, "raw_url", None):
+            # The API cuts file contents off at 1 MB; the raw URL serves all of it
+            try:
+                with GIST_REQUEST_SECONDS.time(op="read_raw"), urllib.request.urlopen(f.raw_url, timeout=60) as r:
+                    return r.read().decode("utf-8")
+            except Exception:
+                GIST_ERRORS.inc(op="read_raw")
+                raise
+        return f.content
+
+    def _write(self, gist, files: Dict[str, Optional[str]]):
+        from github import InputFileContent
+        payload = {name: None if content is None else InputFileContent(content) for name, content in files.items()}
+        try:
+            with GIST_REQUEST_SECONDS.time(op="write"):
+                gist.edit(files=payload)
+        except Exception:
+            GIST_ERRORS.inc(op="write")
+            raise
+        written = sum(len(c.encode("utf-8")) for c in files.values() if c)
+        self.bytes_written += written
+        logger.info(f"Saved sync state to Gist: {', '.join(sorted(files))} ({written / 1024:.1f} KB)")
+
+    def delta_album_ids(self) -> Set[int]:
+        """Albums with marks in the delta file, i.e. whose shards a compaction must rewrite."""
+        return {line[0] for line in self._delta}
+
+    def _album_id(self, album_name: str) -> Tuple[int, bool]:
+        albums = self.manifest["albums"]
+        if album_name in albums:
+            return albums[album_name], False
+        album_id = self.manifest["next_id"]
+        self.manifest["next_id"] = album_id + 1
+        albums[album_name] = album_id
+        return album_id, True
+
+    def load(self, gist, migrate: bool = True) -> SyncState:
+        """
+        Read the state from the Gist, migrating the version 1 file if that's all
+        there is (with migrate=False it is read as it is and left in place).
+        """
+        manifest_content = self._read_file(gist, MANIFEST_FILE)
+        if manifest_content is None:
+            legacy = self._read_file(gist, LEGACY_FILE)
+            self.manifest = self._empty_manifest()
+            self._delta = []
+            if legacy is None:
+                logger.info("No existing sync data found, starting fresh")
+                return SyncState()
+            if not migrate:
+                return SyncState.from_legacy(json.loads(legacy))
+            return self._migrate(gist, json.loads(legacy))
+
+        self.manifest = json.loads(manifest_content)
+        if self.manifest.get("version") != STATE_VERSION:
+            raise ValueError(f"Unsupported sync state version {self.manifest.get('version')}")
+        state = SyncState()
+        state.fingerprints = dict(self.manifest.get("fingerprints", {}))
+        names = {album_id: name for name, album_id in self.manifest["albums"].items()}
+        for album_id, name in names.items():
+            content = self._read_file(gist, shard_file(album_id))
+            state.albums[name] = dict(decode_content(content)["synced"]) if content else {}
+        content = self._read_file(gist, CONTENT_FILE)
+        if content:
+            state.content = ContentIndex(decode_content(content)["content"])
+        self._delta = []
+        for line in (self._read_file(gist, DELTA_FILE) or "").splitlines():
+            try:
+                album_id, photo_uuid, synced_at, *keys = json.loads(line)
+            except ValueError:
+                continue
+            if album_id in names:
+                state.mark(photo_uuid, names[album_id], synced_at)
+                if keys:
+                    state.content.add(photo_uuid, keys[0])
+                self._delta.append([album_id, photo_uuid, synced_at] + keys[:1])
+        logger.info(
+            f"Loaded sync data: {state.photo_count()} photos tracked in {len(names)} album shards "
+            f"(+{len(self._delta)} delta marks)"
+        )
+        return state
+
+    def _migrate(self, gist, legacy: dict) -> SyncState:
+        state = SyncState.from_legacy(legacy)
+        logger.info(f"Migrating {LEGACY_FILE} ({state.photo_count()} photos) to sharded sync state")
+        self.compact(gist, state, remove=[LEGACY_FILE])
+        return state
+
+    def save(self, gist, state: SyncState, marks: Iterable[Tuple[str, str, object]],
+             fingerprints: Optional[Dict[str, dict]] = None, content: Optional[Dict[str, List[str]]] = None):
+        """
+        Persist new marks (uuid, album, synced_at), album fingerprints and the
+        content keys of newly sent photos ({uuid: keys}). `state` must come from
+        the latest `load()` with all of them already applied.
+        """
+        content = content or {}
+        manifest_changed = bool(fingerprints)
+        if fingerprints:
+            self.manifest["fingerprints"].update(fingerprints)
+        lines = []
+        with_content = set()
+        for photo_uuid, album_name, synced_at in marks:
+            album_id, new_album = self._album_id(album_name)
+            manifest_changed |= new_album
+            line = [album_id, photo_uuid, to_epoch(synced_at)]
+            if content.get(photo_uuid) and photo_uuid not in with_content:
+                line.append(list(content[photo_uuid]))
+                with_content.add(photo_uuid)
+            lines.append(line)
+        if len(self._delta) + len(lines) >= self.compact_every:
+            touched = {self.manifest["albums"][name] for _, name, _ in marks}
+            touched |= self.delta_album_ids()
+            self.compact(gist, state, album_ids=touched)
+            return
+        if not lines and not manifest_changed:
+            return
+        self._delta.extend(lines)
+        files = {}
+        if lines:
+            files[DELTA_FILE] = "".join(json.dumps(line, separators=(",", ":")) + "\n" for line in self._delta)
+        if manifest_changed:
+            files[MANIFEST_FILE] = json.dumps(self.manifest, separators=(",", ":"), sort_keys=True)
+        self._write(gist, files)
+
+    def compact(self, gist, state: SyncState, album_ids: Optional[Set[int]] = None,
+                remove: Iterable[str] = ()):
+        """
+        Rewrite the shards of `album_ids` (default: every album) and the content
+        index from `state`, empty the delta file and drop shards of albums no
+        longer in the state.
+        """
+        for name in state.albums:
+            self._album_id(name)
+        self.manifest["fingerprints"] = dict(state.fingerprints)
+        self.manifest["encoding"] = self.encoding
+        self.manifest["compacted_at"] = int(time.time())
+        files: Dict[str, Optional[str]] = {name: None for name in remove if name in gist.files}
+        if len(state.content):
+            files[CONTENT_FILE] = encode_content(
+                {"version": STATE_VERSION, "content": state.content.owners}, self.encoding
+            )
+        elif CONTENT_FILE in gist.files:
+            files[CONTENT_FILE] = None
+        for name, album_id in list(self.manifest["albums"].items()):
+            if name not in state.albums:
+                del self.manifest["albums"][name]
+                if shard_file(album_id) in gist.files:
+                    files[shard_file(album_id)] = None
+            elif album_ids is None or album_id in album_ids:
+                files[shard_file(album_id)] = encode_content(
+                    {"version": STATE_VERSION, "album": name, "synced": state.albums[name]}, self.encoding
+                )
+        if DELTA_FILE in gist.files:
+            files[DELTA_FILE] = None
+        files[MANIFEST_FILE] = json.dumps(self.manifest, separators=(",", ":"), sort_keys=True)
+        self._write(gist, files)
+        self._delta = []
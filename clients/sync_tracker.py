@@ -1,105 +1,374 @@
-from github import Github, InputFileContent
+import atexit
+import fcntl
 import json
 import os
-from datetime import datetime
-from typing import List, Optional
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
+from .destinations import record_destination
 from .logger import setup_logger
+from .metrics import GIST_ERRORS, GIST_REQUEST_SECONDS
+from .sync_state import GistStateStore, SyncState
+from .state import pid_alive, state_path
 
 load_dotenv()
 
 logger = setup_logger(__name__)
 
+# Write-behind settings: pending marks are pushed to the Gist once this many
+# have accumulated or this many seconds have passed since the last flush.
+# SYNC_FLUSH_EVERY=1 gives the old write-through behaviour.
+SYNC_FLUSH_EVERY = int(os.getenv("SYNC_FLUSH_EVERY", 50))
+SYNC_FLUSH_INTERVAL = float(os.getenv("SYNC_FLUSH_INTERVAL", 120))
+
 class SyncTracker:
-    def __init__(self):
-        """Initialize sync tracker with GitHub token and Gist ID from environment."""
+    def __init__(self, flush_every: Optional[int] = None, flush_interval: Optional[float] = None,
+                 journal_path: Optional[str] = None, github_client=None, store: Optional[GistStateStore] = None,
+                 read_only: bool = False):
+        """
+        Initialize sync tracker with GitHub token and Gist ID from environment.
+
+        State is loaded from the Gist once and kept in an in-memory index.
+        New marks are appended to a local journal and flushed to the Gist in
+        batches, on `flush()`, and on `close()`/interpreter exit.
+
+        A read_only tracker never writes: a legacy state file is read without
+        being migrated, unflushed journal marks are shown but left to the
+        process that owns them, and marking, flushing or clearing raises.
+        """
         logger.info("Initializing...")
         self.github_token = os.getenv("GITHUB_TOKEN")
         self.gist_id = os.getenv("SYNC_GIST_ID")
-        
-        if not self.github_token or not self.gist_id:
-            raise ValueError("GITHUB_TOKEN and SYNC_GIST_ID must be set in .env")
-        
-        self.gh = Github(self.github_token)
-        self.gist = self.gh.get_gist(self.gist_id)
+
+        if github_client is None:
+            if not self.github_token or not self.gist_id:
+                raise ValueError("GITHUB_TOKEN and SYNC_GIST_ID must be set in .env")
+            from github import Github
+            github_client = Github(self.github_token)
+        elif not self.gist_id:
+            self.gist_id = "local"
+
+        self.gh = github_client
+        self.gist = self._get_gist()
         logger.info(f"Connected to Gist: {self.gist_id[:8]}...")
-    
-    def _load_synced_photos(self) -> dict:
+
+        self.flush_every = max(1, flush_every or SYNC_FLUSH_EVERY)
+        self.flush_interval = flush_interval if flush_interval is not None else SYNC_FLUSH_INTERVAL
+        self.journal_path = journal_path or os.getenv("SYNC_JOURNAL_PATH") or state_path(
+            f"sync_journal_{self.gist_id[:12]}.jsonl"
+        )
+
+        self._lock = threading.RLock()
+        # Held for a whole flush (Gist read, merge, write); self._lock only while taking and settling the batch
+        self._flush_lock = threading.RLock()
+        self.store = store or GistStateStore()
+        self._state = SyncState()
+        # Marks not yet pushed to the Gist: (uuid, album, synced_at)
+        self._pending: List[Tuple[str, str, str]] = []
+        # Album fingerprints not yet pushed to the Gist
+        self._pending_fingerprints: Dict[str, dict] = {}
+        # Content keys of photos marked since the last flush: uuid -> keys
+        self._pending_content: Dict[str, List[str]] = {}
+        self._last_flush = time.monotonic()
+        self.read_only = read_only
+        self._closed = read_only
+
+        self._state = self._load_state()
+        self._replay_journal()
+        if not read_only:
+            atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _load_state(self) -> SyncState:
         """Load the current state of synced photos from Gist."""
         try:
-            content = self.gist.files["synced_photos.json"].content
-            data = json.loads(content)
-            logger.info(f"Loaded sync data: {len(data.get('synced_photos', {}))} photos tracked")
-            return data
-        except (KeyError, json.JSONDecodeError):
-            logger.info("No existing sync data found, starting fresh")
-            return {"synced_photos": {}}
+            return self.store.load(self.gist, migrate=not self.read_only)
         except Exception as e:
             logger.error(f"Error loading sync data: {e}")
-            return {"synced_photos": {}}
-    
-    def _save_synced_photos(self, data: dict):
-        """Save the updated state back to Gist."""
+            raise
+
+    def _get_gist(self):
         try:
-            self.gist.edit(
-                files={
-                    "synced_photos.json": InputFileContent(
-                        json.dumps(data, indent=2)
-                    )
-                }
-            )
-            logger.info("Successfully saved sync data to Gist")
-        except Exception as e:
-            logger.error(f"Error saving sync data: {e}")
+            with GIST_REQUEST_SECONDS.time(op="read"):
+                return self.gh.get_gist(self.gist_id)
+        except Exception:
+            GIST_ERRORS.inc(op="read")
             raise
-    
-    def mark_synced(self, photo_uuid: str, album_name: str):
-        """Mark a photo as synced with its album context."""
+
+    def _index_mark(self, photo_uuid: str, album_name: str, synced_at: str, content: Optional[List[str]] = None):
+        self._state.mark(photo_uuid, album_name, synced_at)
+        if content:
+            self._state.content.add(photo_uuid, content)
+            self._pending_content[photo_uuid] = list(content)
+
+    def _replay_journal(self):
+        """
+        Re-apply marks left in the local journal by a run that never flushed.
+
+        Every mark is indexed, but only those of processes that are gone are
+        taken over (rewritten under our pid) and flushed by us; a live process
+        on the same Gist flushes its own.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        pid = os.getpid()
+        replayed = 0
+        with open(self.journal_path, "r" if self.read_only else "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if self.read_only else fcntl.LOCK_EX)
+            lines = []
+            for line in f:
+                lines.append(line)
+                try:
+                    entry = json.loads(line)
+                    mark = (entry["uuid"], entry["album"], entry["synced_at"])
+                except (ValueError, KeyError):
+                    continue
+                self._index_mark(*mark, content=entry.get("content"))
+                owner = entry.get("pid")
+                if self.read_only or (owner not in (None, pid) and pid_alive(owner)):
+                    continue
+                self._pending.append(mark)
+                if owner != pid:
+                    entry["pid"] = pid
+                    lines[-1] = json.dumps(entry) + "\n"
+                replayed += 1
+            if replayed:
+                f.seek(0)
+                f.writelines(lines)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+        if replayed:
+            logger.info(f"Replayed {replayed} unflushed marks from journal {self.journal_path}")
+
+    def _journal_append(self, mark: Tuple[str, str, str], content: Optional[List[str]] = None):
+        entry = {"uuid": mark[0], "album": mark[1], "synced_at": mark[2], "pid": os.getpid()}
+        if content:
+            entry["content"] = list(content)
+        line = json.dumps(entry) + "\n"
+        with open(self.journal_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _journal_discard(self, flushed: List[Tuple[str, str, str]]):
+        """Drop flushed marks from the journal, keeping entries written by other processes."""
+        if not os.path.exists(self.journal_path):
+            return
+        done = set(flushed)
+        with open(self.journal_path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            keep = []
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    if (entry["uuid"], entry["album"], entry["synced_at"]) in done:
+                        continue
+                except (ValueError, KeyError):
+                    continue
+                keep.append(line)
+            f.seek(0)
+            f.writelines(keep)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("This sync tracker is read-only")
+
+    def _refresh_gist(self):
+        """Fetch the latest Gist so flushes merge with writes from other processes."""
+        self.gist = self._get_gist()
+
+    def _adopt_state(self, state):
+        """Make a freshly loaded state current, keeping what was marked since it was read."""
+        for mark in self._pending:
+            state.mark(*mark)
+        for photo_uuid, keys in self._pending_content.items():
+            state.content.add(photo_uuid, keys)
+        state.fingerprints.update(self._pending_fingerprints)
+        self._state = state
+
+    def flush(self):
+        """
+        Push pending marks to the Gist in one write. Only taking the batch and
+        settling it hold the tracker lock; marks made during the Gist round
+        trips stay pending for the next flush.
+        """
+        self._check_writable()
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._pending_fingerprints:
+                    self._last_flush = time.monotonic()
+                    return
+                batch = list(self._pending)
+                fingerprints = dict(self._pending_fingerprints)
+                content = dict(self._pending_content)
+            # Merge with writes from other processes; without a fresh read the
+            # marks stay pending, since the shards can't be written blind
+            self._refresh_gist()
+            state = self._load_state()
+            for mark in batch:
+                state.mark(*mark)
+            for photo_uuid, keys in content.items():
+                state.content.add(photo_uuid, keys)
+            state.fingerprints.update(fingerprints)
+            self.store.save(self.gist, state, batch, fingerprints, content)
+            with self._lock:
+                # Only flushes remove marks, so the batch is still at the front
+                del self._pending[:len(batch)]
+                for name, fingerprint in fingerprints.items():
+                    if self._pending_fingerprints.get(name) is fingerprint:
+                        del self._pending_fingerprints[name]
+                for photo_uuid, keys in content.items():
+                    if self._pending_content.get(photo_uuid) == keys:
+                        del self._pending_content[photo_uuid]
+                self._adopt_state(state)
+                self._journal_discard(batch)
+                self._last_flush = time.monotonic()
+        logger.info(f"Flushed {len(batch)} synced marks to Gist")
+
+    def _flush_due(self) -> bool:
+        return (len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def _maybe_flush(self):
+        # A flush already under way leaves these marks for the next one rather than making senders wait
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            if self._flush_due():
+                self.flush()
+        except Exception as e:
+            # The marks stay pending and journaled; the next flush retries them
+            logger.error(f"Deferred sync data flush failed: {e}")
+        finally:
+            self._flush_lock.release()
+
+    def close(self):
+        """Flush any pending marks. Safe to call more than once."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing sync data on close, marks kept in journal: {e}")
+        with self._lock:
+            if self._pending:
+                # Marked while closing; left for a later flush or interpreter exit
+                return
+            self._closed = True
+            atexit.unregister(self.close)
+
+    def mark_synced(self, photo_uuid: str, album_name: str, content: Optional[List[str]] = None):
+        """
+        Mark a photo as synced with its album context. content, the photo's
+        content fingerprint keys, lets later copies of the image be recognised.
+        """
         logger.info(f"Marking photo as synced: {photo_uuid[:8]}... from album: {album_name}")
-        data = self._load_synced_photos()
-        data["synced_photos"][photo_uuid] = {
-            "album": album_name,
-            "synced_at": datetime.utcnow().isoformat(),
-        }
-        self._save_synced_photos(data)
-    
+        self._check_writable()
+        mark = (photo_uuid, album_name, datetime.utcnow().isoformat())
+        with self._lock:
+            self._journal_append(mark, content)
+            self._index_mark(*mark, content=content)
+            self._pending.append(mark)
+            if self._closed:
+                self._closed = False
+                atexit.register(self.close)
+            due = self._flush_due()
+        if due:
+            self._maybe_flush()
+
     def is_synced(self, photo_uuid: str, album_name: str) -> bool:
         """Check if a photo has been synced from a specific album."""
-        data = self._load_synced_photos()
-        is_synced = (
-            photo_uuid in data["synced_photos"] and
-            data["synced_photos"][photo_uuid]["album"] == album_name
-        )
-        if is_synced:
-            sync_time = data["synced_photos"][photo_uuid]["synced_at"]
-            logger.debug(f"Photo {photo_uuid[:8]}... was synced at {sync_time}")
+        with self._lock:
+            sync_time = self._state.synced_at(photo_uuid, album_name)
+            is_synced = sync_time is not None
+            if is_synced:
+                synced_at = datetime.fromtimestamp(sync_time, timezone.utc).isoformat()
+                logger.debug(f"Photo {photo_uuid[:8]}... was synced at {synced_at}")
         return is_synced
-    
+
+    def synced_uuids(self, album_name: str) -> Set[str]:
+        """Return the set of photo UUIDs synced from an album."""
+        with self._lock:
+            return set(self._state.albums.get(album_name, ()))
+
+    def synced_anywhere(self, destination: Optional[str] = None) -> Set[str]:
+        """Return the UUIDs of photos synced from any album, optionally only those sent to destination."""
+        with self._lock:
+            if destination is None:
+                return self._state.all_uuids()
+            return {uuid for name, records in self._state.albums.items()
+                    if record_destination(name) == destination for uuid in records}
+
+    def find_duplicate(self, content: List[str], max_distance: int = 0,
+                       destination: Optional[str] = None) -> Optional[str]:
+        """
+        Return the UUID of a synced photo with the same content fingerprint, if
+        any; with destination, only if that photo was sent there.
+        """
+        with self._lock:
+            owner = self._state.content.find(content, max_distance)
+            if owner is None or destination is None:
+                return owner
+            for name, records in self._state.albums.items():
+                if owner in records and record_destination(name) == destination:
+                    return owner
+            return None
+
+    def last_synced_at(self, album_name: str) -> Optional[int]:
+        """Epoch seconds of the most recent sync recorded for an album, if any."""
+        with self._lock:
+            records = self._state.albums.get(album_name)
+            return max(records.values()) if records else None
+
+    def get_album_fingerprint(self, album_name: str) -> Optional[dict]:
+        """Return the fingerprint stored by the last sync of an album, if any."""
+        with self._lock:
+            if album_name in self._pending_fingerprints:
+                return self._pending_fingerprints[album_name]
+            return self._state.fingerprints.get(album_name)
+
+    def set_album_fingerprint(self, album_name: str, fingerprint: dict):
+        """Store an album fingerprint; it is pushed to the Gist with the next flush."""
+        self._check_writable()
+        with self._lock:
+            self._pending_fingerprints[album_name] = fingerprint
+            self._state.fingerprints[album_name] = fingerprint
+
     def get_synced_photos(self, album_name: Optional[str] = None) -> List[str]:
         """Get all synced photo UUIDs, optionally filtered by album."""
-        data = self._load_synced_photos()
-        if album_name:
-            photos = [
-                uuid for uuid, info in data["synced_photos"].items()
-                if info["album"] == album_name
-            ]
-            logger.info(f"Found {len(photos)} synced photos in album: {album_name}")
-            return photos
-        
-        photos = list(data["synced_photos"].keys())
+        with self._lock:
+            if album_name:
+                photos = list(self._state.albums.get(album_name, ()))
+                logger.info(f"Found {len(photos)} synced photos in album: {album_name}")
+                return photos
+
+            photos = list({uuid for records in self._state.albums.values() for uuid in records})
         logger.info(f"Found {len(photos)} total synced photos")
         return photos
-    
+
     def clear_album_history(self, album_name: str):
         """Clear sync history for a specific album."""
+        self._check_writable()
         logger.info(f"Clearing sync history for album: {album_name}")
-        data = self._load_synced_photos()
-        before_count = len(data["synced_photos"])
-        data["synced_photos"] = {
-            uuid: info for uuid, info in data["synced_photos"].items()
-            if info["album"] != album_name
-        }
-        after_count = len(data["synced_photos"])
-        removed = before_count - after_count
-        logger.info(f"Removed {removed} photos from sync history")
-        self._save_synced_photos(data) 
\ No newline at end of file
+        with self._flush_lock:
+            self.flush()
+            self._refresh_gist()
+            state = self._load_state()
+            removed = state.remove_album(album_name)
+            logger.info(f"Removed {removed} photos from sync history")
+            # Drops the album's shard and folds the delta into the remaining shards
+            self.store.compact(self.gist, state, album_ids=self.store.delta_album_ids())
+            with self._lock:
+                self._adopt_state(state)
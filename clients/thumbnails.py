@@ -0,0 +1,172 @@
+import importlib.util
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from .apple_photos import export_photo, photo_cache_key
+from .export_cache import DiskCache
+from .logger import setup_logger
+from .metrics import THUMBNAIL_SECONDS, THUMBNAILS
+from .state import STATE_DIR
+
+# Pillow is optional; without it the exported JPEG is served as is. It is
+# imported where thumbnails are made, so the web server starts without it.
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+THUMBNAIL_CACHE_DIR = os.path.expanduser(os.getenv("THUMBNAIL_CACHE_DIR") or os.path.join(STATE_DIR, "thumbnails"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+# Default longest edge in pixels; requests are clamped to THUMBNAIL_MIN_SIZE..THUMBNAIL_MAX_SIZE
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 360))
+THUMBNAIL_MIN_SIZE = 32
+THUMBNAIL_MAX_SIZE = 2048
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+# Thumbnails generated at once; Pillow releases the GIL while decoding and resizing
+THUMBNAIL_WORKERS = max(1, int(os.getenv("THUMBNAIL_WORKERS", min(4, os.cpu_count() or 1))))
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+def make_thumbnail(src: str, dest: str, size: int, fmt: str = "jpeg", quality: int = THUMBNAIL_QUALITY) -> str:
+    """Write a thumbnail of src, at most size pixels on its longest edge, to dest."""
+    from PIL import Image, ImageOps
+    with Image.open(src) as im:
+        if im.format == "JPEG":
+            # Decode at the smallest DCT scale that is still at least size
+            im.draft("RGB", (size, size))
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.thumbnail((size, size), Image.LANCZOS)
+        if fmt == "webp":
+            im.save(dest, "WEBP", quality=quality, method=4)
+        else:
+            im.save(dest, "JPEG", quality=quality, optimize=True, progressive=True)
+    return dest
+
+class Thumbnail:
+    """A cached thumbnail file and what is needed to serve it."""
+
+    def __init__(self, path: str, etag: str, fmt: str):
+        self.path = path
+        self.etag = etag
+        self.format = fmt
+        self.media_type = MEDIA_TYPES[fmt]
+
+class ThumbnailService:
+    """
+    Small derivatives of library photos, generated on demand and kept in a
+    byte-bounded LRU DiskCache.
+
+    Misses are exported (through the export cache) and downsized on a pool of
+    `workers` threads; concurrent requests for the same thumbnail share one
+    generation. Keys include the photo's modification date, so an edited
+    photo gets a new thumbnail and old ones age out of the cache.
+    """
+
+    def __init__(self, cache: Optional[DiskCache] = None, workers: Optional[int] = None,
+                 quality: Optional[int] = None):
+        self.cache = cache or DiskCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, name="thumbnails")
+        self.workers = workers or THUMBNAIL_WORKERS
+        self.quality = quality or THUMBNAIL_QUALITY
+        self.generated = 0
+        self.failed = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        if not HAS_PILLOW:
+            logger.warning("Pillow is not installed; face samples are served at full size")
+
+    def formats(self) -> List[str]:
+        """Output formats this install can write, preferred first."""
+        if not HAS_PILLOW:
+            return ["jpeg"]
+        from PIL import features
+        if features.check("webp"):
+            return ["webp", "jpeg"]
+        return ["jpeg"]
+
+    @staticmethod
+    def clamp_size(size: Optional[int]) -> int:
+        return min(THUMBNAIL_MAX_SIZE, max(THUMBNAIL_MIN_SIZE, size or THUMBNAIL_SIZE))
+
+    @staticmethod
+    def version(photo) -> str:
+        """Changes whenever the photo's thumbnails would; used to make thumbnail URLs immutable."""
+        return photo_cache_key(photo)[:12]
+
+    def key(self, photo, size: int, fmt: str) -> str:
+        return DiskCache.make_key(photo_cache_key(photo), size, fmt if HAS_PILLOW else "original")
+
+    def get(self, photo, size: Optional[int] = None, fmt: str = "jpeg") -> Optional[Thumbnail]:
+        """Return the thumbnail of photo, generating it if needed; None if the photo can't be exported."""
+        size = self.clamp_size(size)
+        fmt = fmt if fmt in self.formats() else "jpeg"
+        key = self.key(photo, size, fmt)
+        thumbnail = self._cached(key, fmt)
+        if thumbnail is not None:
+            THUMBNAILS.inc(result="hit")
+            return thumbnail
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._pool.submit(self._generate, photo, size, fmt, key)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._done(key))
+        return future.result()
+
+    def _done(self, key: str):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def _cached(self, key: str, fmt: str) -> Optional[Thumbnail]:
+        paths = self.cache.get(key)
+        meta = self.cache.get_meta(key) if paths else None
+        if not paths or not meta:
+            return None
+        return Thumbnail(paths[0], meta["files"][0]["sha256"][:20], fmt)
+
+    def _generate(self, photo, size: int, fmt: str, key: str) -> Optional[Thumbnail]:
+        staging = self.cache.staging_dir()
+        try:
+            with THUMBNAIL_SECONDS.time():
+                exported = export_photo(photo, staging)
+                if not exported:
+                    raise ValueError("export failed")
+                if not HAS_PILLOW:
+                    thumb = exported[0]
+                else:
+                    thumb = make_thumbnail(exported[0], os.path.join(staging, f"thumbnail.{fmt}"), size, fmt,
+                                           self.quality)
+                paths = self.cache.put(key, [thumb], extra={"uuid": photo.uuid, "size": size, "format": fmt})
+        except Exception as e:
+            logger.error(f"Could not make a thumbnail of {photo.uuid[:8]}...: {e}")
+            self.failed += 1
+            THUMBNAILS.inc(result="failed")
+            return None
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.generated += 1
+        THUMBNAILS.inc(result="generated")
+        meta = self.cache.get_meta(key)
+        return Thumbnail(paths[0], meta["files"][0]["sha256"][:20], fmt)
+
+    def stats(self) -> dict:
+        return dict(self.cache.stats(), generated=self.generated, failed=self.failed, workers=self.workers)
+
+    def close(self):
+        self._pool.shutdown()
+
+_service: Optional[ThumbnailService] = None
+_service_lock = threading.Lock()
+
+def get_thumbnail_service() -> ThumbnailService:
+    """Return the shared thumbnail service, creating it on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService()
+        return _service
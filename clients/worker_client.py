@@ -0,0 +1,102 @@
+import json
+import os
+import socket
+from typing import Callable, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .state import STATE_DIR
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Unix socket of the sync worker (python -m server.worker). While a worker
+# listens there, the scheduler and the web server hand their syncs and plans to it.
+WORKER_SOCKET = os.path.expanduser(os.getenv("WORKER_SOCKET") or os.path.join(STATE_DIR, "worker.sock"))
+# Seconds to wait for the worker to accept a connection
+WORKER_CONNECT_TIMEOUT = float(os.getenv("WORKER_CONNECT_TIMEOUT", 2))
+
+class WorkerError(RuntimeError):
+    """The worker failed the request or went away while handling it."""
+
+class WorkerUnavailable(WorkerError):
+    """No worker is listening on the socket."""
+
+class RemoteResult(dict):
+    """An album sync result sent back by the worker, as SyncResult.to_dict() made it."""
+
+    def __bool__(self):
+        return bool(self.get("success"))
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def to_dict(self) -> dict:
+        return dict(self)
+
+class WorkerClient:
+    """
+    Sends requests to the sync worker over its Unix socket: one JSON line per
+    request, answered by any number of {"event": ...} lines and then one
+    {"result": ...} or {"error": ...} line.
+    """
+
+    def __init__(self, path: Optional[str] = None, connect_timeout: Optional[float] = None):
+        self.path = path or WORKER_SOCKET
+        self.connect_timeout = WORKER_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+
+    def _connect(self) -> socket.socket:
+        if not os.path.exists(self.path):
+            raise WorkerUnavailable(f"No worker socket at {self.path}")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise WorkerUnavailable(f"Worker at {self.path} is not accepting connections: {e}") from e
+        # Syncs take as long as they take
+        sock.settimeout(None)
+        return sock
+
+    def call(self, op: str, on_event: Optional[Callable[[dict], None]] = None, **params):
+        """Run op on the worker and return its result; events are passed to on_event as they arrive."""
+        sock = self._connect()
+        with sock, sock.makefile("rwb") as stream:
+            stream.write(json.dumps(dict(params, op=op)).encode("utf-8") + b"\n")
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if "event" in message:
+                    if on_event:
+                        on_event(message["event"])
+                elif "error" in message:
+                    raise WorkerError(message["error"])
+                else:
+                    return message.get("result")
+        raise WorkerError("Worker closed the connection before answering")
+
+    def ping(self) -> Optional[dict]:
+        """The worker's stats, or None if no worker is listening."""
+        try:
+            return self.call("ping")
+        except WorkerError:
+            return None
+
+    def sync_album(self, album_name: Optional[str] = None, progress=None, export_workers=None) -> RemoteResult:
+        result = self.call("sync_album", on_event=progress, album=album_name, export_workers=export_workers)
+        return RemoteResult(result or {})
+
+def find_worker() -> Optional[WorkerClient]:
+    """A client for the running worker, or None if there isn't one (callers then work in-process)."""
+    client = WorkerClient()
+    if not os.path.exists(client.path):
+        return None
+    try:
+        client._connect().close()
+    except WorkerUnavailable as e:
+        logger.debug(f"{e}; working in-process")
+        return None
+    return client
@@ -0,0 +1,240 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from .logger import setup_logger
+from .metrics import WORKSPACE_BYTES, WORKSPACE_DIRS_SWEPT, WORKSPACE_SPILLS, WORKSPACE_WAIT_SECONDS
+from .state import STATE_DIR, pid_alive
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Scratch space for exported photos on their way to the frame. On the same
+# filesystem as the export cache, cached exports are hard-linked rather than copied.
+WORKSPACE_DIR = os.path.expanduser(os.getenv("WORKSPACE_DIR") or os.path.join(STATE_DIR, "workspace"))
+# Put the workspace in RAM (/dev/shm) where there is one; full workspaces spill to WORKSPACE_DIR
+WORKSPACE_TMPFS = os.getenv("WORKSPACE_TMPFS", "false").lower() == "true"
+TMPFS_ROOT = "/dev/shm"
+# Byte budget for exports in the workspace; 0 means no limit
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", 2 * 1024 ** 3))
+# Longest an export waits for room before spilling (or going over budget)
+WORKSPACE_MAX_WAIT = float(os.getenv("WORKSPACE_MAX_WAIT", 30))
+
+
+class Workspace:
+    """
+    Scratch directories for exports, one per run, under a shared byte budget.
+
+    `run()` hands out a directory that is removed when the run ends, whether
+    it succeeded or failed; directories still open at a normal interpreter
+    exit are removed then. A process killed outside Python's control (or by
+    a SIGTERM it doesn't handle) leaves its directories behind, and the
+    startup sweep of the next process removes them.
+
+    `place()` is called before each export and waits while the workspace is
+    over budget, for up to `max_wait` seconds, as other exports are sent and
+    deleted. After that the export spills to `spill_root` (the on-disk
+    workspace, when the main one is in RAM) or, without one, goes ahead
+    over budget. Stages holding exports back (like batching uploads) should
+    let them go when the workspace is `full()`.
+
+    The budget is kept as a running count of this process's files, which
+    are registered with `track()` and deleted with `remove()` or
+    `release()`, so checking it costs nothing however many files are out.
+    Files hard-linked from the export cache take no extra space and count
+    as nothing.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 spill_root: Optional[str] = None, max_wait: Optional[float] = None):
+        self.root = root or WORKSPACE_DIR
+        self.spill_root = spill_root if spill_root != self.root else None
+        self.max_bytes = WORKSPACE_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_wait = WORKSPACE_MAX_WAIT if max_wait is None else max_wait
+        self.waits = 0
+        self.spills = 0
+        self._open: Dict[str, float] = {}
+        # Tracked files in the workspace and the bytes each one counts for
+        self._files: Dict[str, int] = {}
+        self._used = 0
+        self._lock = threading.Lock()
+        # Notified whenever files are given back, for exports waiting for room
+        self._room = threading.Condition(self._lock)
+        for root in (self.root, self.spill_root):
+            if root:
+                os.makedirs(root, exist_ok=True)
+        self.sweep()
+        atexit.register(self.close)
+
+    def run_dir(self, prefix: str = "run_") -> str:
+        """A new scratch directory, kept until `release()` or interpreter exit."""
+        # The pid lets the startup sweep tell directories of live processes from leftovers
+        path = tempfile.mkdtemp(prefix=f"{os.getpid()}-{prefix}", dir=self.root)
+        with self._lock:
+            self._open[path] = time.time()
+        return path
+
+    def release(self, path: str):
+        """Remove a scratch directory, and anything of it that spilled, with its contents."""
+        prefix = os.path.join(path, "")
+        with self._lock:
+            self._open.pop(path, None)
+            for tracked in [f for f in self._files if f.startswith(prefix)]:
+                self._used -= self._files.pop(tracked)
+            self._room.notify_all()
+        shutil.rmtree(path, ignore_errors=True)
+        spilled = self._spill_path(path)
+        if spilled:
+            shutil.rmtree(spilled, ignore_errors=True)
+        self._update_gauge()
+
+    @contextmanager
+    def run(self, prefix: str = "run_"):
+        """Scratch directory for the duration of a with block."""
+        path = self.run_dir(prefix)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def _spill_path(self, path: str) -> Optional[str]:
+        if not self.spill_root:
+            return None
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith(os.pardir):
+            return None
+        return os.path.join(self.spill_root, relative)
+
+    def _inside(self, path: str) -> bool:
+        return not os.path.relpath(path, self.root).startswith(os.pardir)
+
+    def track(self, paths: List[str]) -> List[str]:
+        """Count newly written files against the budget (those outside the workspace are ignored); returns paths."""
+        for path in paths:
+            if not self._inside(path):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # A hard link shares its blocks with the export cache
+            size = 0 if st.st_nlink > 1 else st.st_size
+            with self._lock:
+                self._used += size - self._files.get(path, 0)
+                self._files[path] = size
+        self._update_gauge()
+        return paths
+
+    def remove(self, paths: List[str]):
+        """Delete files and give their bytes back to the budget."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"Could not remove {path}: {e}")
+            with self._lock:
+                self._used -= self._files.pop(path, 0)
+                self._room.notify_all()
+        self._update_gauge()
+
+    def used_bytes(self) -> int:
+        return self._used
+
+    def full(self) -> bool:
+        """True if the workspace is at or over its byte budget."""
+        return bool(self.max_bytes) and self.used_bytes() >= self.max_bytes
+
+    def _update_gauge(self):
+        WORKSPACE_BYTES.set(self.used_bytes())
+
+    def place(self, dest_dir: str) -> str:
+        """
+        Directory an export headed for dest_dir should go to: dest_dir itself
+        once there is room, or its spill counterpart. Directories outside the
+        workspace are returned unchanged.
+        """
+        if not self.max_bytes or not self._inside(dest_dir):
+            return dest_dir
+        started = time.monotonic()
+        used = self.used_bytes()
+        WORKSPACE_BYTES.set(used)
+        if used < self.max_bytes:
+            return dest_dir
+        self.waits += 1
+        logger.info(f"Workspace full ({used} of {self.max_bytes} bytes), waiting for exports to be sent")
+        with self._room:
+            self._room.wait_for(lambda: self._used < self.max_bytes, timeout=self.max_wait)
+            used = self._used
+        WORKSPACE_WAIT_SECONDS.observe(time.monotonic() - started)
+        WORKSPACE_BYTES.set(used)
+        if used < self.max_bytes:
+            return dest_dir
+        spilled = self._spill_path(dest_dir)
+        if spilled:
+            self.spills += 1
+            WORKSPACE_SPILLS.inc()
+            os.makedirs(spilled, exist_ok=True)
+            logger.warning(f"Workspace still full after {self.max_wait:.0f}s, exporting to {self.spill_root}")
+            return spilled
+        logger.warning(f"Workspace still full after {self.max_wait:.0f}s, going over WORKSPACE_MAX_BYTES")
+        return dest_dir
+
+    def sweep(self) -> int:
+        """Remove scratch directories left by processes that are no longer running."""
+        swept = 0
+        for root in (self.root, self.spill_root):
+            if not root:
+                continue
+            for entry in os.scandir(root):
+                pid, sep, _ = entry.name.partition("-")
+                if not entry.is_dir() or not sep or not pid.isdigit():
+                    continue
+                if int(pid) == os.getpid() or pid_alive(int(pid)):
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                swept += 1
+        if swept:
+            WORKSPACE_DIRS_SWEPT.inc(swept)
+            logger.info(f"Removed {swept} scratch directories left by earlier runs")
+        return swept
+
+    def close(self):
+        """Remove every scratch directory still open. Safe to call more than once."""
+        with self._lock:
+            paths = list(self._open)
+        for path in paths:
+            self.release(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            open_dirs = len(self._open)
+        return {
+            "root": self.root,
+            "spill_root": self.spill_root,
+            "used_bytes": self.used_bytes(),
+            "max_bytes": self.max_bytes,
+            "open_dirs": open_dirs,
+            "waits": self.waits,
+            "spills": self.spills,
+        }
+
+_workspace: Optional[Workspace] = None
+_workspace_lock = threading.Lock()
+
+def get_workspace() -> Workspace:
+    """Return the process-wide workspace, sweeping leftovers of crashed runs on first use."""
+    global _workspace
+    with _workspace_lock:
+        if _workspace is None:
+            if WORKSPACE_TMPFS and os.path.isdir(TMPFS_ROOT):
+                _workspace = Workspace(os.path.join(TMPFS_ROOT, "aura-frame-syncer"), spill_root=WORKSPACE_DIR)
+            else:
+                if WORKSPACE_TMPFS:
+                    logger.warning(f"WORKSPACE_TMPFS is set but {TMPFS_ROOT} does not exist; using {WORKSPACE_DIR}")
+                _workspace = Workspace()
+        return _workspace
@@ -1,15 +1,21 @@
+import argparse
 import schedule
+import threading
 import time
 import os
+import json
 from datetime import datetime
 from dotenv import load_dotenv
-from server.jobs import sync_photos_to_aura
 from clients.logger import setup_logger
+from clients.worker_client import find_worker
+
+# The sync code (Photos library, Gist, SMTP, Pillow) is imported where it is
+# first needed, and not at all while a sync worker does the work
 
 # Set up logging
 logger = setup_logger(__name__)
 
-def sync_job():
+def sync_job(export_workers=None):
     """Run the sync job for configured albums."""
     try:
         logger.info("Starting scheduled sync job")
@@ -24,40 +30,103 @@ def sync_job():
         
         logger.info(f"Syncing {len(album_names)} albums: {', '.join(album_names)}")
         
-        for album in album_names:
-            try:
-                logger.info(f"Processing album: {album}")
-                success = sync_photos_to_aura(album)
-                logger.info(f"Album '{album}' sync {'completed' if success else 'failed'}")
-            except Exception as e:
-                logger.error(f"Error syncing album '{album}': {e}")
-                continue
+        # Albums run concurrently through the shared job queue (which skips albums
+        # already queued or running and holds a per-album lock shared with the web
+        # server), sharing one tracker, library snapshot and pool of SMTP sessions
+        worker = find_worker()
+        if worker is not None:
+            # The worker has the library and tracker loaded already
+            logger.info(f"Handing the run to the sync worker at {worker.path}")
+            summary = worker.call("sync", albums=album_names, export_workers=export_workers)
+        else:
+            from server.coordinator import SyncCoordinator
+            summary = SyncCoordinator().run(album_names, export_workers=export_workers)
+            summary = summary.to_dict() if summary is not None else None
+        if summary is not None:
+            logger.info(
+                f"{summary['short_circuited']}/{len(summary['albums'])} albums unchanged since their last complete sync and skipped"
+            )
         
         logger.info("Scheduled sync job completed")
     except Exception as e:
         logger.error(f"Error in sync job: {e}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync Apple Photos albums to an Aura frame.")
+    parser.add_argument(
+        "--export-workers", type=int, default=None,
+        help="Number of photos to export in parallel (default: EXPORT_WORKERS from .env)",
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Also sync shortly after the Photos library changes (the 30 minute run stays as a safety net)",
+    )
+    parser.add_argument(
+        "--plan", action="store_true",
+        help="Show what a sync would send, with size and time estimates, without exporting or sending anything",
+    )
+    parser.add_argument(
+        "--album", action="append", default=None,
+        help="Album to plan (repeatable; default: SYNC_ALBUMS from .env)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+    parser.add_argument("--detail", type=int, default=50, help="Photos to list per album in the plan")
+    return parser.parse_args(argv)
+
+def plan(args):
+    """Print a dry-run plan of the next sync."""
+    from clients.planner import configured_albums, dry_run, format_plan
+    album_names = args.album or configured_albums()
+    if not album_names:
+        logger.warning("No albums to plan. Set SYNC_ALBUMS in .env or pass --album")
+        return
+    worker = find_worker()
+    if worker is not None:
+        result = worker.call("plan", albums=album_names, detail=args.detail)
+    else:
+        result = dry_run(album_names, detail=args.detail)
+    print(json.dumps(result, indent=2) if args.json else format_plan(result, items=args.detail > 0))
+
 def main():
     """Main function to run the scheduler."""
     load_dotenv()
+    args = parse_args()
+    if args.plan:
+        plan(args)
+        return
     
     # Log startup
     logger.info("Starting Aura Frame sync scheduler")
     logger.info("Scheduling sync job to run every 30 minutes")
     
     # Run immediately on startup
-    sync_job()
+    sync_job(export_workers=args.export_workers)
     
     # Schedule to run every 30 minutes
-    schedule.every(30).minutes.do(sync_job)
+    schedule.every(30).minutes.do(sync_job, export_workers=args.export_workers)
+    
+    # Optionally sync as soon as the library settles after a change
+    library_changed = threading.Event()
+    watcher = None
+    if args.watch:
+        from clients.library_watcher import LibraryWatcher
+        watcher = LibraryWatcher(library_changed.set)
+    if watcher is not None and not watcher.start():
+        watcher = None
     
     # Keep running
     while True:
         try:
             schedule.run_pending()
-            time.sleep(60)  # Check every minute
+            # Check every minute, or right away when the library changed
+            if library_changed.wait(60):
+                library_changed.clear()
+                logger.info("Running sync for library change")
+                sync_job(export_workers=args.export_workers)
         except KeyboardInterrupt:
             logger.info("Scheduler stopped by user")
+            if watcher is not None:
+                watcher.stop()
             break
         except Exception as e:
             logger.error(f"Error in scheduler loop: {e}")
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+from dotenv import load_dotenv
+from clients.apple_photos import EXPORT_WORKERS
+from clients.email_uploader import SMTPSessionPool
+from clients.library import get_library_manager
+from clients.logger import setup_logger
+from clients.metrics import REGISTRY
+from clients.sync_tracker import SyncTracker
+from .job_queue import SyncJobQueue, get_job_queue
+from .jobs import SyncResources
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Exports running at once across all albums of a run
+EXPORT_WORKERS_TOTAL = max(1, int(os.getenv("EXPORT_WORKERS_TOTAL", EXPORT_WORKERS)))
+
+class RunSummary:
+    """Per-album and per-destination results of one coordinated run, plus the metrics it recorded."""
+
+    def __init__(self, jobs, elapsed: float, metrics: Optional[dict] = None):
+        self.jobs = jobs
+        self.elapsed = elapsed
+        # Registry.summary() over the run: stage latencies, photos/bytes, round-trips
+        self.metrics = metrics or {}
+
+    @property
+    def results(self):
+        return [job.result for job in self.jobs if job.result is not None]
+
+    @property
+    def short_circuited(self) -> int:
+        return sum(1 for r in self.results if getattr(r, "short_circuited", False))
+
+    def albums(self) -> List[dict]:
+        rows = []
+        for job in self.jobs:
+            result = job.result
+            wall = (job.finished_at or time.time()) - (job.started_at or job.created_at)
+            sent = getattr(result, "sent", 0)
+            rows.append({
+                "album_name": job.album_name,
+                "status": job.status,
+                "short_circuited": getattr(result, "short_circuited", False),
+                "planned": getattr(result, "planned", 0),
+                "sent": sent,
+                "failed": getattr(result, "failed", 0),
+                "retried": getattr(result, "retried", 0),
+                "deduplicated": getattr(result, "deduplicated", 0),
+                "deferred": getattr(result, "deferred", 0),
+                "destinations": getattr(result, "destinations", {}),
+                "wall_seconds": round(wall, 3),
+                "photos_per_sec": round(sent / wall, 3) if wall > 0 else 0.0,
+            })
+        return rows
+
+    def destinations(self) -> List[dict]:
+        """
+        How far behind each frame is: photos still to deliver across the run's
+        albums, and how long ago the latest delivery to it was.
+        """
+        now = time.time()
+        totals = {}
+        for result in self.results:
+            for name, row in getattr(result, "destinations", {}).items():
+                total = totals.setdefault(name, {"destination": name, "sent": 0, "pending": 0, "last_synced_at": None})
+                total["sent"] += row["sent"]
+                total["pending"] += row["pending"]
+                if row["last_synced_at"] and (total["last_synced_at"] or 0) < row["last_synced_at"]:
+                    total["last_synced_at"] = row["last_synced_at"]
+        for total in totals.values():
+            last = total["last_synced_at"]
+            total["lag_seconds"] = round(now - last, 1) if last else None
+        return sorted(totals.values(), key=lambda row: row["destination"])
+
+    def to_dict(self) -> dict:
+        return {
+            "elapsed_seconds": round(self.elapsed, 3),
+            "short_circuited": self.short_circuited,
+            "albums": self.albums(),
+            "destinations": self.destinations(),
+            "metrics": self.metrics,
+        }
+
+    def log(self):
+        logger.info(f"Run finished in {self.elapsed:.1f}s:")
+        for row in self.albums():
+            note = " (unchanged, skipped)" if row["short_circuited"] else ""
+            logger.info(
+                f"- {row['album_name']}: {row['status']}{note}, {row['sent']}/{row['planned']} sent "
+                f"in {row['wall_seconds']:.1f}s ({row['photos_per_sec']:.2f} photos/s)"
+            )
+        for row in self.destinations():
+            lag = f"{row['lag_seconds']:.0f}s ago" if row["lag_seconds"] is not None else "never"
+            logger.info(
+                f"- frame {row['destination']}: {row['sent']} sent, {row['pending']} still to send, "
+                f"last delivery {lag}"
+            )
+        logger.info(f"Run metrics: {json.dumps(self.metrics, sort_keys=True)}")
+
+class SyncCoordinator:
+    """
+    Syncs several albums concurrently through the job queue.
+
+    All albums of a run share one SyncTracker, one library snapshot, one pool
+    of SMTP sessions (SMTP_MAX_SESSIONS) and EXPORT_WORKERS_TOTAL export slots.
+    A failing album is reported in the summary without holding up the others.
+    """
+
+    def __init__(self, queue: Optional[SyncJobQueue] = None, export_workers_total: Optional[int] = None,
+                 tracker_factory=None, session_pool_factory=None):
+        self.queue = queue or get_job_queue()
+        self.export_workers_total = export_workers_total or EXPORT_WORKERS_TOTAL
+        self.tracker_factory = tracker_factory or SyncTracker
+        self.session_pool_factory = session_pool_factory or SMTPSessionPool
+
+    def _resources(self) -> SyncResources:
+        return SyncResources(
+            tracker=self.tracker_factory(),
+            session_pool=self.session_pool_factory(),
+            export_slots=threading.BoundedSemaphore(self.export_workers_total),
+            snapshot=get_library_manager().get(),
+        )
+
+    def run(self, album_names: List[str], export_workers: Optional[int] = None) -> Optional[RunSummary]:
+        started = time.monotonic()
+        before = REGISTRY.snapshot()
+        try:
+            resources = self._resources()
+        except Exception as e:
+            logger.error(f"Error setting up sync run: {e}")
+            return None
+        try:
+            jobs = []
+            for album in album_names:
+                try:
+                    jobs.append(self.queue.submit(album, export_workers=export_workers, resources=resources))
+                except Exception as e:
+                    logger.error(f"Error queueing album '{album}': {e}")
+            for job in jobs:
+                job.wait()
+        finally:
+            resources.close()
+        summary = RunSummary(jobs, time.monotonic() - started, REGISTRY.summary(since=before))
+        summary.log()
+        return summary
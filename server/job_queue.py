@@ -0,0 +1,173 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from clients.logger import setup_logger
+from clients.metrics import SYNC_JOBS
+from clients.state import state_path
+from .jobs import run_sync
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Album syncs allowed to run at the same time in this process
+SYNC_MAX_CONCURRENCY = max(1, int(os.getenv("SYNC_MAX_CONCURRENCY", 3)))
+# Finished jobs kept around for the status endpoints
+SYNC_JOB_HISTORY = int(os.getenv("SYNC_JOB_HISTORY", 50))
+
+RANDOM_PHOTO_JOB = "__random_photo__"
+
+@contextmanager
+def album_lock(album_name: Optional[str]):
+    """
+    Exclusive, cross-process lock for one album, so the scheduler and the web
+    server never sync the same album at the same time.
+    """
+    name = hashlib.sha1((album_name or RANDOM_PHOTO_JOB).encode("utf-8")).hexdigest()[:16]
+    with open(state_path("locks", f"album-{name}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class SyncJob:
+    """One queued or running album sync and the progress events it has produced."""
+
+    def __init__(self, album_name: Optional[str]):
+        self.id = uuid.uuid4().hex[:12]
+        self.album_name = album_name
+        self.status = "queued"
+        self.success: Optional[bool] = None
+        self.error: Optional[str] = None
+        # Whatever the sync function returned, e.g. a SyncResult
+        self.result = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[dict] = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def publish(self, event: dict):
+        with self._lock:
+            self.events.append(dict(event, seq=len(self.events), time=time.time()))
+
+    def events_since(self, seq: int) -> List[dict]:
+        with self._lock:
+            return self.events[seq:]
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        uploaded = next((e["uploaded"] for e in reversed(self.events) if "uploaded" in e), 0)
+        return {
+            "id": self.id,
+            "album_name": self.album_name,
+            "status": self.status,
+            "success": self.success,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "uploaded": uploaded,
+            "events": len(self.events),
+            "result": self.result.to_dict() if hasattr(self.result, "to_dict") else None,
+        }
+
+class SyncJobQueue:
+    """
+    Runs album syncs in the background on a small executor.
+
+    Submitting an album that is already queued or running returns the existing
+    job instead of starting a second one, and each job additionally holds the
+    album's cross-process lock while it runs.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None,
+                 sync_func: Optional[Callable] = None):
+        self.max_concurrency = max_concurrency or SYNC_MAX_CONCURRENCY
+        self.sync_func = sync_func or run_sync
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="sync-job")
+        self._jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, album_name: Optional[str] = None, **kwargs) -> SyncJob:
+        """Queue a sync of album_name (None: random photo test) and return its job."""
+        key = album_name or RANDOM_PHOTO_JOB
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None and not active.finished:
+                logger.info(f"Sync of '{key}' already {active.status} as job {active.id}")
+                return active
+            job = SyncJob(album_name)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._trim()
+        job.publish({"type": "queued"})
+        SYNC_JOBS.inc(status="queued")
+        self._executor.submit(self._run, job, kwargs)
+        logger.info(f"Queued sync job {job.id} for '{key}'")
+        return job
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - SYNC_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: SyncJob, kwargs: dict):
+        SYNC_JOBS.dec(status="queued")
+        SYNC_JOBS.inc(status="running")
+        try:
+            with album_lock(job.album_name):
+                job.status = "running"
+                job.started_at = time.time()
+                job.publish({"type": "started"})
+                job.result = self.sync_func(job.album_name, progress=job.publish, **kwargs)
+                job.success = bool(job.result)
+            job.status = "succeeded" if job.success else "failed"
+        except Exception as e:
+            logger.error(f"Sync job {job.id} crashed: {e}")
+            job.success = False
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            SYNC_JOBS.dec(status="running")
+            job.finished_at = time.time()
+            job.publish({"type": "finished", "status": job.status})
+            job._done.set()
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[SyncJob]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+_queue: Optional[SyncJobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue() -> SyncJobQueue:
+    """Return the process-wide sync job queue."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = SyncJobQueue()
+        return _queue
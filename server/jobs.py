@@ -1,19 +1,119 @@
-from clients.apple_photos import export_random_photo, get_album_photos
-from clients.email_uploader import send_photos_via_email
+import os
+import threading
+import time
+from clients.apple_photos import export_random_photo, export_stage, order_photos, plan_album
+from clients.destinations import get_routing
+from clients.email_uploader import SMTPUploader, send_photos_via_email
+from clients.fingerprint import DEDUPE_ACROSS_ALBUMS, DEDUPE_PERCEPTUAL_DISTANCE, ContentClaims, fingerprint_keys
+from clients.frame_transform import FrameTransformer
 from clients.sync_tracker import SyncTracker
+from clients.worker_client import find_worker
+from clients.workspace import get_workspace
 from clients.logger import setup_logger
+from clients.metrics import (ALBUM_LAST_SUCCESS, ALBUM_PHOTOS_SYNCED, ALBUM_SYNC_SECONDS, DESTINATION_PENDING,
+                             PHOTOS_DEDUPLICATED, PHOTOS_DEFERRED)
+from clients.outbox import get_outbox
+from clients.pipeline import Pipeline, Stage
+from clients.planner import get_throughput_history
+from clients.send_quota import get_send_quota
 
 logger = setup_logger(__name__)
 
-def sync_photos_to_aura(album_name=None):
+class SyncResult:
+    """
+    Outcome of one album sync. Truthy when the sync succeeded.
+
+    `planned` counts photos to export; sent, failed, retried, deduplicated and
+    deferred count deliveries, so with several destinations a photo sent to
+    two frames counts twice. `destinations` breaks them down per frame.
+    """
+
+    def __init__(self, album_name, success, short_circuited=False, planned=0, sent=0, failed=0, elapsed=0.0,
+                 retried=0, deduplicated=0, deferred=0, destinations=None):
+        self.album_name = album_name
+        self.success = success
+        # True when the album was skipped because nothing changed since its last complete sync
+        self.short_circuited = short_circuited
+        self.planned = planned
+        self.sent = sent
+        self.failed = failed
+        self.elapsed = elapsed
+        # Photos among `sent` that came from the outbox rather than a fresh export
+        self.retried = retried
+        # Photos marked synced without sending, because the same image was already sent
+        self.deduplicated = deduplicated
+        # Photos left for a later run because the send quota was used up
+        self.deferred = deferred
+        # Destination name -> {"sent", "deduplicated", "failed", "deferred", "pending", "last_synced_at"}
+        self.destinations = destinations or {}
+
+    def __bool__(self):
+        return bool(self.success)
+
+    def to_dict(self) -> dict:
+        return {
+            "album_name": self.album_name,
+            "success": self.success,
+            "short_circuited": self.short_circuited,
+            "planned": self.planned,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "deduplicated": self.deduplicated,
+            "deferred": self.deferred,
+            "destinations": self.destinations,
+            "elapsed_seconds": round(self.elapsed, 3),
+        }
+
+class SyncResources:
+    """
+    Objects shared by album syncs that run together: one tracker, one library
+    snapshot, one pool of SMTP sessions, a cap on concurrent exports, the
+    outbox of failed uploads, the content being sent to each destination and
+    the album -> frames routing. The owner closes them once every album is done.
+    """
+
+    def __init__(self, tracker, session_pool=None, export_slots=None, snapshot=None, outbox=None, routing=None):
+        self.tracker = tracker
+        self.session_pool = session_pool
+        self.export_slots = export_slots
+        self.snapshot = snapshot
+        self.outbox = outbox if outbox is not None else get_outbox()
+        self.routing = routing or get_routing()
+        self._claims = {}
+        self._claims_lock = threading.Lock()
+
+    def claims(self, destination: str) -> ContentClaims:
+        """Content being sent to a destination by the albums of this run."""
+        with self._claims_lock:
+            return self._claims.setdefault(destination, ContentClaims())
+
+    def uploader(self, recipient=None):
+        """A batching uploader, sending through the shared sessions if there are any."""
+        if self.session_pool is not None:
+            return self.session_pool.uploader(recipient=recipient)
+        return SMTPUploader(recipient=recipient)
+
+    def close(self):
+        if self.session_pool is not None:
+            self.session_pool.close()
+        self.tracker.close()
+
+def sync_photos_to_aura(album_name=None, export_workers=None, progress=None, resources=None):
     """
     Sync photos to Aura frame.
     If album_name is provided, syncs unsynced photos from that album.
     Otherwise, sends a random photo for testing.
+    export_workers overrides EXPORT_WORKERS for the album export pool.
+    progress, if given, is called with a dict for every photo sent or failed.
+    resources (SyncResources) shares the tracker, SMTP sessions and export
+    slots with other albums in the same run; by default the sync creates its own.
     """
     try:
         if album_name:
             logger.info(f"Starting sync for album: {album_name}")
+            if resources is not None:
+                return _observe(_sync_album(album_name, resources, export_workers, progress))
             
             # Initialize sync tracker
             try:
@@ -22,45 +122,362 @@ def sync_photos_to_aura(album_name=None):
                 logger.error(f"Error initializing sync tracker: {e}")
                 return False
             
-            # Get unsynced photos from album
             try:
-                photo_results = get_album_photos(album_name, sync_tracker)
-                if not photo_results:
-                    logger.info(f"No new photos to sync from album '{album_name}'")
-                    return True  # Return success when there are no new photos to sync
-            except Exception as e:
-                logger.error(f"Error getting album photos: {e}")
-                return False
-            
-            # Upload photos
-            success = True
-            total = len(photo_results)
-            logger.info(f"Starting upload of {total} photos...")
-            
-            for i, (photo_uuid, photo_paths) in enumerate(photo_results, 1):
-                try:
-                    if send_photos_via_email(photo_paths):
-                        sync_tracker.mark_synced(photo_uuid, album_name)
-                        logger.info(f"Progress: {i}/{total} photos uploaded")
-                    else:
-                        logger.error(f"Failed to upload photo {i}/{total}")
-                        success = False
-                except Exception as e:
-                    logger.error(f"Error uploading photo {i}/{total}: {e}")
-                    success = False
-            
-            logger.info(f"Album sync completed. Success: {success}")
-            return success
+                return _observe(_sync_album(album_name, SyncResources(sync_tracker), export_workers, progress))
+            finally:
+                # Push the batched sync marks to the Gist before returning
+                sync_tracker.close()
         else:
             # Test mode: just send a random photo
             logger.info("Starting random photo test sync")
-            photo_paths = export_random_photo()
-            if not photo_paths:
-                logger.warning("No photos found in library.")
-                return False
-            success = send_photos_via_email(photo_paths)
+            with get_workspace().run("random_photo_") as run_dir:
+                photo_paths = export_random_photo(run_dir)
+                if not photo_paths:
+                    logger.warning("No photos found in library.")
+                    return False
+                success = send_photos_via_email(photo_paths)
             logger.info(f"Random photo sync completed. Success: {success}")
             return success
     except Exception as e:
         logger.error(f"Error during sync: {e}")
-        return False 
\ No newline at end of file
+        return False
+
+def run_sync(album_name=None, export_workers=None, progress=None, resources=None):
+    """
+    sync_photos_to_aura in the sync worker when one is running (and no
+    resources are being shared), otherwise in this process.
+    """
+    if resources is None:
+        worker = find_worker()
+        if worker is not None:
+            return worker.sync_album(album_name, progress, export_workers)
+    return sync_photos_to_aura(album_name, export_workers, progress, resources)
+
+def _observe(result):
+    """Record an album sync's wall time, photos sent and, on success, when it finished."""
+    ALBUM_SYNC_SECONDS.observe(result.elapsed, album=result.album_name)
+    if result.sent:
+        ALBUM_PHOTOS_SYNCED.inc(result.sent, album=result.album_name)
+    if result:
+        ALBUM_LAST_SUCCESS.set(time.time(), album=result.album_name)
+    return result
+
+def _remove_files(paths):
+    get_workspace().remove(paths)
+
+def _retry_outbox(album_name, destination, resources, progress=None):
+    """
+    Resend the outbox items of an album's record for one destination that are
+    due, straight from their kept files. Returns the outbox retry counts.
+    """
+    outbox = resources.outbox
+    sync_tracker = resources.tracker
+    record = destination.record(album_name)
+    due = outbox.due(record)
+    for item in due:
+        if sync_tracker.is_synced(item["photo_uuid"], record):
+            # Delivered since it was queued (e.g. by another machine)
+            outbox.remove(item["id"])
+    if not outbox.due(record, limit=1):
+        return {}
+    
+    sent = []
+    
+    def on_sent(item):
+        sync_tracker.mark_synced(item["photo_uuid"], record)
+        sent.append(item["photo_uuid"])
+        if progress:
+            progress({"type": "photo", "uuid": item["photo_uuid"], "sent": True, "uploaded": len(sent),
+                      "outbox": True, "destination": destination.name})
+    
+    uploader = resources.uploader(destination.email)
+    try:
+        return outbox.retry(uploader, on_sent, record)
+    finally:
+        uploader.close()
+
+def _sync_album(album_name, resources, export_workers=None, progress=None):
+    """
+    Stream an album through export -> upload -> mark_synced stages.
+    Uploads start as soon as the first photos are exported, several photos
+    share one message and one SMTP session, and each exported file is
+    deleted once it has been sent. Photos whose send fails go to the outbox,
+    which is retried (without exporting again) before the album is planned.
+    With DEDUPE_ACROSS_ALBUMS, photos already sent from another album, or
+    whose exported content matches a sent photo's, are marked without sending.
+    Only as many photos as the send quota allows are exported; the rest (the
+    end of SYNC_ORDER) are left unsynced for a later run rather than failed.
+    An album routed to several frames is planned per frame, but each photo is
+    exported once and goes out in one message addressed to every frame that
+    still needs it.
+    """
+    started = time.monotonic()
+    sync_tracker = resources.tracker
+    outbox = resources.outbox
+    destinations = resources.routing.for_album(album_name)
+    if not destinations:
+        logger.error(f"Album '{album_name}' is not routed to any frame")
+        return SyncResult(album_name, False, elapsed=time.monotonic() - started)
+    retried = {}
+    retry_ok = True
+    for destination in destinations:
+        retry = _retry_outbox(album_name, destination, resources, progress)
+        retried[destination.name] = retry.get("sent", 0)
+        retry_ok = retry_ok and not retry.get("failed")
+    plans = {
+        destination.name: plan_album(album_name, sync_tracker, resources.snapshot,
+                                     held=outbox.held_uuids(destination.record(album_name)),
+                                     destination=destination.name)
+        for destination in destinations
+    }
+    retried_total = sum(retried.values())
+    if all(plan.unchanged for plan in plans.values()):
+        return SyncResult(album_name, retry_ok, short_circuited=True, sent=retried_total, retried=retried_total,
+                          elapsed=time.monotonic() - started)
+    if not all(plan.found for plan in plans.values()):
+        return SyncResult(album_name, False, sent=retried_total, retried=retried_total,
+                          elapsed=time.monotonic() - started)
+    
+    # Destinations each planned photo still has to reach, in routing order
+    needed = {}
+    planned = {}
+    for destination in destinations:
+        for photo in plans[destination.name].photos:
+            needed.setdefault(photo.uuid, []).append(destination)
+            planned[photo.uuid] = photo
+    photos = order_photos(planned.values()) if len(destinations) > 1 else plans[destinations[0].name].photos
+    
+    # One uploader per set of frames, created as photos for it come along
+    uploaders = {}
+    uploaders_lock = threading.Lock()
+    
+    def uploader_for(targets):
+        key = tuple(d.name for d in targets)
+        with uploaders_lock:
+            if key not in uploaders:
+                uploaders[key] = resources.uploader([d.email for d in targets])
+            return uploaders[key]
+    
+    def quota_exhausted():
+        return any(u.quota_exhausted for u in list(uploaders.values()))
+    
+    available = get_send_quota().messages_available()
+    if available is not None:
+        # Upper bound: every message full. Albums syncing alongside share the
+        # quota, so the uploader may still run out before this.
+        budget = available * uploader_for(destinations).max_attachments
+        if len(photos) > budget:
+            logger.info(f"Send quota allows about {budget} of {len(photos)} photos from '{album_name}' now, "
+                        f"leaving {len(photos) - budget} for a later run")
+            photos = photos[:budget]
+    
+    workspace = get_workspace()
+    try:
+        run_dir = workspace.run_dir(f"album_{album_name}_")
+    except Exception as e:
+        logger.error(f"Error creating scratch directory: {e}")
+        for uploader in uploaders.values():
+            uploader.close()
+        return SyncResult(album_name, False, planned=len(planned), elapsed=time.monotonic() - started)
+    
+    # Per destination name: photos delivered, deduplicated and left for a later run
+    uploaded = {d.name: [] for d in destinations}
+    deduplicated = {d.name: [] for d in destinations}
+    quota_deferred = {d.name: [] for d in destinations}
+    for destination in destinations:
+        plan = plans[destination.name]
+        for photo_uuid in plan.duplicates:
+            sync_tracker.mark_synced(photo_uuid, destination.record(album_name))
+            deduplicated[destination.name].append(photo_uuid)
+        if plan.duplicates:
+            PHOTOS_DEDUPLICATED.inc(len(plan.duplicates), reason="album")
+    # Content fingerprints filled in by the export workers, and those of photos being sent
+    fingerprints = {} if DEDUPE_ACROSS_ALBUMS else None
+    content = {}
+    # Copies of a photo another album is sending right now: (uuid, destination, owner uuid, keys)
+    deferred = []
+    
+    def dedupe(item):
+        photo_uuid, photo_paths = item
+        keys = fingerprint_keys(fingerprints.pop(photo_uuid, None))
+        if not keys:
+            return item
+        remaining = []
+        for destination in needed[photo_uuid]:
+            owner = sync_tracker.find_duplicate(keys, DEDUPE_PERCEPTUAL_DISTANCE, destination.name)
+            if owner is None:
+                owner = resources.claims(destination.name).claim(photo_uuid, keys)
+                if owner is None:
+                    remaining.append(destination)
+                    continue
+                deferred.append((photo_uuid, destination, owner, keys))
+            else:
+                logger.info(f"Photo {photo_uuid[:8]}... has the same content as {owner[:8]}..., "
+                            f"not sending it to {destination.name} again")
+                sync_tracker.mark_synced(photo_uuid, destination.record(album_name), keys)
+                deduplicated[destination.name].append(photo_uuid)
+                PHOTOS_DEDUPLICATED.inc(reason="content")
+        needed[photo_uuid] = remaining
+        if remaining:
+            content[photo_uuid] = keys
+            return item
+        _remove_files(photo_paths)
+        return None
+    
+    def defer(photo_uuid, photo_paths):
+        # Not a delivery failure: exported again (from the cache) on a later run
+        for destination in needed[photo_uuid]:
+            quota_deferred[destination.name].append(photo_uuid)
+        _remove_files(photo_paths)
+    
+    # Bytes of each photo sent in this run, for the planner's throughput history
+    sent_bytes = []
+    
+    def sent_results(uploader, done):
+        results = []
+        for photo_uuid, photo_paths, sent in done:
+            if not sent and uploader.quota_exhausted:
+                defer(photo_uuid, photo_paths)
+                continue
+            if not sent:
+                logger.error(f"Failed to upload photo {photo_uuid[:8]}..., keeping it in the outbox")
+                for destination in needed[photo_uuid]:
+                    outbox.add(photo_uuid, destination.record(album_name), photo_paths, uploader.last_error)
+            else:
+                sent_bytes.append(sum(os.path.getsize(path) for path in photo_paths if os.path.exists(path)))
+            _remove_files(photo_paths)
+            results.append((photo_uuid, sent))
+        return results
+    
+    def upload(item):
+        photo_uuid, photo_paths = item
+        if quota_exhausted():
+            defer(photo_uuid, photo_paths)
+            return None
+        uploader = uploader_for(needed[photo_uuid])
+        results = sent_results(uploader, uploader.add(photo_uuid, photo_paths))
+        if workspace.full():
+            # Exports are waiting for room: send the batches now rather than hold their files
+            results += flush_all() or []
+        return results or None
+    
+    def flush_all():
+        results = []
+        for uploader in list(uploaders.values()):
+            results.extend(sent_results(uploader, uploader.flush()))
+        return results or None
+    
+    def flush_due():
+        # Nothing has reached the upload stage for a while: send messages that have waited long enough
+        results = []
+        for uploader in list(uploaders.values()):
+            results.extend(sent_results(uploader, uploader.flush_due()))
+        return results or None
+    
+    def next_due():
+        waits = [w for w in (u.due_in() for u in list(uploaders.values())) if w is not None]
+        return min(waits) if waits else None
+    
+    def mark(results):
+        for photo_uuid, sent in results:
+            if sent:
+                for destination in needed[photo_uuid]:
+                    sync_tracker.mark_synced(photo_uuid, destination.record(album_name), content.get(photo_uuid))
+                    uploaded[destination.name].append(photo_uuid)
+            if progress:
+                progress({"type": "photo", "uuid": photo_uuid, "sent": sent,
+                          "uploaded": retried_total + sum(len(u) for u in uploaded.values()),
+                          "destinations": [d.name for d in needed[photo_uuid]]})
+        logger.info(f"Progress: {sum(len(u) for u in uploaded.values())}/{len(photos)} photos uploaded")
+        return results
+    
+    stages = [export_stage(run_dir, export_workers, resources.export_slots, fingerprints)]
+    if fingerprints is not None:
+        stages.append(Stage("dedupe", dedupe))
+    transformer = FrameTransformer()
+    if transformer.enabled:
+        stages.append(Stage("transform", transformer.transform, workers=transformer.workers, ordered=True))
+    stages += [
+        Stage("upload", upload, on_finish=flush_all, on_idle=flush_due, idle_timeout=next_due),
+        Stage("mark_synced", mark),
+    ]
+    
+    pipeline = Pipeline(f"sync:{album_name}", photos, stages)
+    run_started = time.monotonic()
+    try:
+        batches = pipeline.run()
+        get_throughput_history().record(len(sent_bytes), sum(sent_bytes), time.monotonic() - run_started)
+    finally:
+        # Batches still queued when the pipeline stops early are sent on close; mark those too
+        closed = []
+        for uploader in uploaders.values():
+            closed += sent_results(uploader, uploader.close())
+        if closed:
+            mark(closed)
+        transformer.close()
+        workspace.release(run_dir)
+    if transformer.files:
+        logger.info(f"Resized for frame: {transformer.format_stats()}")
+    results = [result for batch in batches for result in batch]
+    if deferred:
+        # Copies whose twin was being sent by another album: settled if that send went through
+        for photo_uuid, destination, owner, keys in deferred:
+            if owner in sync_tracker.synced_anywhere(destination.name):
+                sync_tracker.mark_synced(photo_uuid, destination.record(album_name), keys)
+                deduplicated[destination.name].append(photo_uuid)
+                PHOTOS_DEDUPLICATED.inc(reason="content")
+    
+    if not results:
+        logger.info(f"No new photos to sync from album '{album_name}'")
+    
+    messages = sum(u.messages_sent for u in uploaders.values())
+    logger.info(f"Sent {sum(1 for _, sent in results if sent)} photos from '{album_name}' in {messages} messages")
+    # Photos the quota kept out of this run, per destination
+    left_out = set(planned) - {p.uuid for p in photos}
+    summary = {}
+    for destination in destinations:
+        name = destination.name
+        plan = plans[name]
+        if plan.unchanged:
+            summary[name] = {"sent": retried[name], "deduplicated": 0, "failed": 0, "deferred": 0, "pending": 0,
+                             "last_synced_at": sync_tracker.last_synced_at(destination.record(album_name))}
+            continue
+        wanted = len(plan.photos) + len(plan.duplicates)
+        done = len(uploaded[name]) + len(deduplicated[name])
+        deferred_count = sum(1 for p in plan.photos if p.uuid in left_out) + len(quota_deferred[name])
+        if done == wanted and not plan.held and plan.fingerprint:
+            # Everything in the album reached this frame; later runs can skip it until it changes
+            sync_tracker.set_album_fingerprint(destination.record(album_name), dict(plan.fingerprint, complete=True))
+        pending = wanted - done + plan.held
+        DESTINATION_PENDING.set(pending, album=album_name, destination=name)
+        summary[name] = {
+            "sent": retried[name] + len(uploaded[name]),
+            "deduplicated": len(deduplicated[name]),
+            "failed": wanted - done - deferred_count,
+            "deferred": deferred_count,
+            "pending": pending,
+            "last_synced_at": sync_tracker.last_synced_at(destination.record(album_name)),
+        }
+        if len(destinations) > 1:
+            logger.info(f"- {name}: {summary[name]['sent']} sent, {summary[name]['deduplicated']} already there, "
+                        f"{pending} still to send")
+    deduplicated_total = sum(row["deduplicated"] for row in summary.values())
+    deferred_total = sum(row["deferred"] for row in summary.values())
+    if deduplicated_total:
+        logger.info(f"Skipped {deduplicated_total} photos from '{album_name}' already sent from elsewhere")
+    if deferred_total:
+        logger.info(f"Left {deferred_total} photos from '{album_name}' for a later run (send quota)")
+        PHOTOS_DEFERRED.inc(deferred_total)
+    success = retry_ok and all(sent for _, sent in results)
+    logger.info(f"Album sync completed. Success: {success}")
+    return SyncResult(
+        album_name, success,
+        planned=len(planned),
+        sent=sum(row["sent"] for row in summary.values()),
+        failed=sum(row["failed"] for row in summary.values()),
+        elapsed=time.monotonic() - started,
+        retried=retried_total,
+        deduplicated=deduplicated_total,
+        deferred=deferred_total,
+        destinations=summary,
+    )
@@ -1,11 +1,21 @@
-from fastapi import FastAPI, Request, Form, Path
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
+from fastapi import FastAPI, Request, Form, Path, Query, HTTPException
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, StreamingResponse, PlainTextResponse, Response, JSONResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+import asyncio
+import hashlib
+import json
 import os
-from .jobs import sync_photos_to_aura
-from clients.apple_photos import list_all_person_names, get_sample_photos_for_person, list_albums
-import glob
+from typing import List
+from .job_queue import get_job_queue
+from clients.album_catalog import get_album_catalog
+from clients.apple_photos import list_persons, person_photos, photos_by_uuid
+from clients.library import get_library_manager
+from clients.metrics import REGISTRY
+from clients.outbox import get_outbox
+from clients.planner import dry_run
+from clients.worker_client import find_worker
+from clients.send_quota import get_send_quota
+from clients.thumbnails import get_thumbnail_service
 
 app = FastAPI()
 
@@ -14,50 +24,180 @@ TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
 os.makedirs(TEMPLATES_DIR, exist_ok=True)
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
-# Serve static files from temp dirs for sample images
-temp_sample_dirs = []
+# Albums listed per dashboard page
+ALBUMS_PER_PAGE = int(os.getenv("DASHBOARD_ALBUMS_PER_PAGE", 50))
+
+# Versioned thumbnail URLs never change content, so browsers may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def conditional_response(request: Request, etag: str, render, cache_control: str = "private, no-cache",
+                         vary: str = None):
+    """
+    Answer 304 Not Modified when the client's If-None-Match holds etag,
+    otherwise `render()` with the ETag attached. By default clients must
+    revalidate every time, so a changed page is never served from their cache.
+    """
+    tag = f'W/"{etag}"'
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+    if vary:
+        headers["Vary"] = vary
+    sent = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+    if tag in sent or tag[2:] in sent or "*" in sent:
+        return Response(status_code=304, headers=headers)
+    response = render()
+    response.headers.update(headers)
+    return response
 
 @app.get("/", response_class=HTMLResponse)
-def dashboard(request: Request, sync_status: str = None):
-    albums = list_albums()
-    return templates.TemplateResponse(
-        "dashboard.html",
-        {
-            "request": request,
-            "sync_status": sync_status,
-            "albums": albums
-        }
+def dashboard(request: Request, sync_status: str = None, job_id: str = None, q: str = None, page: int = 1):
+    albums = get_album_catalog().page(q, page, ALBUMS_PER_PAGE)
+    job = get_job_queue().get(job_id) if job_id else None
+    context = {
+        "sync_status": sync_status,
+        "albums": albums,
+        "job": job.to_dict() if job else None,
+        "outbox": get_outbox().stats(),
+        "quota": get_send_quota().stats(),
+    }
+    etag = hashlib.sha1(json.dumps(context, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return conditional_response(
+        request, etag, lambda: templates.TemplateResponse("dashboard.html", dict(context, request=request))
     )
 
+@app.get("/albums")
+def albums(request: Request, q: str = None, page: int = 1, per_page: int = ALBUMS_PER_PAGE):
+    result = get_album_catalog().page(q, page, per_page)
+    etag = hashlib.sha1(json.dumps(result, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return conditional_response(request, etag, lambda: JSONResponse(result))
+
 @app.post("/sync")
 def manual_sync(request: Request, album_name: str = Form(None)):
-    if album_name:
-        success = sync_photos_to_aura(album_name=album_name)
-        status = f"Sync completed successfully for album '{album_name}!" if success else f"Sync failed for album '{album_name}'."
-    else:
-        # Test mode with random photo
-        success = sync_photos_to_aura()
-        status = "Random photo sync completed successfully!" if success else "Sync failed."
-    
-    url = f"/?sync_status={status}"
-    return RedirectResponse(url, status_code=303)
+    # album_name=None queues the random photo test
+    job = get_job_queue().submit(album_name or None)
+    return RedirectResponse(f"/?job_id={job.id}", status_code=303)
+
+@app.post("/jobs", status_code=202)
+def create_job(album_name: str = Form(None)):
+    job = get_job_queue().submit(album_name or None)
+    return job.to_dict()
+
+@app.get("/jobs")
+def list_jobs():
+    return [job.to_dict() for job in get_job_queue().jobs()]
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return dict(job.to_dict(), recent_events=job.events[-20:])
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream of a job's progress, ending when the job finishes."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        seq = 0
+        while True:
+            finished = job.finished
+            for event in job.events_since(seq):
+                seq = event["seq"] + 1
+                yield f"data: {json.dumps(event)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/outbox")
+def outbox_items(status: str = None, limit: int = 100):
+    outbox = get_outbox()
+    return {"stats": outbox.stats(), "items": outbox.items(status, limit)}
+
+@app.post("/outbox/requeue")
+def outbox_requeue(item_id: int = Form(None)):
+    """Give dead-lettered uploads (one, or all) another round of retries."""
+    count = get_outbox().requeue(item_id)
+    return RedirectResponse(f"/?sync_status=Requeued {count} outbox item(s)", status_code=303)
+
+@app.post("/outbox/{item_id}/discard")
+def outbox_discard(item_id: int):
+    if not get_outbox().remove(item_id):
+        raise HTTPException(status_code=404, detail="Unknown outbox item")
+    return {"discarded": item_id}
+
+@app.get("/quota")
+def send_quota():
+    """Send quota limits, what is left of each window and when the next message may go out."""
+    return get_send_quota().stats()
+
+@app.get("/plan")
+def sync_plan(album: List[str] = Query(None), detail: int = 50):
+    """What a sync of the given albums (SYNC_ALBUMS by default) would send, without sending anything."""
+    worker = find_worker()
+    if worker is not None:
+        return worker.call("plan", albums=album, detail=max(0, detail))
+    return dry_run(album, detail=max(0, detail))
+
+@app.get("/worker")
+def worker_status():
+    """Whether a sync worker is taking this server's syncs, and its stats."""
+    worker = find_worker()
+    stats = worker.ping() if worker is not None else None
+    return {"running": stats is not None, "socket": worker.path if worker else None, "stats": stats}
+
+@app.get("/library/stats")
+def library_stats():
+    return get_library_manager().stats()
 
 @app.get("/faces", response_class=HTMLResponse)
 def faces(request: Request):
-    person_names = list_all_person_names()
-    return templates.TemplateResponse("faces.html", {"request": request, "person_names": person_names})
+    persons = list_persons()
+    return templates.TemplateResponse("faces.html", {"request": request, "persons": persons})
 
 @app.get("/faces/{person_name}", response_class=HTMLResponse)
-def face_samples(request: Request, person_name: str = Path(...)):
-    sample_paths = get_sample_photos_for_person(person_name)
-    # Register temp dir for static serving
-    if sample_paths:
-        temp_dir = os.path.dirname(sample_paths[0])
-        if temp_dir not in temp_sample_dirs:
-            app.mount(f"/samples/{os.path.basename(temp_dir)}", StaticFiles(directory=temp_dir), name=f"samples-{os.path.basename(temp_dir)}")
-            temp_sample_dirs.append(temp_dir)
-        # Convert to URLs for browser
-        sample_urls = [f"/samples/{os.path.basename(temp_dir)}/{os.path.basename(p)}" for p in sample_paths]
-    else:
-        sample_urls = []
-    return templates.TemplateResponse("face_samples.html", {"request": request, "person_name": person_name, "sample_urls": sample_urls}) 
\ No newline at end of file
+def face_samples(request: Request, person_name: str = Path(...), limit: int = 10, newest: bool = True,
+                 size: int = None):
+    # Only links to thumbnails; the browser fetches (and the service renders) them in parallel
+    service = get_thumbnail_service()
+    size = service.clamp_size(size)
+    sample_urls = [
+        f"/thumbs/{photo.uuid}?size={size}&v={service.version(photo)}"
+        for photo in person_photos(person_name, limit=limit, newest=newest)
+    ]
+    return templates.TemplateResponse("face_samples.html", {"request": request, "person_name": person_name, "sample_urls": sample_urls})
+
+@app.get("/thumbs/stats")
+def thumbnail_stats():
+    return get_thumbnail_service().stats()
+
+@app.get("/thumbs/{photo_uuid}")
+def thumbnail(request: Request, photo_uuid: str, size: int = None, v: str = None):
+    """
+    A downsized copy of a library photo, WebP when the browser accepts it.
+    Requested with the photo's current version (`v`) the response is cached
+    for good; otherwise the browser revalidates with the ETag.
+    """
+    photos = photos_by_uuid([photo_uuid])
+    if not photos:
+        raise HTTPException(status_code=404, detail="Unknown photo")
+    photo = photos[0]
+    service = get_thumbnail_service()
+    formats = service.formats()
+    fmt = "webp" if "webp" in formats and "image/webp" in request.headers.get("accept", "") else "jpeg"
+    thumb = service.get(photo, size, fmt)
+    if thumb is None:
+        raise HTTPException(status_code=404, detail="Photo could not be exported")
+    cache_control = IMMUTABLE if v and v == service.version(photo) else "public, no-cache"
+    return conditional_response(
+        request, thumb.etag, lambda: FileResponse(thumb.path, media_type=thumb.media_type),
+        cache_control=cache_control, vary="Accept" if len(formats) > 1 else None,
+    )
@@ -0,0 +1,205 @@
+"""
+Long-lived sync worker.
+
+Keeps the Photos library snapshot, the sync tracker and the imported sync
+code warm between runs, and takes sync and plan requests from the scheduler
+and the web server over a Unix socket (WORKER_SOCKET). Either of them works
+on its own, in-process, while no worker is running.
+
+    python -m server.worker
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from clients.library import get_library_manager
+from clients.logger import setup_logger
+from clients.planner import configured_albums, plan_sync
+from clients.sync_tracker import SyncTracker
+from clients.worker_client import WORKER_SOCKET
+from .coordinator import SyncCoordinator
+from .jobs import SyncResources, sync_photos_to_aura
+
+load_dotenv()
+logger = setup_logger(__name__)
+
+# Seconds a tracker is reused before the Gist is loaded again, picking up
+# marks written from other machines
+WORKER_TRACKER_TTL = float(os.getenv("WORKER_TRACKER_TTL", 3600))
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+        self._gone = False
+
+    def _send(self, message: dict):
+        # Progress comes from the sync's pipeline threads; a client that went
+        # away must not fail the sync
+        with self._write_lock:
+            if self._gone:
+                return
+            try:
+                self.wfile.write(json.dumps(message, default=str).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            except OSError:
+                self._gone = True
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self._send({"error": "Request is not valid JSON"})
+            return
+        try:
+            result = self.server.worker.handle(request, lambda event: self._send({"event": event}))
+        except Exception as e:
+            logger.error(f"Worker request {request.get('op')!r} failed: {e}")
+            self._send({"error": str(e)})
+            return
+        self._send({"result": result})
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class SyncWorker:
+    """
+    Serves sync and plan requests from one process, so the library snapshot
+    and the sync tracker (with its Gist state) are loaded once rather than by
+    every scheduled run and web request.
+    """
+
+    def __init__(self, path: Optional[str] = None, tracker_factory=None, tracker_ttl: Optional[float] = None):
+        self.path = path or WORKER_SOCKET
+        self.tracker_factory = tracker_factory or SyncTracker
+        self.tracker_ttl = WORKER_TRACKER_TTL if tracker_ttl is None else tracker_ttl
+        self.started_at = time.time()
+        self.requests = 0
+        self._tracker = None
+        self._tracker_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def tracker(self):
+        """The shared tracker, loaded again once it is older than tracker_ttl."""
+        with self._lock:
+            if self._tracker is not None and time.monotonic() - self._tracker_loaded_at > self.tracker_ttl:
+                # Syncs still holding the old tracker keep using it; closing only flushes
+                self._tracker.close()
+                self._tracker = None
+            if self._tracker is None:
+                self._tracker = self.tracker_factory()
+                self._tracker_loaded_at = time.monotonic()
+            return self._tracker
+
+    def warm(self):
+        """Load the library snapshot and the tracker ahead of the first request."""
+        started = time.monotonic()
+        try:
+            get_library_manager().get()
+            self.tracker()
+        except Exception as e:
+            logger.error(f"Worker warm-up failed, loading on first request instead: {e}")
+            return
+        logger.info(f"Worker warm in {time.monotonic() - started:.1f}s")
+
+    def handle(self, request: dict, event=None):
+        op = request.get("op")
+        with self._lock:
+            self.requests += 1
+        if op == "ping":
+            return self.stats()
+        if op == "sync":
+            # A scheduled run: albums through the job queue, which takes the album locks
+            summary = SyncCoordinator(tracker_factory=self.tracker).run(
+                request.get("albums") or configured_albums(), export_workers=request.get("export_workers"),
+            )
+            return summary.to_dict() if summary is not None else None
+        if op == "sync_album":
+            # One album for the web server's job queue, which holds the album lock already
+            album_name = request.get("album")
+            resources = SyncResources(self.tracker(), snapshot=get_library_manager().get()) if album_name else None
+            try:
+                result = sync_photos_to_aura(album_name, export_workers=request.get("export_workers"),
+                                             progress=event, resources=resources)
+            finally:
+                if resources is not None:
+                    resources.close()
+            return result.to_dict() if hasattr(result, "to_dict") else {"album_name": album_name,
+                                                                        "success": bool(result)}
+        if op == "plan":
+            return plan_sync(request.get("albums") or configured_albums(), self.tracker(),
+                             detail=int(request.get("detail", 50)))
+        raise ValueError(f"Unknown worker request {op!r}")
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "tracker_age_seconds": round(time.monotonic() - self._tracker_loaded_at, 1) if self._tracker else None,
+            "library": get_library_manager().stats(),
+        }
+
+    def _claim_socket(self):
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            # Left behind by a worker that died
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"Another worker is already listening on {self.path}")
+
+    def serve(self):
+        """Listen on the socket until shutdown()."""
+        self._claim_socket()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._server = _Server(self.path, _Handler)
+        self._server.worker = self
+        os.chmod(self.path, 0o600)
+        threading.Thread(target=self.warm, name="worker-warm", daemon=True).start()
+        logger.info(f"Sync worker listening on {self.path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            with self._lock:
+                if self._tracker is not None:
+                    self._tracker.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep syncs warm for the scheduler and the web server.")
+    parser.add_argument("--socket", default=None, help="Unix socket to listen on (default: WORKER_SOCKET)")
+    args = parser.parse_args(argv)
+    worker = SyncWorker(args.socket)
+    # launchd stops the worker with SIGTERM: exit normally, so the socket is
+    # removed, the tracker flushed and the workspace cleaned up (atexit)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        worker.serve()
+    except KeyboardInterrupt:
+        logger.info("Sync worker stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from datetime import datetime
+from types import SimpleNamespace
+from clients.library import LibrarySnapshot
+from clients.person_index import PersonIndex
+
+def _snapshot(photos, generation):
+    db = SimpleNamespace(photos=lambda: photos)
+    return LibrarySnapshot(db, ("Photos.sqlite", generation, 0), generation, 0.0)
+
+def test_renamed_person_on_unmodified_photo_is_picked_up(tmp_path):
+    photo = SimpleNamespace(uuid="u1", date=datetime(2020, 1, 1), date_modified=None, persons=["_UNKNOWN_"])
+    other = SimpleNamespace(uuid="u2", date=datetime(2021, 1, 1), date_modified=None, persons=["Ann"])
+    index = PersonIndex(str(tmp_path / "person_index.json"))
+    index.update(_snapshot([photo, other], 1))
+    assert index.uuids_for("Bob") == []
+
+    # Naming the face in Photos leaves date_modified alone
+    photo.persons = ["Bob"]
+    index.update(_snapshot([photo, other], 2))
+    assert index.uuids_for("Bob") == ["u1"]
+    assert "_UNKNOWN_" not in index.names()
+
+    # A fresh index loaded from disk sees the same
+    reloaded = PersonIndex(str(tmp_path / "person_index.json"))
+    assert reloaded.uuids_for("Bob") == ["u1"]
@@ -0,0 +1,92 @@
+import threading
+import time
+from clients.pipeline import Pipeline, Stage
+
+def test_ordered_stage_moves_past_items_dropped_upstream():
+    def first(item):
+        # Finish out of order, and drop one item
+        time.sleep(0.01 * (item % 3))
+        return None if item == 3 else item
+
+    def second(item):
+        time.sleep(0.01 * (item % 2))
+        return item * 10
+
+    pipeline = Pipeline("test", range(10), [
+        Stage("first", first, workers=4, ordered=True),
+        Stage("second", second, workers=2, ordered=True),
+    ])
+    assert pipeline.run() == [0, 10, 20, 40, 50, 60, 70, 80, 90]
+    assert pipeline.stages[1]._held == {}
+
+def test_ordered_stage_after_unordered_drops():
+    pipeline = Pipeline("test", range(6), [
+        Stage("filter", lambda item: item if item % 2 else None),
+        Stage("double", lambda item: item * 2, workers=3, ordered=True),
+    ])
+    assert pipeline.run() == [2, 6, 10]
+
+def test_idle_stage_lets_its_batch_go_while_upstream_is_slow():
+    batch = []
+    started = []
+    arrivals = []
+
+    def slow_source():
+        for item in range(3):
+            yield item
+            time.sleep(0.3)
+
+    def buffer(item):
+        if not batch:
+            started.append(time.monotonic())
+        batch.append(item)
+
+    def due_in():
+        return max(0.0, started[-1] + 0.05 - time.monotonic()) if batch else None
+
+    def release():
+        items = list(batch)
+        batch.clear()
+        return items
+
+    def collect(items):
+        arrivals.append((time.monotonic(), items))
+        return items
+
+    begun = time.monotonic()
+    results = Pipeline("test", slow_source(), [
+        Stage("buffer", buffer, on_finish=lambda: release() or None, on_idle=release, idle_timeout=due_in),
+        Stage("collect", collect),
+    ]).run()
+
+    # Each item went out on its own, long before the source finished
+    assert results == [[0], [1], [2]]
+    assert arrivals[0][0] - begun < 0.25
+
+def test_ordered_stage_keeps_working_while_downstream_is_full():
+    gate = threading.Event()
+    processed = []
+
+    def first(item):
+        # Item 3 is slow, so the items after it are held for ordering
+        time.sleep(0.3 if item == 3 else 0)
+        processed.append(item)
+        return item
+
+    def second(item):
+        gate.wait(5)
+        return item
+
+    pipeline = Pipeline("test", range(20), [
+        Stage("first", first, workers=3, ordered=True),
+        Stage("second", second),
+    ], queue_size=1)
+    runner = threading.Thread(target=lambda: processed.append(pipeline.run()))
+    runner.start()
+    time.sleep(0.8)
+    done_while_blocked = len(processed)
+    gate.set()
+    runner.join(5)
+    # Only workers with a run to pass on wait for room downstream
+    assert done_while_blocked >= 15
+    assert processed[-1] == list(range(20))
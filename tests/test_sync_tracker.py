@@ -0,0 +1,94 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from benchmarks.fakes import FakeGithub
+from clients.sync_tracker import SyncTracker
+
+LEGACY = {"synced_photos": {"u1": {"album": "Fam", "synced_at": "2024-01-01T00:00:00"}}}
+
+def test_read_only_tracker_leaves_sync_state_alone(tmp_path):
+    gh = FakeGithub({"synced_photos.json": json.dumps(LEGACY)})
+    journal = tmp_path / "journal.jsonl"
+    journal.write_text(json.dumps({"uuid": "u2", "album": "Fam", "synced_at": "2024-01-02T00:00:00"}) + "\n")
+    before = journal.read_text()
+
+    tracker = SyncTracker(github_client=gh, journal_path=str(journal), read_only=True)
+    # Sees the legacy file and the unflushed journal...
+    assert tracker.synced_uuids("Fam") == {"u1", "u2"}
+    tracker.close()
+    with pytest.raises(RuntimeError):
+        tracker.mark_synced("u3", "Fam")
+
+    # ...without migrating, flushing or touching the journal
+    assert gh.writes == 0
+    assert journal.read_text() == before
+
+    writer = SyncTracker(github_client=gh, journal_path=str(journal))
+    writer.close()
+    assert gh.writes > 0
+
+class SlowGithub(FakeGithub):
+    """Holds every Gist read until `release` is set, once `slow` is."""
+
+    def __init__(self):
+        super().__init__()
+        self.slow = threading.Event()
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def get_gist(self, gist_id):
+        if self.slow.is_set():
+            self.reading.set()
+            self.release.wait(5)
+        return super().get_gist(gist_id)
+
+def test_marks_are_not_held_up_by_a_flush(tmp_path):
+    gh = SlowGithub()
+    tracker = SyncTracker(github_client=gh, journal_path=str(tmp_path / "journal.jsonl"), flush_every=1000)
+    tracker.mark_synced("u1", "Fam")
+    gh.slow.set()
+    flusher = threading.Thread(target=tracker.flush)
+    flusher.start()
+    assert gh.reading.wait(5)
+
+    # The flush is waiting on the Gist; marking doesn't wait for it
+    started = time.monotonic()
+    tracker.mark_synced("u2", "Fam")
+    assert time.monotonic() - started < 1
+    assert tracker.is_synced("u2", "Fam")
+    gh.release.set()
+    flusher.join(5)
+
+    # u1 went out with that flush, u2 stays pending and journaled for the next
+    assert [mark[0] for mark in tracker._pending] == ["u2"]
+    assert [json.loads(line)["uuid"] for line in open(tmp_path / "journal.jsonl")] == ["u2"]
+    gh.slow.clear()
+    tracker.close()
+    assert SyncTracker(github_client=gh, journal_path=str(tmp_path / "other.jsonl"), read_only=True) \
+        .synced_uuids("Fam") == {"u1", "u2"}
+
+def test_journal_marks_of_a_live_process_are_left_to_it(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    live = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    try:
+        journal.write_text(
+            json.dumps({"uuid": "u1", "album": "Fam", "synced_at": "2024-01-01T00:00:00", "pid": live.pid}) + "\n"
+            + json.dumps({"uuid": "u2", "album": "Fam", "synced_at": "2024-01-01T00:00:00", "pid": dead.pid}) + "\n"
+        )
+        tracker = SyncTracker(github_client=FakeGithub(), journal_path=str(journal), flush_every=1000)
+        # Both count as sent, but only the dead process's mark is taken over
+        assert tracker.synced_uuids("Fam") == {"u1", "u2"}
+        assert [m[0] for m in tracker._pending] == ["u2"]
+        owners = {json.loads(line)["uuid"]: json.loads(line)["pid"] for line in journal.read_text().splitlines()}
+        assert owners == {"u1": live.pid, "u2": os.getpid()}
+        tracker.close()
+        assert [json.loads(line)["uuid"] for line in journal.read_text().splitlines()] == ["u1"]
+    finally:
+        live.kill()
+        live.wait()
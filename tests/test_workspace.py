@@ -0,0 +1,31 @@
+import os
+from clients.workspace import Workspace
+
+def _write(path, size):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+def test_budget_is_counted_without_walking_the_workspace(tmp_path, monkeypatch):
+    workspace = Workspace(str(tmp_path / "ws"), max_bytes=1000, max_wait=0)
+    run_dir = workspace.run_dir()
+    first = workspace.track([_write(os.path.join(run_dir, "a.jpg"), 600)])
+    workspace.track([_write(os.path.join(run_dir, "b.jpg"), 500)])
+    # Hard links share their blocks with the export cache
+    cached = _write(str(tmp_path / "cached.jpg"), 5000)
+    linked = os.path.join(run_dir, "c.jpg")
+    os.link(cached, linked)
+    workspace.track([linked])
+
+    monkeypatch.setattr(os, "walk", lambda *a, **k: (_ for _ in ()).throw(AssertionError("walked")))
+    assert workspace.used_bytes() == 1100
+    assert workspace.full()
+    workspace.remove(first)
+    assert not os.path.exists(first[0])
+    assert workspace.used_bytes() == 500
+    assert not workspace.full()
+    assert workspace.place(run_dir) == run_dir
+
+    workspace.release(run_dir)
+    assert workspace.used_bytes() == 0
+    assert not os.path.exists(run_dir)